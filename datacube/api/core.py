@@ -2,30 +2,49 @@
 #
 # Copyright (c) 2015-2020 ODC Contributors
 # SPDX-License-Identifier: Apache-2.0
+import abc
+import functools
+import logging
+import math
 import uuid
+import weakref
+import threading
 import collections.abc
+import itertools
+import operator
 from itertools import groupby
 from typing import Union, Optional, Dict, Tuple
 import datetime
+from time import monotonic
 
 import numpy
+import toolz
 import xarray
+import dask
 from dask import array as da
+from dask.highlevelgraph import HighLevelGraph, Layer, MaterializedLayer
+from dask.utils import parse_bytes
 
 from datacube.config import LocalConfig
 from datacube.storage import reproject_and_fuse, BandInfo
+from datacube.storage._load import output_allocator, LoadMetrics
+from datacube.storage._rio import shared_file_handles, stacked_reads
 from datacube.utils import ignore_exceptions_if
 from datacube.utils import geometry
 from datacube.utils.dates import normalise_dt
 from datacube.utils.geometry import intersects, GeoBox
 from datacube.utils.geometry.gbox import GeoboxTiles
 from datacube.model.utils import xr_apply
+from datacube.index.eo3 import norm_grid
 
 from .query import Query, query_group_by, query_geopolygon
 from ..index import index_connect
 from ..drivers import new_datasource
 
 
+_LOG = logging.getLogger(__name__)
+
+
 class TerminateCurrentLoad(Exception):
     """ This exception is raised by user code from `progress_cbk`
         to terminate currently running `.load`
@@ -33,6 +52,194 @@ class TerminateCurrentLoad(Exception):
     pass
 
 
+class _LazyLoadProgress(object):
+    """ Progress reporting, load metrics and cooperative cancellation for dask backed loads.
+
+    One instance is shared by all chunk tasks of a load, tasks running in the process that
+    constructed it (local threaded or synchronous scheduler) call ``cbk`` and add to ``metrics``
+    directly. Copies sent to other processes keep cancellation state, but report nothing, unless
+    ``name`` is given: then copies running on ``dask.distributed`` workers send progress and
+    metrics of every finished task to a ``distributed.Queue`` of that name, which the constructing
+    process relays to ``cbk`` and ``metrics`` (see :meth:`listen`), and cancellation is shared
+    via a ``distributed.Event`` of the same name, checked at most every ``_CANCEL_CHECK_INTERVAL``
+    seconds by every copy.
+    """
+
+    def __init__(self, cbk, n_total, name=None, metrics=None):
+        self._cbk = cbk
+        self._n = 0
+        self._n_total = n_total
+        self._name = name
+        self._metrics = metrics
+        self._remote = False
+        self._pending = 0  # sources processed by a remote copy, not yet reported
+        self._checked = None  # when a remote copy last checked for cancellation
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._finished = threading.Event()
+        self._attrs = None  # attributes of the Dataset returned by load, marked on cancel
+
+    @property
+    def cancelled(self):
+        if not self._cancelled and self._remote and self._name is not None:
+            now = monotonic()
+            if self._checked is None or now - self._checked >= _CANCEL_CHECK_INTERVAL:
+                self._checked = now
+                self._cancelled = _load_event(self._name).is_set()
+        return self._cancelled
+
+    @property
+    def done(self):
+        return self._n >= self._n_total
+
+    def track(self, attrs):
+        """ Set ``dc_partial_load`` in ``attrs`` when load is cancelled.
+        """
+        self._attrs = attrs
+        if self._cancelled:
+            attrs['dc_partial_load'] = True
+
+    def cancel(self):
+        self._cancelled = True
+        if self._attrs is not None:
+            self._attrs['dc_partial_load'] = True
+        if self._name is not None:
+            _load_event(self._name).set()
+        self._finished.set()
+
+    def wait(self, timeout=None):
+        """ Block until all sources are processed or load is cancelled.
+
+        :returns: ``False`` on timeout
+        """
+        return self._finished.wait(timeout)
+
+    def task_done(self, metrics=None):
+        """ Called by every chunk task once it's done, with counts collected by the task.
+        """
+        if not self._remote:
+            if metrics is not None and self._metrics is not None:
+                self._metrics.update(metrics)
+            return
+
+        if self._name is not None:
+            with self._lock:
+                n, self._pending = self._pending, 0
+            _load_queue(self._name).put((n, None if metrics is None else metrics.to_dict()))
+
+    def report(self, n, metrics=None):
+        """ Account for ``n`` sources and ``metrics`` reported by a remote task.
+        """
+        if metrics is not None and self._metrics is not None:
+            self._metrics.update(metrics)
+        if self._cancelled:
+            return
+        for _ in range(n):
+            self()
+
+    def listen(self, client):
+        """ Relay progress and metrics reported by tasks running on workers of ``client``.
+
+        Runs in a background thread until all sources are processed, or, once load is cancelled,
+        until this object is garbage collected, as tasks still to run need to see cancellation.
+        """
+        from distributed import Event, Queue
+
+        queue = Queue(self._name, client=client)
+        event = Event(self._name, client=client)
+        threading.Thread(target=_relay_progress, args=(weakref.ref(self), queue, event), daemon=True).start()
+
+    def __call__(self, *ignored):
+        if self._remote:
+            if self.cancelled:
+                raise TerminateCurrentLoad()
+            with self._lock:
+                self._pending += 1
+            return None
+
+        with self._lock:
+            if self._cancelled:
+                raise TerminateCurrentLoad()
+
+            self._n += 1
+            try:
+                out = None if self._cbk is None else self._cbk(self._n, self._n_total)
+            except TerminateCurrentLoad:
+                self.cancel()
+                raise
+
+            if self.done:
+                self._finished.set()
+            return out
+
+    def __getstate__(self):
+        return dict(n_total=self._n_total, name=self._name, cancelled=self._cancelled)
+
+    def __setstate__(self, state):
+        self.__init__(None, state['n_total'], state['name'])
+        self._remote = True
+        self._cancelled = state['cancelled']
+
+
+# seconds between checks of the shared cancellation flag by remote copies of _LazyLoadProgress
+_CANCEL_CHECK_INTERVAL = 0.5
+
+
+def _distributed_client():
+    """ Default ``dask.distributed`` client, ``None`` if there isn't one.
+    """
+    try:
+        from distributed import default_client
+        return default_client()
+    except (ImportError, ValueError):
+        return None
+
+
+def _load_event(name):
+    from distributed import Event
+    return Event(name)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_queue(name):
+    """ Progress queue of a load, connected once in every worker process.
+    """
+    from distributed import Queue
+    return Queue(name)
+
+
+def _relay_progress(ref, queue, event):
+    from distributed.utils import TimeoutError  # pylint: disable=redefined-builtin
+
+    try:
+        while True:
+            try:
+                reports = [queue.get(timeout=1)] + queue.get(batch=True)
+            except TimeoutError:
+                reports = []
+
+            progress = ref()
+            if progress is None:
+                return
+
+            for n, metrics in reports:
+                try:
+                    progress.report(n, None if metrics is None else LoadMetrics.from_dict(metrics))
+                except TerminateCurrentLoad:
+                    pass  # cancelled by the callback, tasks that are still to run skip loading
+
+            if progress.done and not progress.cancelled:
+                return
+            del progress
+    except Exception:  # pylint: disable=broad-except
+        return  # client was closed
+    finally:
+        # client might be closed already, event.clear() drops cancellation flag from the scheduler
+        for cleanup in (queue.close, event.clear):
+            with ignore_exceptions_if(True):
+                cleanup()
+
+
 class Datacube(object):
     """
     Interface to search, read and write a datacube.
@@ -144,6 +351,7 @@ class Datacube(object):
     def load(self, product=None, measurements=None, output_crs=None, resolution=None, resampling=None,
              skip_broken_datasets=False,
              dask_chunks=None, like=None, fuse_func=None, align=None, datasets=None, progress_cbk=None,
+             out=None, plan_only=False, metrics=None, dask_group_measurements=False,
              **query):
         """
         Load data as an ``xarray`` object.  Each measurement will be a data variable in the :class:`xarray.Dataset`.
@@ -259,6 +467,13 @@ class Datacube(object):
             If the data should be lazily loaded using :class:`dask.array.Array`,
             specify the chunking size in each output dimension.
 
+            Use ``'storage'`` for a dimension, or ``dask_chunks='storage'`` for all of them, to pick chunk
+            sizes based on source file tiling and dask's ``array.chunk-size`` setting: spatial chunks are
+            multiples of source blocks (from the product's ``storage.chunking`` if recorded, otherwise
+            from one file header), with boundaries on source block boundaries, so the first chunk along
+            a dimension might be smaller, and chunks are as large as fits into the configured size.
+            ``'auto'`` is the same as leaving a dimension out.
+
             See the documentation on using `xarray with dask <http://xarray.pydata.org/en/stable/dask.html>`_
             for more information.
 
@@ -286,12 +501,165 @@ class Datacube(object):
             returned. Useful for testing and debugging.
 
         :param progress_cbk: Int, Int -> None
-            if supplied will be called for every file read with `files_processed_so_far, total_files`. This is
-            only applicable to non-lazy loads, ignored when using dask.
+            if supplied will be called for every file read with `files_processed_so_far, total_files`.
+            Raise :class:`TerminateCurrentLoad` from it to stop loading early, data loaded so far is
+            returned with ``dc_partial_load`` attribute set. When using dask it is called as chunks are
+            computed, remaining chunks are then filled with ``nodata``, only the Dataset returned by ``load``
+            gets ``dc_partial_load`` set, not copies made of it before cancel, like ``.compute()`` output.
+            With ``dask.distributed`` it is called from a background thread of the process that called
+            ``load``, as progress reports from workers arrive, for this the client should be active when
+            ``load`` is called.
+
+        :param out:
+            Optional. Load into caller supplied memory rather than newly allocated arrays, not supported
+            with ``dask_chunks``. Either a dictionary mapping measurement name to an array of the
+            output shape and dtype, or a path to a local directory in which to create
+            :class:`numpy.memmap` backed arrays, one ``<measurement>-*.dat`` file per measurement.
+            Files are deleted once the arrays are garbage collected, to keep them or to control file
+            naming pass a dictionary of :class:`numpy.memmap` arrays instead.
+            ::
 
-        :return: Requested data in a :class:`xarray.Dataset`
+                xx = dc.load(product='ls8_nbar_albers', out='/scratch/tmp', **query)
+
+        :param bool plan_only:
+            Optional. Don't load anything, instead return a dictionary describing what would be read:
+            files to open, source and destination regions, whether pixels are pasted or reprojected,
+            read scale and estimated bytes read and output, per measurement and time group.
+            No pixel data is read, only dataset metadata is used.
+
+        :param metrics:
+            Optional. :class:`datacube.storage._load.LoadMetrics` object to which counts of files opened,
+            bytes read, paste vs. reprojected reads and broken datasets skipped, and time spent opening,
+            reading, reprojecting and fusing are added. With ``dask_chunks`` counts are added as chunks
+            are computed, with ``dask.distributed`` they are sent back from workers as tasks complete,
+            for this the client should be active when ``load`` is called. Results are only available
+            through the supplied object, nothing is added to the returned Dataset.
+
+        :param bool dask_group_measurements:
+            Optional. With ``dask_chunks``, use one task per chunk that loads all measurements, rather
+            than one task per chunk per measurement. Each source file is then opened once for all bands
+            it stores and dataset footprints are checked once per chunk. Measurements are views of the
+            shared task output, so computing any one of them loads all of them.
+
+        :return: Requested data in a :class:`xarray.Dataset`, or a load plan when ``plan_only=True``
         :rtype: :class:`xarray.Dataset`
         """
+        prepared = self._prepare_load(product=product, measurements=measurements,
+                                      output_crs=output_crs, resolution=resolution,
+                                      like=like, align=align, datasets=datasets, **query)
+        if prepared is None:
+            return _load_plan(None, None, []) if plan_only else xarray.Dataset()
+
+        grouped, geobox, measurement_dicts = prepared
+
+        if plan_only:
+            return _load_plan(grouped, geobox,
+                              per_band_load_data_settings(measurement_dicts,
+                                                          resampling=resampling, fuse_func=fuse_func))
+
+        result = self.load_data(grouped, geobox,
+                                measurement_dicts,
+                                resampling=resampling,
+                                fuse_func=fuse_func,
+                                dask_chunks=dask_chunks,
+                                skip_broken_datasets=skip_broken_datasets,
+                                progress_cbk=progress_cbk,
+                                out=out,
+                                metrics=metrics,
+                                dask_group_measurements=dask_group_measurements)
+
+        return result
+
+    def load_iter(self, product=None, measurements=None, output_crs=None, resolution=None, resampling=None,
+                  skip_broken_datasets=False,
+                  like=None, fuse_func=None, align=None, datasets=None, progress_cbk=None,
+                  batch_size=1, reuse_buffers=False, metrics=None,
+                  **query):
+        """
+        Load data one batch of time slices at a time.
+
+        Takes the same arguments as :meth:`load`, except for ``dask_chunks``, but
+        instead of allocating output for the whole time range up front, yields an
+        :class:`xarray.Dataset` per batch of ``batch_size`` consecutive groups
+        (time slices), loading each batch only when it is requested.
+        ::
+
+            for xx in dc.load_iter(product='ls8_nbar_albers', time=('2014', '2019'), **extent):
+                process(xx)
+
+        :param int batch_size:
+            Number of groups (time slices) per yielded :class:`xarray.Dataset`, last one might be shorter.
+
+        :param bool reuse_buffers:
+            If ``True`` pixel memory is allocated once and re-used for every batch,
+            so previously yielded data is overwritten once the next batch is requested.
+            Copy anything that needs to be kept around past the next iteration.
+
+        :param progress_cbk: Int, Int -> None
+            if supplied will be called for every file read with `files_processed_so_far, total_files`,
+            counts are per batch. Raising :class:`TerminateCurrentLoad` from it ends the iteration,
+            batch loaded so far is yielded last, with ``dc_partial_load`` attribute set.
+
+        :param metrics:
+            Optional :class:`datacube.storage._load.LoadMetrics` accumulating totals across batches, see :meth:`load`.
+
+        :return: Generator of :class:`xarray.Dataset`, one per batch
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size should be at least 1")
+
+        prepared = self._prepare_load(product=product, measurements=measurements,
+                                      output_crs=output_crs, resolution=resolution,
+                                      like=like, align=align, datasets=datasets, **query)
+        if prepared is None:
+            return iter(())
+
+        grouped, geobox, measurement_dicts = prepared
+        measurement_dicts = per_band_load_data_settings(measurement_dicts,
+                                                        resampling=resampling, fuse_func=fuse_func)
+
+        return Datacube._load_batches(grouped, geobox, measurement_dicts, batch_size,
+                                      skip_broken_datasets=skip_broken_datasets,
+                                      progress_cbk=progress_cbk,
+                                      reuse_buffers=reuse_buffers,
+                                      metrics=metrics)
+
+    @staticmethod
+    def _load_batches(grouped, geobox, measurement_dicts, batch_size,
+                      skip_broken_datasets=False,
+                      progress_cbk=None,
+                      reuse_buffers=False,
+                      metrics=None):
+        """ Generator behind :meth:`load_iter`, stops after a batch that was cancelled from ``progress_cbk``.
+        """
+        buffers = {}
+
+        def reused(m, shape):
+            buf = buffers.get(m.name, None)
+            if buf is None:
+                buf = numpy.empty((batch_size,) + shape[1:], dtype=m.dtype)
+                buffers[m.name] = buf
+            return buf[:shape[0]]
+
+        dim, *_ = grouped.dims
+        for i in range(0, grouped.shape[0], batch_size):
+            sources = grouped.isel({dim: slice(i, i + batch_size)})
+            xx = Datacube._xr_load(sources, geobox, measurement_dicts,
+                                   skip_broken_datasets=skip_broken_datasets,
+                                   progress_cbk=progress_cbk,
+                                   alloc=reused if reuse_buffers else None,
+                                   metrics=metrics)
+            yield xx
+            if xx.attrs.get('dc_partial_load', False):
+                return
+
+    def _prepare_load(self, product=None, measurements=None, output_crs=None, resolution=None,
+                      like=None, align=None, datasets=None, **query):
+        """
+        Work out what to load, shared by :meth:`load` and :meth:`load_iter`.
+
+        :return: ``(grouped datasets, output GeoBox, measurements)``, or ``None`` if there is nothing to load
+        """
         if product is None and datasets is None:
             raise ValueError("Must specify a product or supply datasets")
 
@@ -301,7 +669,7 @@ class Datacube(object):
             datasets = list(datasets)
 
         if len(datasets) == 0:
-            return xarray.Dataset()
+            return None
 
         ds, *_ = datasets
         datacube_product = ds.type
@@ -316,15 +684,7 @@ class Datacube(object):
 
         measurement_dicts = datacube_product.lookup_measurements(measurements)
 
-        result = self.load_data(grouped, geobox,
-                                measurement_dicts,
-                                resampling=resampling,
-                                fuse_func=fuse_func,
-                                dask_chunks=dask_chunks,
-                                skip_broken_datasets=skip_broken_datasets,
-                                progress_cbk=progress_cbk)
-
-        return result
+        return grouped, geobox, measurement_dicts
 
     def find_datasets(self, **search_terms):
         """
@@ -479,41 +839,85 @@ class Datacube(object):
 
     @staticmethod
     def _dask_load(sources, geobox, measurements, dask_chunks,
-                   skip_broken_datasets=False):
-        needed_irr_chunks, grid_chunks = _calculate_chunk_sizes(sources, geobox, dask_chunks)
-        gbt = GeoboxTiles(geobox, grid_chunks)
+                   skip_broken_datasets=False,
+                   metrics=None,
+                   progress_cbk=None,
+                   group_measurements=False):
+        needed_irr_chunks, grid_chunks, grid_offset = _chunk_grid(sources, geobox, dask_chunks, measurements)
+        gbt = GeoboxTiles(geobox, grid_chunks, grid_offset)
         dsk = {}
 
+        # chunk -> dataset keys shared by all measurements,
+        # (dataset, measurement) key -> read description, see _read_source
         def chunk_datasets(dss, gbt):
             out = {}
             for ds in dss:
-                dsk[_tokenize_dataset(ds)] = ds
+                key = _tokenize_dataset(ds)
+                if key not in dsk:
+                    dsk[key] = None
+                    dsk.update((_band_key(key, m.name), _read_source(ds, m.name)) for m in measurements)
                 for idx in gbt.tiles(ds.extent):
-                    out.setdefault(idx, []).append(ds)
+                    out.setdefault(idx, []).append(key)
             return out
 
         chunked_srcs = xr_apply(sources,
                                 lambda _, dss: chunk_datasets(dss, gbt),
                                 dtype=object)
 
+        progress = None
+        if progress_cbk is not None or metrics is not None:
+            n_total = sum(len(dss)
+                          for tiles in chunked_srcs.values.ravel()
+                          for dss in tiles.values())*len(measurements)
+            client = _distributed_client()
+            progress = _LazyLoadProgress(progress_cbk, n_total,
+                                         name=None if client is None else 'dc_progress-' + uuid.uuid4().hex,
+                                         metrics=metrics)
+            if client is not None:
+                progress.listen(client)
+
+        dsk = ('dc_datasets-{}'.format(uuid.uuid4().hex),
+               MaterializedLayer({k: v for k, v in dsk.items() if v is not None}))
+
+        shared = None
+        if group_measurements and len(measurements) > 1:
+            shared_name = 'dc_load-{}'.format(uuid.uuid4().hex)
+            shared = (shared_name, _LazyLoadLayer(shared_name, chunked_srcs, gbt, list(measurements),
+                                                  irr_chunks=needed_irr_chunks,
+                                                  skip_broken_datasets=skip_broken_datasets,
+                                                  metrics=metrics,
+                                                  progress=progress,
+                                                  read_sources=dsk[1]))
+        band_index = {m.name: i for i, m in enumerate(measurements)}
+
         def data_func(measurement):
             return _make_dask_array(chunked_srcs, dsk, gbt,
                                     measurement,
                                     chunks=needed_irr_chunks+grid_chunks,
-                                    skip_broken_datasets=skip_broken_datasets)
-
-        return Datacube.create_storage(sources.coords, geobox, measurements, data_func)
+                                    skip_broken_datasets=skip_broken_datasets,
+                                    metrics=metrics,
+                                    progress=progress,
+                                    shared=None if shared is None else shared + (band_index[measurement.name],))
+
+        result = Datacube.create_storage(sources.coords, geobox, measurements, data_func)
+        if progress is not None:
+            progress.track(result.attrs)
+        return result
 
     @staticmethod
     def _xr_load(sources, geobox, measurements,
                  skip_broken_datasets=False,
-                 progress_cbk=None):
+                 progress_cbk=None,
+                 alloc=None,
+                 metrics=None):
+        """ Load into memory, ``alloc(measurement, shape) -> ndarray`` supplies pixel storage if given.
+        """
 
         def mk_cbk(cbk):
             if cbk is None:
                 return None
             n = 0
-            n_total = sum(len(x) for x in sources.values.ravel())*len(measurements)
+            n_total = sum(len(x) for x in plans.values.ravel())*len(measurements)
 
             def _cbk(*ignored):
                 nonlocal n
@@ -521,27 +925,41 @@ class Datacube(object):
                 return cbk(n, n_total)
             return _cbk
 
-        data = Datacube.create_storage(sources.coords, geobox, measurements)
-        _cbk = mk_cbk(progress_cbk)
+        # Footprint based pruning, done once per time slice and shared by all measurements
+        plans = xr_apply(sources, lambda _, dss: _plan_sources(dss, geobox), dtype=object)
 
-        for index, datasets in numpy.ndenumerate(sources.values):
-            for m in measurements:
-                t_slice = data[m.name].values[index]
+        def data_func(m):
+            return alloc(m, sources.shape + geobox.shape)
 
-                try:
-                    _fuse_measurement(t_slice, datasets, geobox, m,
-                                      skip_broken_datasets=skip_broken_datasets,
-                                      progress_cbk=_cbk)
-                except (TerminateCurrentLoad, KeyboardInterrupt):
-                    data.attrs['dc_partial_load'] = True
-                    return data
+        data = Datacube.create_storage(sources.coords, geobox, measurements,
+                                       data_func if alloc is not None else None)
+        _cbk = mk_cbk(progress_cbk)
+
+        # time slices stored in one file are read together, rather than once per time index
+        bands = (band for plan in plans.values.ravel() for m in measurements
+                 for band in _band_infos([ds for ds, _ in plan], m))
+
+        with stacked_reads(bands):
+            for index, plan in numpy.ndenumerate(plans.values):
+                for m in measurements:
+                    t_slice = data[m.name].values[index]
+
+                    try:
+                        _fuse_measurement(t_slice, None, geobox, m,
+                                          skip_broken_datasets=skip_broken_datasets,
+                                          progress_cbk=_cbk,
+                                          plan=plan,
+                                          metrics=metrics)
+                    except (TerminateCurrentLoad, KeyboardInterrupt):
+                        data.attrs['dc_partial_load'] = True
+                        return data
 
         return data
 
     @staticmethod
     def load_data(sources, geobox, measurements, resampling=None,
                   fuse_func=None, dask_chunks=None, skip_broken_datasets=False,
-                  progress_cbk=None,
+                  progress_cbk=None, out=None, metrics=None, dask_group_measurements=False,
                   **extra):
         """
         Load data from :meth:`group_datasets` into an :class:`xarray.Dataset`.
@@ -574,13 +992,24 @@ class Datacube(object):
             Should be a dictionary specifying the chunking size for each output dimension.
             Unspecified dimensions will be auto-guessed, currently this means use chunk size of 1 for non-spatial
             dimensions and use whole dimension (no chunking unless specified) for spatial dimensions.
+            Dimensions set to ``'storage'`` are sized based on storage layout, see :meth:`load`.
 
             See the documentation on using `xarray with dask <http://xarray.pydata.org/en/stable/dask.html>`_
             for more information.
 
         :param progress_cbk: Int, Int -> None
-            if supplied will be called for every file read with `files_processed_so_far, total_files`. This is
-            only applicable to non-lazy loads, ignored when using dask.
+            if supplied will be called for every file read with `files_processed_so_far, total_files`,
+            see :meth:`load` for cancellation and use with dask.
+
+        :param out:
+            Dictionary of output arrays keyed by measurement name, or a directory for
+            :class:`numpy.memmap` backed output, see :meth:`load`.
+
+        :param metrics:
+            :class:`datacube.storage._load.LoadMetrics` to collect I/O counts and timings into, see :meth:`load`.
+
+        :param bool dask_group_measurements:
+            Load all measurements of a chunk in one dask task, see :meth:`load`.
 
         :rtype: xarray.Dataset
 
@@ -589,12 +1018,19 @@ class Datacube(object):
         measurements = per_band_load_data_settings(measurements, resampling=resampling, fuse_func=fuse_func)
 
         if dask_chunks is not None:
+            if out is not None:
+                raise ValueError("Can not use `out=` with `dask_chunks`")
             return Datacube._dask_load(sources, geobox, measurements, dask_chunks,
-                                       skip_broken_datasets=skip_broken_datasets)
+                                       skip_broken_datasets=skip_broken_datasets,
+                                       metrics=metrics,
+                                       progress_cbk=progress_cbk,
+                                       group_measurements=dask_group_measurements)
         else:
             return Datacube._xr_load(sources, geobox, measurements,
                                      skip_broken_datasets=skip_broken_datasets,
-                                     progress_cbk=progress_cbk)
+                                     progress_cbk=progress_cbk,
+                                     alloc=None if out is None else output_allocator(out),
+                                     metrics=metrics)
 
     def __str__(self):
         return "Datacube<index={!r}>".format(self.index)
@@ -708,26 +1144,251 @@ def select_datasets_inside_polygon(datasets, polygon):
             yield dataset
 
 
-def fuse_lazy(datasets, geobox, measurement, skip_broken_datasets=False, prepend_dims=0):
-    prepend_shape = (1,) * prepend_dims
-    data = numpy.full(geobox.shape, measurement.nodata, dtype=measurement.dtype)
-    _fuse_measurement(data, datasets, geobox, measurement,
-                      skip_broken_datasets=skip_broken_datasets)
-    return data.reshape(prepend_shape + geobox.shape)
+def fuse_lazy(datasets, geobox, measurement, skip_broken_datasets=False, prepend_dims=0, metrics=None,
+              progress=None):
+    return fuse_lazy_block([datasets], geobox, measurement, skip_broken_datasets, (1,) * prepend_dims,
+                           metrics=metrics, progress=progress)
+
+
+def fuse_lazy_block(datasets, geobox, measurement, skip_broken_datasets=False, block_shape=(), metrics=None,
+                    progress=None, plans=None):
+    """ Fuse several groups of datasets into one block of shape ``block_shape + geobox.shape``.
+
+    :param datasets: One list of datasets per element of ``block_shape``, in C order
+    :param plans: Optional, :func:`_plan_sources` output for every group of ``datasets``
+    """
+    data = numpy.empty(tuple(block_shape) + geobox.shape, dtype=measurement.dtype)
+    # tasks run concurrently, so collect locally and add to shared totals once done
+    task_metrics = None if metrics is None else LoadMetrics()
+
+    if plans is None:
+        plans = [_plan_sources(dss, geobox) for dss in datasets]
+
+    with stacked_reads(band for dss in datasets for band in _band_infos(dss, measurement)):
+        for dss, plan, dst in zip(datasets, plans, data.reshape((-1,) + geobox.shape)):
+            if progress is not None and progress.cancelled:
+                dst.fill(measurement.nodata)
+                continue
+
+            try:
+                if progress is not None:
+                    # chunks are matched to datasets by extent only, count sources dropped here too
+                    for _ in range(len(dss) - len(plan)):
+                        progress()
+
+                # dst is filled with nodata by _fuse_measurement
+                _fuse_measurement(dst, dss, geobox, measurement,
+                                  skip_broken_datasets=skip_broken_datasets,
+                                  progress_cbk=progress,
+                                  plan=plan,
+                                  metrics=task_metrics)
+            except TerminateCurrentLoad:
+                pass  # load was cancelled, keep what was fused so far
+
+    # totals are kept by the process that constructed the load, see _LazyLoadProgress
+    if progress is not None:
+        progress.task_done(task_metrics)
+    elif metrics is not None:
+        metrics.update(task_metrics)
+    return data
+
+
+def fuse_lazy_multi(datasets, geobox, measurements, skip_broken_datasets=False, block_shape=(), metrics=None,
+                    progress=None):
+    """ :func:`fuse_lazy_block` for several measurements at once, files are opened once for all of them.
+
+    Dataset footprints are checked once, all measurements share the result.
+
+    :param datasets: ``datasets`` argument of :func:`fuse_lazy_block` for every measurement, every
+                     measurement lists the same datasets in the same order
+    :returns: Tuple of arrays, one per measurement
+    """
+    rois = [[_footprint_roi(ds, geobox) for ds in grp] for grp in datasets[0]] if datasets else []
+
+    with shared_file_handles():
+        return tuple(fuse_lazy_block(dss, geobox, m, skip_broken_datasets, block_shape, metrics, progress,
+                                     plans=[_plan_sources(grp, geobox, grp_rois) for grp, grp_rois in zip(dss, rois)])
+                     for dss, m in zip(datasets, measurements))
+
+
+def _footprint_roi(ds, geobox, padding=2):
+    """ Compute region of ``geobox`` that can contain valid pixels of dataset ``ds``.
+
+    Uses indexed valid data footprint (``ds.extent``), so no files are opened.
+
+    :returns: ``None`` if footprint is not known (have to read data to find out)
+    :returns: Empty ROI if dataset doesn't overlap with ``geobox``
+    :returns: ROI covering footprint bounding box, padded by ``padding`` pixels
+    """
+    # read descriptors (BandInfo) carry no footprint, those were already matched to chunks by footprint
+    extent = getattr(ds, 'extent', None)
+    if extent is None or geobox.crs is None:
+        return None
+
+    poly = extent.to_crs(geobox.crs)
+    if not geobox.extent.intersects(poly):
+        return numpy.s_[0:0, 0:0]
+
+    bbox = poly.boundingbox
+    A = ~geobox.transform
+    xy = numpy.asarray([A*pt for pt in ((bbox.left, bbox.top),
+                                        (bbox.right, bbox.top),
+                                        (bbox.right, bbox.bottom),
+                                        (bbox.left, bbox.bottom))])
+    return geometry.roi_from_points(xy, geobox.shape, padding=padding)
+
+
+def _plan_sources(datasets, geobox, rois=None):
+    """ Drop datasets that can not contribute any pixels to ``geobox``.
+
+    Footprint ROI is not used to restrict reads, as footprint recorded in the
+    index is not guaranteed to cover every band of the dataset, actual read
+    region is still computed from the raster on open.
+
+    :param rois: Optional, already computed :func:`_footprint_roi` of every dataset
+    :returns: List of ``(Dataset, ROI|None)`` tuples, where ROI is a region of
+              ``geobox`` that dataset footprint touches, see :func:`_footprint_roi`.
+    """
+    if rois is None:
+        rois = [_footprint_roi(ds, geobox) for ds in datasets]
+
+    plan = []
+    for ds, roi in zip(datasets, rois):
+        if roi is not None and geometry.roi_is_empty(roi):
+            continue
+        plan.append((ds, roi))
+
+    return plan
+
+
+def _source_geobox(ds, band):
+    """ Pixel grid of a band as recorded in the dataset metadata.
+
+    :returns: ``None`` if it can't be known without opening the file
+    """
+    gs = ds.type.grid_spec
+    if gs is not None:
+        # ingested product, dataset is one tile
+        tiles = [gbox for _, gbox in gs.tiles(ds.bounds)]
+        return tiles[0] if len(tiles) == 1 else None
+
+    mm = ds.measurements.get(ds.type.canonical_measurement(band), None)
+    crs = ds.crs
+    if mm is None or crs is None:
+        return None
+
+    grid = toolz.get_in(('grids', mm.get('grid', 'default')), ds.metadata_doc)
+    if grid is None:
+        return None
+
+    grid = norm_grid(grid)
+    h, w = grid.shape
+    return GeoBox(w, h, grid.transform, crs)
+
+
+def _roi_bounds(roi):
+    return tuple((s.start, s.stop) for s in roi)
+
+
+def _load_plan(sources, geobox, measurements):
+    """ Describe reads a non-lazy load would perform, without reading any pixels.
+
+    Source pixel grids are taken from dataset metadata (EO3 ``grids`` or ingested
+    product ``grid_spec``). When not available the read is assumed to cover the
+    dataset footprint at output resolution, and ``src_roi``, ``paste`` and ``scale``
+    are ``None``.
+
+    Byte counts are for uncompressed pixels.
+    """
+    from datacube.storage._read import plan_read
+
+    groups = []
+    files = set()
+    plans = numpy.empty((0,), dtype=object)
+    if sources is not None:
+        plans = xr_apply(sources, lambda _, dss: _plan_sources(dss, geobox), dtype=object).values
+
+    for index, plan in numpy.ndenumerate(plans):
+        coords = {dim: sources[dim].values[i] for dim, i in zip(sources.dims, index)}
+
+        for m in measurements:
+            itemsize = numpy.dtype(m.dtype).itemsize
+            resampling = m.get('resampling_method', 'nearest')
+            reads = []
+
+            for ds, footprint in plan:
+                bi = BandInfo(ds, m.name)
+                src_gbox = _source_geobox(ds, m.name)
+                if src_gbox is not None:
+                    rp = plan_read(src_gbox, geobox, resampling)
+                    roi_dst = rp.roi_dst
+                    src_roi, paste, scale = _roi_bounds(rp.rr.roi_src), rp.paste_ok, rp.scale
+                    read_shape = rp.read_shape
+                else:
+                    roi_dst = footprint if footprint is not None else numpy.s_[0:geobox.height, 0:geobox.width]
+                    src_roi, paste, scale = None, None, None
+                    read_shape = geometry.roi_shape(roi_dst)
+
+                files.add(bi.uri)
+                reads.append(dict(dataset=ds.id,
+                                  uri=bi.uri,
+                                  band=bi.band,
+                                  src_roi=src_roi,
+                                  dst_roi=_roi_bounds(roi_dst),
+                                  paste=paste,
+                                  scale=scale,
+                                  bytes_read=int(numpy.prod(read_shape))*itemsize))
+
+            groups.append(dict(index=index,
+                               coords=coords,
+                               measurement=m.name,
+                               reads=reads,
+                               bytes_read=sum(r['bytes_read'] for r in reads),
+                               bytes_out=geobox.height*geobox.width*itemsize))
+
+    return dict(geobox=geobox,
+                measurements=[m.name for m in measurements],
+                groups=groups,
+                files=len(files),
+                reads=sum(len(g['reads']) for g in groups),
+                bytes_read=sum(g['bytes_read'] for g in groups),
+                bytes_out=sum(g['bytes_out'] for g in groups))
+
+
+def _band_infos(datasets, measurement):
+    """ Read descriptors of ``measurement`` for datasets that have one, ``datasets`` can already be read descriptors.
+    """
+    for ds in datasets:
+        if isinstance(ds, BandInfo):
+            yield ds
+            continue
+        try:
+            yield BandInfo(ds, measurement.name)
+        except ValueError:
+            pass  # reported when loading
 
 
 def _fuse_measurement(dest, datasets, geobox, measurement,
                       skip_broken_datasets=False,
-                      progress_cbk=None):
+                      progress_cbk=None,
+                      plan=None,
+                      metrics=None):
+    if plan is None:
+        plan = _plan_sources(datasets, geobox)
+
     srcs = []
-    for ds in datasets:
+    for ds, _ in plan:
         src = None
         with ignore_exceptions_if(skip_broken_datasets):
-            src = new_datasource(BandInfo(ds, measurement.name))
+            src = new_datasource(ds if isinstance(ds, BandInfo) else BandInfo(ds, measurement.name))
 
         if src is None:
             if not skip_broken_datasets:
-                raise ValueError(f"Failed to load dataset: {ds.id}")
+                raise ValueError(f"Failed to load dataset: {ds.uri if isinstance(ds, BandInfo) else ds.id}")
+            if metrics is not None:
+                metrics.datasets_broken += 1
+            if progress_cbk is not None:
+                progress_cbk(0, 0)  # skipped sources count towards progress too
         else:
             srcs.append(src)
 
@@ -738,7 +1399,8 @@ def _fuse_measurement(dest, datasets, geobox, measurement,
                        resampling=measurement.get('resampling_method', 'nearest'),
                        fuse_func=measurement.get('fuser', None),
                        skip_broken_datasets=skip_broken_datasets,
-                       progress_cbk=progress_cbk)
+                       progress_cbk=progress_cbk,
+                       metrics=metrics)
 
 
 def get_bounds(datasets, crs):
@@ -746,10 +1408,121 @@ def get_bounds(datasets, crs):
     return geometry.box(*bbox, crs=crs)
 
 
-def _calculate_chunk_sizes(sources: xarray.DataArray,
-                           geobox: GeoBox,
-                           dask_chunks: Dict[str, Union[str, int]]):
+def _source_layout(ds, band):
+    """ Internal tiling of a band and the pixel grid it is stored in.
+
+    Block size is taken from the product's ``storage.chunking`` when recorded in the index,
+    otherwise the file header is read.
+
+    :returns: ``(block_shape, transform, crs)`` or ``None`` if it can't be found out
+    """
+    chunking = toolz.get_in(['storage', 'chunking'], ds.type.definition) or {}
+    block = tuple(next((chunking[d] for d in dims if d in chunking), None)
+                  for dims in (('y', 'latitude'), ('x', 'longitude')))
+    gbox = _source_geobox(ds, band)
+
+    if None not in block and gbox is not None:
+        return block, gbox.transform, gbox.crs
+
+    try:
+        src = new_datasource(BandInfo(ds, band))
+        if src is None:
+            return None
+        with src.open() as rdr:
+            block = getattr(rdr, 'block_shape', None)
+            if block is not None:
+                return tuple(block), rdr.transform, rdr.crs
+    except (OSError, ValueError) as e:
+        _LOG.warning("Failed to read storage layout of dataset %s, band %s: %s", ds.id, band, e)
+
+    return None
+
+
+def _storage_tile(sources, geobox, measurements):
+    """ Source block grid in output pixels: ``(tile_shape, tile_origin)``, where ``tile_origin`` is the output
+    pixel ``(row, col)`` of a block corner. ``((1, 1), (0, 0))`` when unknown or not aligned with the output grid.
+
+    Only one dataset is inspected, all datasets are assumed to share the same layout.
+    """
+    unknown = ((1, 1), (0, 0))
+    ds = next((dss[0] for dss in sources.values.ravel() if len(dss) > 0), None)
+    if ds is None or not measurements:
+        return unknown
+
+    layout = _source_layout(ds, measurements[0].name)
+    if layout is None:
+        return unknown
+
+    block, transform, crs = layout
+    if crs != geobox.crs:
+        return unknown
+
+    tile = tuple(max(1, int(round(b*abs(src_res)/abs(dst_res))))
+                 for b, src_res, dst_res in zip(block, (transform.e, transform.a), geobox.resolution))
+    col, row = ~geobox.transform * (transform.c, transform.f)
+    return tile, (int(round(row)), int(round(col)))
+
+
+def _storage_chunks(sources, geobox, measurements, chunks, storage_dims):
+    """ Pick chunk sizes for ``storage_dims``, other dimensions are already resolved in ``chunks``.
+
+    Spatial chunks are multiples of source blocks in the output grid, so that every source tile
+    is decoded by as few tasks as possible. Chunks are made as large as possible without going over
+    dask's ``array.chunk-size`` config (bytes per chunk), spatial dimensions are grown first.
+
+    :returns: ``(chunks, offset)``, sizes of ``storage_dims`` and offset of the spatial chunk grid,
+              see :class:`~datacube.utils.geometry.gbox.GeoboxTiles`, so that chunk boundaries fall on
+              source block boundaries
+    """
+    # pylint: disable=too-many-locals
+    itemsize = max((numpy.dtype(m.dtype).itemsize for m in measurements), default=1)
+    target_px = max(1, parse_bytes(dask.config.get('array.chunk-size')) // itemsize)
+
+    def align(n_px, tile, n):
+        return min(max(tile, n_px // tile * tile), n)
+
+    out = {}
+    ydim, xdim = geobox.dimensions
+    (ny, nx), ((ty, tx), origin) = geobox.shape, _storage_tile(sources, geobox, measurements)
+
+    if ydim in storage_dims and xdim in storage_dims:
+        cy = align(int(math.sqrt(target_px)), ty, ny)
+        cx = align(target_px // cy, tx, nx)
+        cy = align(target_px // cx, ty, ny)  # width might be limited by image size
+        out.update({ydim: cy, xdim: cx})
+    elif ydim in storage_dims:
+        out[ydim] = align(target_px // chunks[xdim], ty, ny)
+    elif xdim in storage_dims:
+        out[xdim] = align(target_px // chunks[ydim], tx, nx)
+
+    resolved = toolz.merge(chunks, out)
+    budget = target_px // (resolved[ydim] * resolved[xdim])
+    for dim, n in zip(sources.dims, sources.shape):
+        if dim in storage_dims:
+            out[dim] = min(max(1, budget), n)
+            budget = 1  # rest of the budget only goes to the first storage dimension
+        else:
+            budget = budget // resolved[dim]
+
+    # chunk grid starts at the last block corner at or before the first output pixel
+    offset = tuple((-o) % resolved[dim] if dim in storage_dims and resolved[dim] < n else 0
+                   for dim, o, n in zip((ydim, xdim), origin, (ny, nx)))
+    return out, offset
+
+
+def _chunk_grid(sources: xarray.DataArray,
+                geobox: GeoBox,
+                dask_chunks: Union[str, Dict[str, Union[str, int]]],
+                measurements=None):
+    """ Resolve ``dask_chunks`` of :meth:`Datacube.load`.
+
+    :returns: ``(irr_chunks, grid_chunks, grid_offset)``: chunk sizes of non-spatial and spatial dimensions
+              and offset of the spatial chunk grid, see :class:`~datacube.utils.geometry.gbox.GeoboxTiles`
+    """
     valid_keys = sources.dims + geobox.dimensions
+    if dask_chunks in ('auto', 'storage'):
+        dask_chunks = {str(dim): dask_chunks for dim in valid_keys}
+
     bad_keys = set(dask_chunks) - set(valid_keys)
     if bad_keys:
         raise KeyError('Unknown dask_chunk dimension {}. Valid dimensions are: {}'.format(bad_keys, valid_keys))
@@ -761,18 +1534,35 @@ def _calculate_chunk_sizes(sources: xarray.DataArray,
     chunk_defaults = dict([(dim, 1) for dim in sources.dims] + [(dim, -1) for dim in geobox.dimensions])
 
     def _resolve(k, v: Optional[Union[str, int]]) -> int:
-        if v is None or v == "auto":
+        if v is None or v in ("auto", "storage"):
             v = _resolve(k, chunk_defaults[k])
 
         if isinstance(v, int):
             if v < 0:
                 return chunk_maxsz[k]
             return v
-        raise ValueError("Chunk should be one of int|'auto'")
+        raise ValueError("Chunk should be one of int|'auto'|'storage'")
+
+    chunks = {dim: _resolve(dim, dask_chunks.get(str(dim))) for dim in valid_keys}
+    offset = (0, 0)
+    storage_dims = [dim for dim in valid_keys if dask_chunks.get(str(dim)) == 'storage']
+    if storage_dims and measurements is not None:
+        sizes, offset = _storage_chunks(sources, geobox, measurements, chunks, storage_dims)
+        chunks.update(sizes)
+
+    irr_chunks = tuple(chunks[dim] for dim in sources.dims)
+    grid_chunks = tuple(chunks[dim] for dim in geobox.dimensions)
 
-    irr_chunks = tuple(_resolve(dim, dask_chunks.get(str(dim))) for dim in sources.dims)
-    grid_chunks = tuple(_resolve(dim, dask_chunks.get(str(dim))) for dim in geobox.dimensions)
+    return irr_chunks, grid_chunks, offset
 
+
+def _calculate_chunk_sizes(sources: xarray.DataArray,
+                           geobox: GeoBox,
+                           dask_chunks: Union[str, Dict[str, Union[str, int]]],
+                           measurements=None):
+    """ Chunk sizes of non-spatial and spatial dimensions, see :func:`_chunk_grid`.
+    """
+    irr_chunks, grid_chunks, _ = _chunk_grid(sources, geobox, dask_chunks, measurements)
     return irr_chunks, grid_chunks
 
 
@@ -780,67 +1570,249 @@ def _tokenize_dataset(dataset):
     return 'dataset-{}'.format(dataset.id.hex)
 
 
-# pylint: disable=too-many-locals
-def _make_dask_array(chunked_srcs,
-                     dsk,
-                     gbt,
-                     measurement,
-                     chunks,
-                     skip_broken_datasets=False):
-    dsk = dsk.copy()  # this contains mapping from dataset id to dataset object
+def _band_key(ds_key, band):
+    return '{}:{}'.format(ds_key, band)
 
-    token = uuid.uuid4().hex
-    dsk_name = 'dc_load_{name}-{token}'.format(name=measurement.name, token=token)
 
-    needed_irr_chunks, grid_chunks = chunks[:-2], chunks[-2:]
-    actual_irr_chunks = (1,) * len(needed_irr_chunks)
+def _read_source(ds, band):
+    """ What workers need to read ``band`` of ``ds``: a :class:`BandInfo` (uri, band/layer, nodata, dtype,
+    crs/transform and format), rather than the full ``Dataset`` with its metadata, product and lineage.
+
+    Falls back to the ``Dataset`` if that fails, so the error is raised (or skipped) when the chunk is computed.
+    """
+    try:
+        return BandInfo(ds, band)
+    except ValueError:
+        return ds
+
+
+class _ChunkGridLayer(Layer):
+    """ Dask graph layer with one task per chunk of a regular chunk grid.
+
+    Tasks are generated on access rather than stored, so graph construction doesn't
+    depend on the number of chunks and culling only materialises the requested chunks.
+    Keys are ``(name, *chunk_index)``, sub-classes implement ``_task``, ``_deps`` and ``_subset``.
+    """
+
+    def __init__(self, name, shape, keys=None, annotations=None):
+        super().__init__(annotations=annotations)
+        self.name = name
+        self.shape = shape
+        self._keys = keys  # subset left after culling, None means all chunks
+        self._output_keys = keys
+
+    @abc.abstractmethod
+    def _task(self, idx):
+        """ Task of the chunk with index ``idx``. """
+
+    @abc.abstractmethod
+    def _deps(self, idx):
+        """ Keys the task of chunk ``idx`` depends on. """
 
-    # we can have up to 4 empty chunk shapes: whole, right edge, bottom edge and
-    # bottom right corner
-    #  W R
-    #  B BR
-    empties = {}  # type Dict[Tuple[int,int], str]
+    @abc.abstractmethod
+    def _subset(self, keys):
+        """ Same layer limited to ``keys``, used when culling. """
 
-    def _mk_empty(shape: Tuple[int, int]) -> str:
-        name = empties.get(shape, None)
-        if name is not None:
-            return name
+    def is_materialized(self):
+        return False
 
-        name = 'empty_{}x{}-{token}'.format(*shape, token=token)
-        dsk[name] = (numpy.full, actual_irr_chunks + shape, measurement.nodata, measurement.dtype)
-        empties[shape] = name
+    def get_output_keys(self):
+        if self._output_keys is None:
+            self._output_keys = set(self)
+        return self._output_keys
 
-        return name
+    def get_dependencies(self, key, all_hlg_keys):
+        return set(self._deps(key[1:]))
 
-    for irr_index, tiled_dss in numpy.ndenumerate(chunked_srcs.values):
-        key_prefix = (dsk_name, *irr_index)
+    def cull(self, keys, all_hlg_keys):
+        keys = set(k for k in keys if k in self)
+        return self._subset(keys), {k: set(self._deps(k[1:])) for k in keys}
 
-        # all spatial chunks
-        for idx in numpy.ndindex(gbt.shape):
-            dss = tiled_dss.get(idx, None)
+    def __contains__(self, key):
+        if self._keys is not None:
+            return key in self._keys
 
-            if dss is None:
-                val = _mk_empty(gbt.chunk_shape(idx))
-            else:
-                val = (fuse_lazy,
-                       [_tokenize_dataset(ds) for ds in dss],
-                       gbt[idx],
-                       measurement,
-                       skip_broken_datasets,
-                       chunked_srcs.ndim)
+        if not (isinstance(key, tuple) and len(key) == len(self.shape) + 1 and key[0] == self.name):
+            return False
+        return all(isinstance(i, int) and 0 <= i < n for i, n in zip(key[1:], self.shape))
 
-            dsk[key_prefix + idx] = val
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self._task(key[1:])
 
-    y_shapes = [grid_chunks[0]]*gbt.shape[0]
-    x_shapes = [grid_chunks[1]]*gbt.shape[1]
+    def __iter__(self):
+        if self._keys is not None:
+            return iter(self._keys)
+        return itertools.product([self.name], *(range(n) for n in self.shape))
 
-    y_shapes[-1], x_shapes[-1] = gbt.chunk_shape(tuple(n-1 for n in gbt.shape))
+    def __len__(self):
+        if self._keys is not None:
+            return len(self._keys)
+        return int(numpy.prod(self.shape))
 
-    data = da.Array(dsk, dsk_name,
-                    chunks=actual_irr_chunks + (tuple(y_shapes), tuple(x_shapes)),
+    def __repr__(self):
+        return '{}<name={!r}, chunks={}>'.format(self.__class__.__name__, self.name, len(self))
+
+
+class _LazyLoadLayer(_ChunkGridLayer):
+    """ :func:`fuse_lazy_block` task for every chunk.
+
+    ``chunked_srcs`` maps spatial tile index to a list of dataset keys for every element
+    of the non-spatial (irregular) dimensions. These are chunked by ``irr_chunks``, default
+    is one element per chunk, several time groups of a chunk are fused straight into one
+    block. When ``measurements`` is a list, tasks load all of them together
+    (:func:`fuse_lazy_multi`) and produce a tuple of arrays.
+
+    When ``read_sources`` (dataset layer contents) is supplied tasks are annotated with
+    ``dc_uris``: a tuple of files the chunk reads, see
+    :class:`datacube.utils.dask.DataLocalityPlugin`.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, name, chunked_srcs, gbt, measurements,
+                 irr_chunks=None,
+                 skip_broken_datasets=False,
+                 metrics=None,
+                 progress=None,
+                 read_sources=None,
+                 keys=None,
+                 annotations=None):
+        if irr_chunks is None:
+            irr_chunks = (1,) * chunked_srcs.ndim
+        n_blocks = tuple(-(-n // c) for n, c in zip(chunked_srcs.shape, irr_chunks))
+        if read_sources is not None and annotations is None:
+            annotations = {'dc_uris': self._chunk_uris}
+        super().__init__(name, n_blocks + gbt.shape, keys=keys, annotations=annotations)
+        self.chunked_srcs = chunked_srcs
+        self.irr_chunks = tuple(irr_chunks)
+        self.gbt = gbt
+        self.measurements = measurements
+        self.skip_broken_datasets = skip_broken_datasets
+        self.metrics = metrics
+        self.progress = progress
+        self.read_sources = read_sources
+
+    def _subset(self, keys):
+        return _LazyLoadLayer(self.name, self.chunked_srcs, self.gbt, self.measurements,
+                              irr_chunks=self.irr_chunks,
+                              skip_broken_datasets=self.skip_broken_datasets,
+                              metrics=self.metrics,
+                              progress=self.progress,
+                              read_sources=self.read_sources,
+                              keys=keys,
+                              annotations=self.annotations)
+
+    def _chunk_uris(self, key):
+        srcs = (self.read_sources[k] for k in self._deps(key[1:]))
+        return tuple(toolz.unique(src.uri for src in srcs if isinstance(src, BandInfo)))
+
+    def _block(self, idx):
+        """ Dataset keys for every element of the block in C order and block shape.
+        """
+        nirr = self.chunked_srcs.ndim
+        ranges = [range(b*c, min((b + 1)*c, n))
+                  for b, c, n in zip(idx[:nirr], self.irr_chunks, self.chunked_srcs.shape)]
+        tile = idx[nirr:]
+        dss = [self.chunked_srcs.values[i].get(tile, []) for i in itertools.product(*ranges)]
+        return dss, tuple(len(r) for r in ranges)
+
+    def _band_keys(self, dss):
+        if isinstance(self.measurements, list):
+            return [[[_band_key(k, m.name) for k in grp] for grp in dss] for m in self.measurements]
+        return [[_band_key(k, self.measurements.name) for k in grp] for grp in dss]
+
+    def _deps(self, idx):
+        dss, _ = self._block(idx)
+        keys = self._band_keys(dss)
+        if isinstance(self.measurements, list):
+            keys = toolz.concat(keys)
+        return list(toolz.unique(toolz.concat(keys)))
+
+    def _task(self, idx):
+        nirr = self.chunked_srcs.ndim
+        dss, block_shape = self._block(idx)
+        tile = idx[nirr:]
+
+        if not any(dss):
+            shape = block_shape + self.gbt.chunk_shape(tile)
+            if isinstance(self.measurements, list):
+                return (tuple, [(numpy.full, shape, m.nodata, m.dtype) for m in self.measurements])
+            return (numpy.full, shape, self.measurements.nodata, self.measurements.dtype)
+
+        return (fuse_lazy_multi if isinstance(self.measurements, list) else fuse_lazy_block,
+                self._band_keys(dss),
+                self.gbt[tile],
+                self.measurements,
+                self.skip_broken_datasets,
+                block_shape,
+                self.metrics,
+                self.progress)
+
+
+class _PickLayer(_ChunkGridLayer):
+    """ Selects ``index``-th element of every chunk of a layer with tuple valued chunks.
+    """
+
+    def __init__(self, name, src_name, index, shape, keys=None):
+        super().__init__(name, shape, keys=keys)
+        self.src_name = src_name
+        self.index = index
+
+    def _subset(self, keys):
+        return _PickLayer(self.name, self.src_name, self.index, self.shape, keys=keys)
+
+    def _deps(self, idx):
+        return [(self.src_name, *idx)]
+
+    def _task(self, idx):
+        return (operator.getitem, (self.src_name, *idx), self.index)
+
+
+def _make_dask_array(chunked_srcs,
+                     dsk,
+                     gbt,
+                     measurement,
+                     chunks,
+                     skip_broken_datasets=False,
+                     metrics=None,
+                     progress=None,
+                     shared=None):
+    """ Construct lazy dask array for one measurement.
+
+    :param chunked_srcs: For every element of non-spatial dimensions a dictionary from spatial tile index to
+                         a list of dataset keys
+    :param dsk: ``(name, layer)`` graph layer mapping dataset keys to ``Dataset`` objects, same layer should
+                be used for all measurements of a load
+    :param shared: ``(name, layer, index)`` of a multi-measurement :class:`_LazyLoadLayer`, when supplied
+                   chunks of this measurement are ``index``-th outputs of its tasks
+    """
+    ds_layer_name, ds_layer = dsk
+    token = uuid.uuid4().hex
+    dsk_name = 'dc_load_{name}-{token}'.format(name=measurement.name, token=token)
+
+    irr_chunks, grid_chunks = chunks[:-2], chunks[-2:]
+
+    if shared is None:
+        layer = _LazyLoadLayer(dsk_name, chunked_srcs, gbt, measurement,
+                               irr_chunks=irr_chunks,
+                               skip_broken_datasets=skip_broken_datasets,
+                               metrics=metrics,
+                               progress=progress,
+                               read_sources=ds_layer)
+        graph = HighLevelGraph({ds_layer_name: ds_layer, dsk_name: layer},
+                               {ds_layer_name: set(), dsk_name: {ds_layer_name}})
+    else:
+        shared_name, shared_layer, index = shared
+        layer = _PickLayer(dsk_name, shared_name, index, shared_layer.shape)
+        graph = HighLevelGraph({ds_layer_name: ds_layer, shared_name: shared_layer, dsk_name: layer},
+                               {ds_layer_name: set(), shared_name: {ds_layer_name}, dsk_name: {shared_name}})
+
+    # first and last chunks might be smaller
+    y_shapes = tuple(gbt.chunk_shape((i, 0))[0] for i in range(gbt.shape[0]))
+    x_shapes = tuple(gbt.chunk_shape((0, i))[1] for i in range(gbt.shape[1]))
+
+    return da.Array(graph, dsk_name,
+                    chunks=tuple(irr_chunks) + (y_shapes, x_shapes),
                     dtype=measurement.dtype,
                     shape=(chunked_srcs.shape + gbt.base.shape))
-
-    if needed_irr_chunks != actual_irr_chunks:
-        data = data.rechunk(chunks=chunks)
-    return data
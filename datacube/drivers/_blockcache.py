@@ -0,0 +1,545 @@
+# This file is part of the Open Data Cube, see https://opendatacube.org for more information
+#
+# Copyright (c) 2015-2020 ODC Contributors
+# SPDX-License-Identifier: Apache-2.0
+""" Caches of decoded raster blocks: in memory shared by the process and on local disk
+shared by all processes on a node.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple, Union
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+_LOG = logging.getLogger(__name__)
+
+# (uri, band index, overview level, (block row, block column)), overview level 0 is full resolution
+BlockKey = Tuple[str, int, int, Tuple[int, int]]
+# pairs of slices or of (start, stop) tuples, or rasterio.windows.Window
+Window = Union[Tuple[slice, slice], Tuple[Tuple[int, int], Tuple[int, int]], Any]
+
+DEFAULT_VERSION_TTL = 60
+REMOTE_SCHEMES = ('s3', 'http', 'https')
+
+
+class BlockCache:
+    """ Byte bounded LRU cache of decoded source blocks.
+
+    Blocks are keyed by :data:`BlockKey`. Cached arrays are marked read-only and shared by
+    all readers, so they outlive the file handle they were read from: a later load of the
+    same file only reads blocks that are not cached yet.
+
+    Files are assumed not to change while they are cached, use :meth:`clear` otherwise.
+    """
+
+    def __init__(self, max_bytes: int):
+        if max_bytes < 0:
+            raise ValueError("max_bytes can not be negative")
+
+        self._max_bytes = max_bytes
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._blocks = OrderedDict()  # type: OrderedDict[Hashable, np.ndarray]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @property
+    def nbytes(self) -> int:
+        """ Bytes used by cached blocks.
+        """
+        return self._nbytes
+
+    @property
+    def hit_rate(self) -> float:
+        """ Fraction of lookups served from cache, 0 if nothing was looked up yet.
+        """
+        n = self.hits + self.misses
+        return self.hits/n if n > 0 else 0.0
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._blocks
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """ Lookup block, ``None`` if it's not cached.
+        """
+        with self._lock:
+            block = self._blocks.get(key, None)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key: Hashable, block: np.ndarray) -> np.ndarray:
+        """ Add block to the cache, evicting least recently used blocks to make space.
+
+        Blocks bigger than the whole cache are not stored.
+
+        :returns: Read-only version of ``block``, or the block already cached under the same key
+        """
+        block = block.view()
+        block.setflags(write=False)
+
+        with self._lock:
+            have = self._blocks.get(key, None)
+            if have is not None:
+                # some other thread read the same block, keep the first one
+                self._blocks.move_to_end(key)
+                return have
+
+            if block.nbytes > self._max_bytes:
+                return block
+
+            self._blocks[key] = block
+            self._nbytes += block.nbytes
+            self._evict()
+
+        return block
+
+    def resize(self, max_bytes: int) -> None:
+        """ Change cache capacity, evicting blocks if it shrinks.
+        """
+        if max_bytes < 0:
+            raise ValueError("max_bytes can not be negative")
+
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        """ Drop all cached blocks, counters are not reset.
+        """
+        with self._lock:
+            self._blocks.clear()
+            self._nbytes = 0
+
+    def _evict(self) -> None:
+        while self._nbytes > self._max_bytes:
+            _, block = self._blocks.popitem(last=False)
+            self._nbytes -= block.nbytes
+            self.evictions += 1
+
+
+_SHARED_LOCK = threading.Lock()
+_SHARED = None  # type: Optional[BlockCache]
+
+
+def shared_block_cache(max_bytes: Optional[int] = None) -> BlockCache:
+    """ Get the block cache shared by all loads in this process.
+
+    :param max_bytes: Grow shared cache to at least this many bytes, it is never shrunk here so
+                      the largest size requested by any driver wins, see :meth:`BlockCache.resize`
+    """
+    global _SHARED  # pylint: disable=global-statement
+
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = BlockCache(0 if max_bytes is None else max_bytes)
+        elif max_bytes is not None and max_bytes > _SHARED.max_bytes:
+            _SHARED.resize(max_bytes)
+
+        return _SHARED
+
+
+def remote_version(uri: str) -> Optional[str]:
+    """ Version tag of a remote file: ETag, or Last-Modified when there is no ETag.
+
+    :returns: ``None`` for local files, files that don't exist and servers that report neither
+    """
+    scheme = urlparse(uri).scheme
+    if scheme == 's3':
+        from datacube.utils.aws import s3_head_object
+        meta = s3_head_object(uri) or {}
+        tag = meta.get('ETag', meta.get('LastModified', None))
+        return None if tag is None else str(tag)
+
+    if scheme in ('http', 'https'):
+        try:
+            with urlopen(Request(uri, method='HEAD'), timeout=30) as rr:
+                return rr.headers.get('ETag', rr.headers.get('Last-Modified', None))
+        except (IOError, ValueError) as e:
+            _LOG.debug("Failed to HEAD %s: %s", uri, e)
+            return None
+
+    return None
+
+
+def _flock(fd: int):
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover
+        return lambda: None
+
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    return lambda: fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class DiskBlockCache:
+    """ Size capped LRU cache of decoded blocks of remote files, stored in a local directory.
+
+    Has the same ``get/put`` interface as :class:`BlockCache` and expects :data:`BlockKey` keys.
+    Only files with a version tag (see :func:`remote_version`) are cached, the tag is part of the
+    cache key, so blocks of a file that changed are never returned. Tags are looked up at most
+    once every ``version_ttl`` seconds per file.
+
+    Several processes can use the same directory: blocks are written to a temporary file and
+    renamed into place, and eviction runs under an exclusive file lock. Last use is recorded
+    as file modification time. Eviction runs every time ``max_bytes/8`` bytes were written by
+    this process, so the directory can exceed ``max_bytes`` by that much per writing process.
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_bytes: int,
+                 version_ttl: float = DEFAULT_VERSION_TTL,
+                 version: Callable[[str], Optional[str]] = remote_version):
+        if max_bytes < 0:
+            raise ValueError("max_bytes can not be negative")
+
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._max_bytes = max_bytes
+        self._version_ttl = version_ttl
+        self._version = version
+        self._lock = threading.Lock()
+        self._versions = {}  # type: Dict[str, Tuple[float, Optional[str]]]
+        self._written = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @property
+    def hit_rate(self) -> float:
+        """ Fraction of lookups served from cache, 0 if nothing was looked up yet.
+        """
+        n = self.hits + self.misses
+        return self.hits/n if n > 0 else 0.0
+
+    def file_version(self, uri: str) -> Optional[str]:
+        if urlparse(uri).scheme not in REMOTE_SCHEMES:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            t, tag = self._versions.get(uri, (None, None))
+        if t is not None and now - t < self._version_ttl:
+            return tag
+
+        tag = self._version(uri)
+        with self._lock:
+            self._versions[uri] = (now, tag)
+        return tag
+
+    def _fname(self, key: BlockKey) -> Optional[str]:
+        tag = self.file_version(key[0])
+        if tag is None:
+            return None
+        h = hashlib.sha1(repr((tag,) + tuple(key)).encode('utf8')).hexdigest()
+        return os.path.join(self._path, h[:2], h + '.npy')
+
+    def get(self, key: BlockKey) -> Optional[np.ndarray]:
+        """ Lookup block, ``None`` if it's not cached or file is not cacheable.
+        """
+        fname = self._fname(key)
+        if fname is None:
+            return None
+
+        try:
+            block = np.load(fname, allow_pickle=False)
+            os.utime(fname)
+        except (IOError, ValueError):  # not there, or evicted by another process
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        block.setflags(write=False)
+        return block
+
+    def put(self, key: BlockKey, block: np.ndarray) -> np.ndarray:
+        """ Store block on disk if file is cacheable, returns ``block``.
+        """
+        fname = self._fname(key)
+        if fname is None or block.nbytes > self._max_bytes:
+            return block
+
+        folder = os.path.dirname(fname)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, block, allow_pickle=False)
+            os.replace(tmp, fname)
+        except IOError as e:
+            _LOG.warning("Failed to write block cache file %s: %s", fname, e)
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return block
+
+        with self._lock:
+            self._written += block.nbytes
+            evict = self._written >= self._max_bytes//8
+            if evict:
+                self._written = 0
+
+        if evict:
+            self.evict()
+        return block
+
+    def _files(self):
+        for folder in os.scandir(self._path):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, st
+
+    def evict(self, max_bytes: Optional[int] = None) -> None:
+        """ Delete least recently used blocks until directory is under ``max_bytes``, defaults to cache size.
+        """
+        max_bytes = self._max_bytes if max_bytes is None else max_bytes
+        stale_tmp = time.time() - 3600
+
+        fd = os.open(os.path.join(self._path, '.lock'), os.O_RDWR | os.O_CREAT)
+        unlock = _flock(fd)
+        try:
+            files = []
+            for fname, st in self._files():
+                if fname.endswith('.npy'):
+                    files.append((st.st_mtime, st.st_size, fname))
+                elif st.st_mtime < stale_tmp:  # left behind by a crashed writer
+                    _unlink(fname)
+
+            total = sum(sz for _, sz, _ in files)
+            for _, sz, fname in sorted(files):
+                if total <= max_bytes:
+                    break
+                if _unlink(fname):
+                    total -= sz
+                    with self._lock:
+                        self.evictions += 1
+        finally:
+            unlock()
+            os.close(fd)
+
+    def resize(self, max_bytes: int) -> None:
+        """ Change cache capacity, evicting blocks if it shrinks.
+        """
+        if max_bytes < 0:
+            raise ValueError("max_bytes can not be negative")
+        self._max_bytes = max_bytes
+        self.evict()
+
+    def nbytes(self) -> int:
+        """ Bytes used by cached blocks of all processes, scans the directory.
+        """
+        return sum(st.st_size for fname, st in self._files() if fname.endswith('.npy'))
+
+    def clear(self) -> None:
+        """ Delete all cached blocks, counters are not reset.
+        """
+        self.evict(0)
+
+
+def _unlink(fname: str) -> bool:
+    try:
+        os.unlink(fname)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+_DISK_CACHES = {}  # type: Dict[str, DiskBlockCache]
+
+
+def shared_disk_cache(path: Optional[str] = None,
+                      max_bytes: Optional[Union[int, str]] = None) -> Optional[DiskBlockCache]:
+    """ Get disk cache for ``path``, one instance per directory per process.
+
+    When ``path`` is not supplied it is taken from ``DATACUBE_DISK_CACHE_DIR`` environment variable
+    and size from ``DATACUBE_DISK_CACHE_SIZE`` (bytes, or a string like ``"50GB"``).
+
+    :returns: ``None`` when disk cache is not configured
+    """
+    if path is None:
+        path = os.environ.get('DATACUBE_DISK_CACHE_DIR', None)
+        if not path:
+            return None
+        if max_bytes is None:
+            max_bytes = os.environ.get('DATACUBE_DISK_CACHE_SIZE', None)
+
+    if isinstance(max_bytes, str):
+        from dask.utils import parse_bytes
+        max_bytes = parse_bytes(max_bytes)
+
+    path = os.path.abspath(path)
+    with _SHARED_LOCK:
+        cache = _DISK_CACHES.get(path, None)
+        if cache is None:
+            if max_bytes is None:
+                raise ValueError("Size of the disk cache is not configured")
+            cache = _DISK_CACHES[path] = DiskBlockCache(path, max_bytes)
+            return cache
+
+    if max_bytes is not None and max_bytes != cache.max_bytes:
+        cache.resize(max_bytes)
+
+    return cache
+
+
+def read_blocks(caches: Sequence[Any],
+                key: Tuple[str, int],
+                shape: Tuple[int, int],
+                block_shape: Tuple[int, int],
+                overviews: Sequence[int],
+                dtype: Any,
+                read: Callable[[Optional[Window], Optional[Tuple[int, int]]], np.ndarray],
+                window: Optional[Window] = None,
+                out_shape: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """ Read from a band of an image via block caches.
+
+    Read is split along the block grid of the full resolution image (overview blocks cover the
+    same number of overview pixels), blocks are looked up in ``caches`` in order, missing blocks
+    are read with ``read`` and added to all caches, blocks found in a later cache are added to earlier
+    ones. Decimated reads are cached only when they map exactly onto one of the ``overviews``,
+    other reads go straight to ``read``.
+
+    :param caches: :class:`BlockCache` and/or :class:`DiskBlockCache`, fastest first
+    :param key: ``(uri, band index)`` of the band
+    :param shape: Shape of the full resolution image
+    :param overviews: Overview factors in the order they are stored in the file
+    :param read: ``read(window, out_shape)`` reads band pixels, like ``rasterio`` ``read``
+    """
+    return read_blocks_multi(caches, [key], shape, block_shape, overviews, dtype,
+                             lambda _, roi, roi_shape: read(roi, roi_shape)[np.newaxis],
+                             window, out_shape)[0]
+
+
+def read_blocks_multi(caches: Sequence[Any],
+                      keys: Sequence[Tuple[str, int]],
+                      shape: Tuple[int, int],
+                      block_shape: Tuple[int, int],
+                      overviews: Sequence[int],
+                      dtype: Any,
+                      read: Callable[[List[int], Optional[Window], Optional[Tuple[int, int]]], np.ndarray],
+                      window: Optional[Window] = None,
+                      out_shape: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """ Read from several bands of an image via block caches, see :func:`read_blocks`.
+
+    Bands should share block grid and overviews. Blocks missing for any of the bands are
+    read for all those bands with one call to ``read``.
+
+    :param keys: ``(uri, band index)`` of every band
+    :param read: ``read(bands, window, out_shape)`` reads pixels of ``bands`` (positions
+                 in ``keys``) into a ``(len(bands), height, width)`` array
+    :returns: ``(len(keys), height, width)`` array
+    """
+    # pylint: disable=too-many-locals
+    H, W = shape
+    (r0, r1), (c0, c1) = _window_bounds(window, shape)
+    f = _decimation(shape, overviews, ((r0, r1), (c0, c1)), out_shape)
+    if f is None or not caches:
+        return read(list(range(len(keys))), window, out_shape)
+
+    level = 0 if f == 1 else list(overviews).index(f) + 1
+    H, W = -(-H//f), -(-W//f)
+    (r0, r1), (c0, c1) = ((a//f, -(-b//f)) for a, b in ((r0, r1), (c0, c1)))
+    bh, bw = block_shape
+
+    out = np.empty((len(keys), r1 - r0, c1 - c0), dtype=dtype)
+    for bi in range(r0//bh, -(-r1//bh)):
+        y0, y1 = bi*bh, min((bi + 1)*bh, H)
+        for bj in range(c0//bw, -(-c1//bw)):
+            x0, x1 = bj*bw, min((bj + 1)*bw, W)
+            ys, ye = max(r0, y0), min(r1, y1)
+            xs, xe = max(c0, x0), min(c1, x1)
+
+            blocks = [_cache_lookup(caches, key + (level, (bi, bj))) for key in keys]
+            missing = [i for i, (block, _) in enumerate(blocks) if block is None]
+            if missing:
+                roi = (slice(y0*f, min(y1*f, shape[0])), slice(x0*f, min(x1*f, shape[1])))
+                pix = read(missing, roi, None if f == 1 else (y1 - y0, x1 - x0))
+                for i, block in zip(missing, pix):
+                    # cached block should not keep pixels of other bands alive
+                    blocks[i] = (block if len(missing) == 1 else block.copy(), len(caches))
+
+            for i, (block, found) in enumerate(blocks):
+                block_key = keys[i] + (level, (bi, bj))
+                for cache in reversed(caches[:found]):
+                    block = cache.put(block_key, block)
+                out[i, ys - r0:ye - r0, xs - c0:xe - c0] = block[ys - y0:ye - y0, xs - x0:xe - x0]
+
+    return out
+
+
+def _cache_lookup(caches: Sequence[Any], block_key: Hashable) -> Tuple[Optional[np.ndarray], int]:
+    """ First cache that has a block: ``(block, cache index)``, ``(None, len(caches))`` if none do.
+    """
+    for i, cache in enumerate(caches):
+        block = cache.get(block_key)
+        if block is not None:
+            return block, i
+    return None, len(caches)
+
+
+def _window_bounds(window: Optional[Window], shape: Tuple[int, int]) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """ ``((row start, row stop), (column start, column stop))`` of a window given as slices,
+    ``(start, stop)`` pairs (as used by the legacy reader) or :class:`rasterio.windows.Window`.
+    """
+    if window is None:
+        return ((0, shape[0]), (0, shape[1]))
+
+    if hasattr(window, 'toranges'):
+        window = window.toranges()
+
+    (r0, r1), (c0, c1) = (w.indices(n)[:2] if isinstance(w, slice) else w
+                          for w, n in zip(window, shape))
+    return ((int(r0), int(r1)), (int(c0), int(c1)))
+
+
+def _decimation(shape: Tuple[int, int],
+                overviews: Sequence[int],
+                win: Tuple[Tuple[int, int], Tuple[int, int]],
+                out_shape: Optional[Tuple[int, int]]) -> Optional[int]:
+    """ Overview factor a read is served from, 1 for full resolution reads,
+    ``None`` if the read doesn't map onto whole pixels of the full image or any overview.
+    """
+    (r0, r1), (c0, c1) = win
+    if out_shape is None or tuple(out_shape) == (r1 - r0, c1 - c0):
+        return 1
+
+    H, W = shape
+    for f in overviews:
+        if (r0 % f == 0 and c0 % f == 0
+                and (r1 % f == 0 or r1 == H) and (c1 % f == 0 or c1 == W)
+                and tuple(out_shape) == (-(-r1//f) - r0//f, -(-c1//f) - c0//f)):
+            return f
+    return None
@@ -0,0 +1,217 @@
+# This file is part of the Open Data Cube, see https://opendatacube.org for more information
+#
+# Copyright (c) 2015-2020 ODC Contributors
+# SPDX-License-Identifier: Apache-2.0
+""" Timeouts, retries and hedging for reads from slow or unreliable storage.
+"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import monotonic, sleep
+from typing import Callable, Deque, List, Optional, Tuple, TypeVar
+
+import numpy as np
+
+_LOG = logging.getLogger(__name__)
+T = TypeVar('T')
+
+DEFAULT_BACKOFF = 0.1
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+DEFAULT_ATTEMPT_WORKERS = 8
+
+
+class ReadTimeoutError(IOError):
+    """ Raised when read didn't complete within allowed time.
+    """
+
+
+class ReadPolicy(object):
+    """ Decides how to run a read: how long to wait, how many times to retry
+    and when to issue a duplicate (hedged) request.
+
+    Configured from reader driver ``cfg``, see :meth:`from_cfg`:
+
+    - ``read_timeout``: seconds to wait for a single read attempt, default is to wait forever
+    - ``read_retries``: number of times to retry a failed or timed out read, default 0
+    - ``read_backoff``: seconds to sleep before the first retry, doubles with every retry, default 0.1
+    - ``read_hedge_quantile``: issue duplicate read once an attempt takes longer than this
+      quantile (0, 1) of latencies observed so far, default is not to hedge
+    - ``read_hedge_after``: seconds after which to issue duplicate read before enough latencies were
+      observed (``read_hedge_min_samples``, 20), or always if quantile is not configured
+    - ``read_max_workers``: number of threads running read attempts when timeout or hedging is enabled,
+      default is set by the reader driver, enough for an attempt and a hedged attempt per driver thread
+
+    Attempts run on a separate thread pool when timeout or hedging is enabled,
+    as stuck reads can not be interrupted they are abandoned, not cancelled.
+    Timeout and hedge delay count from when an attempt starts running, not from when it
+    was queued. The pool is shut down by :meth:`close`, or when the policy is garbage collected.
+    """
+
+    def __init__(self,
+                 timeout: Optional[float] = None,
+                 retries: int = 0,
+                 backoff: float = DEFAULT_BACKOFF,
+                 hedge_quantile: Optional[float] = None,
+                 hedge_after: Optional[float] = None,
+                 hedge_min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+                 max_workers: int = DEFAULT_ATTEMPT_WORKERS):
+        if retries < 0:
+            raise ValueError("read_retries can not be negative")
+        if hedge_quantile is not None and not 0 < hedge_quantile < 1:
+            raise ValueError("read_hedge_quantile should be in (0, 1) range")
+
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_quantile = hedge_quantile
+        self.hedge_after = hedge_after
+        self.hedge_min_samples = hedge_min_samples
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)  # type: Deque[float]
+        self._pool = None  # type: Optional[ThreadPoolExecutor]
+        if timeout is not None or self.hedging:
+            self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+        self.n_retries = 0
+        self.n_timeouts = 0
+        self.n_hedged = 0
+
+    def close(self) -> None:
+        """ Shut down attempt thread pool, without waiting for abandoned reads to finish.
+
+        Policies with timeout or hedging can not run reads once closed.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+    def __del__(self):
+        # might be called on partially constructed object
+        if getattr(self, '_pool', None) is not None:
+            self.close()
+
+    @staticmethod
+    def from_cfg(cfg: dict, max_workers: int = DEFAULT_ATTEMPT_WORKERS) -> Optional['ReadPolicy']:
+        """ Construct from reader driver config, ``None`` if no read policy options are set.
+
+        :param max_workers: Size of attempt thread pool, unless set with ``read_max_workers``
+        """
+        opts = dict(timeout=cfg.get('read_timeout', None),
+                    retries=cfg.get('read_retries', 0),
+                    backoff=cfg.get('read_backoff', DEFAULT_BACKOFF),
+                    hedge_quantile=cfg.get('read_hedge_quantile', None),
+                    hedge_after=cfg.get('read_hedge_after', None),
+                    hedge_min_samples=cfg.get('read_hedge_min_samples', DEFAULT_HEDGE_MIN_SAMPLES),
+                    max_workers=cfg.get('read_max_workers', max_workers))
+
+        if (opts['timeout'] is None and opts['retries'] == 0
+                and opts['hedge_quantile'] is None and opts['hedge_after'] is None):
+            return None
+
+        return ReadPolicy(**opts)
+
+    @property
+    def hedging(self) -> bool:
+        return self.hedge_quantile is not None or self.hedge_after is not None
+
+    def hedge_delay(self) -> Optional[float]:
+        """ Seconds after which to issue a duplicate read, ``None`` means don't.
+        """
+        if self.hedge_quantile is not None:
+            with self._lock:
+                if len(self._latencies) >= self.hedge_min_samples:
+                    return float(np.quantile(self._latencies, self.hedge_quantile))
+        return self.hedge_after
+
+    def _record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def run(self,
+            read: Callable[[], T],
+            read_again: Optional[Callable[[], T]] = None) -> T:
+        """ Run ``read`` according to this policy.
+
+        :param read: Performs the read, first attempt when there is no timeout or hedging
+        :param read_again: Used for retries and hedged reads, should not share state that
+                           might be left broken or locked by an earlier attempt, defaults to ``read``.
+                           Also used for the first attempt when timeout or hedging is enabled,
+                           as an abandoned attempt might never release shared state.
+        :raises: Last error if all attempts failed, :class:`ReadTimeoutError` if it was a timeout
+        """
+        read_again = read_again or read
+        attempt = 0
+        while True:
+            try:
+                first = read if attempt == 0 and self._pool is None else read_again
+                return self._attempt(first, read_again)
+            except Exception as e:  # pylint: disable=broad-except
+                if attempt >= self.retries:
+                    raise
+                _LOG.debug("Read attempt %d failed: %s", attempt + 1, e)
+
+            with self._lock:
+                self.n_retries += 1
+            sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    def _start(self, read: Callable[[], T]) -> 'Tuple[Future[T], float]':
+        """ Submit ``read`` to attempt pool, returns once it is running, with the time it started.
+        """
+        started = []  # type: List[float]
+        running = threading.Event()
+
+        def run() -> T:
+            started.append(monotonic())
+            running.set()
+            return read()
+
+        fut = self._pool.submit(run)
+        running.wait()
+        return fut, started[0]
+
+    def _attempt(self, read: Callable[[], T], hedge: Callable[[], T]) -> T:
+        if self._pool is None:
+            t0 = monotonic()
+            out = read()
+            self._record(monotonic() - t0)
+            return out
+
+        # might have to wait for a free thread, that is not counted towards timeout
+        first, t0 = self._start(read)
+        deadline = None if self.timeout is None else t0 + self.timeout
+        hedge_at = None
+        if self.hedging:
+            delay = self.hedge_delay()
+            hedge_at = None if delay is None else t0 + delay
+
+        pending = [first]
+        errors = []  # type: List[BaseException]
+
+        while True:
+            wake_at = [t for t in (deadline, hedge_at) if t is not None]
+            timeout = max(0, min(wake_at) - monotonic()) if wake_at else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for fut in done:
+                if fut.exception() is None:
+                    self._record(monotonic() - t0)
+                    return fut.result()
+                errors.append(fut.exception())
+
+            pending = [fut for fut in pending if not fut.done()]
+            now = monotonic()
+
+            if hedge_at is not None and now >= hedge_at:
+                # slow read: issue duplicate and take whichever completes first
+                hedge_at = None
+                with self._lock:
+                    self.n_hedged += 1
+                pending.append(self._pool.submit(hedge))
+            elif not pending:
+                raise errors[-1]
+            elif deadline is not None and now >= deadline:
+                with self._lock:
+                    self.n_timeouts += 1
+                raise ReadTimeoutError("Read didn't complete in {:.3f} seconds".format(self.timeout))
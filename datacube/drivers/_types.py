@@ -5,11 +5,12 @@
 """ Defines abstract types for IO drivers.
 """
 from typing import (
-    List, Tuple, Optional, Union, Any, Iterable,
+    List, Tuple, Optional, Union, Any, Iterable, Hashable, Sequence,
     TYPE_CHECKING
 )
 
 from abc import ABCMeta, abstractmethod
+import threading
 import numpy as np
 from affine import Affine
 from concurrent.futures import Future
@@ -59,12 +60,66 @@ class GeoRasterReader(object, metaclass=ABCMeta):
     def nodata(self) -> Optional[Union[int, float]]:
         ...  # pragma: no cover
 
+    @property
+    def overviews(self) -> Tuple[int, ...]:
+        """ Available overview (decimation) factors, sorted from finest to coarsest.
+
+        Empty if there are no overviews or reader doesn't know about them.
+        """
+        return ()
+
+    @property
+    def multiband_key(self) -> Optional[Hashable]:
+        """ Readers reporting the same key (other than ``None``) read different
+        bands of one raster and can be read together with :meth:`read_multi`.
+        """
+        return None
+
     @abstractmethod
     def read(self,
              window: Optional[RasterWindow] = None,
              out_shape: Optional[RasterShape] = None) -> FutureNdarray:
         ...  # pragma: no cover
 
+    def read_multi(self,
+                   others: Sequence['GeoRasterReader'],
+                   window: Optional[RasterWindow] = None,
+                   out_shape: Optional[RasterShape] = None) -> FutureNdarray:
+        """ Read this band and bands of ``others`` in one pass.
+
+        Only valid for readers with the same :attr:`multiband_key`. Default implementation
+        reads every band with :meth:`read` and stacks them once all reads have completed,
+        readers that can read several bands in one go should override it.
+
+        :returns: Future of ``(band, y, x)`` array, this band first followed by ``others`` in order
+        """
+        return stack_futures([rdr.read(window, out_shape) for rdr in [self, *others]])
+
+
+def stack_futures(futures: Sequence[FutureNdarray]) -> FutureNdarray:
+    """ Future of ``np.stack`` of the results of ``futures``, fails with the first error encountered.
+    """
+    out = Future()  # type: FutureNdarray
+    remaining = len(futures)
+    lock = threading.Lock()
+
+    def on_done(fut):
+        nonlocal remaining
+        with lock:
+            if out.done():
+                return
+            if fut.exception() is not None:
+                out.set_exception(fut.exception())
+                return
+            remaining -= 1
+            if remaining > 0:
+                return
+        out.set_result(np.stack([f.result() for f in futures]))
+
+    for fut in futures:
+        fut.add_done_callback(on_done)
+    return out
+
 
 class ReaderDriver(object, metaclass=ABCMeta):
     """ Interface for Reader Driver
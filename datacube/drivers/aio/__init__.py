@@ -0,0 +1,6 @@
+# This file is part of the Open Data Cube, see https://opendatacube.org for more information
+#
+# Copyright (c) 2015-2020 ODC Contributors
+# SPDX-License-Identifier: Apache-2.0
+""" Reader driver fetching Cloud Optimized GeoTIFF tiles with asynchronous range requests
+"""
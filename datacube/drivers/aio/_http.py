@@ -0,0 +1,234 @@
+# This file is part of the Open Data Cube, see https://opendatacube.org for more information
+#
+# Copyright (c) 2015-2020 ODC Contributors
+# SPDX-License-Identifier: Apache-2.0
+""" Minimal asyncio HTTP/1.1 client for byte range requests over HTTP(S) and S3
+"""
+import asyncio
+import os
+import ssl
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, quote
+
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_TIMEOUT = 60.0
+
+ConnKey = Tuple[str, str, int]  # pylint: disable=invalid-name
+
+
+class HttpError(IOError):
+    """ Raised on unexpected HTTP response status.
+    """
+
+    def __init__(self, status: int, url: str):
+        super().__init__("HTTP {} for {}".format(status, url))
+        self.status = status
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    v = os.environ.get(name, None)
+    if v is None:
+        return default
+    return v.upper() in ('YES', 'TRUE', 'ON', '1')
+
+
+def s3_to_http(url: str) -> str:
+    """ Translate ``s3://bucket/key`` into HTTP(S) url.
+
+    Uses the same environment variables as GDAL's ``/vsis3/``: ``AWS_S3_ENDPOINT``,
+    ``AWS_HTTPS``, ``AWS_VIRTUAL_HOSTING`` and ``AWS_REGION`` (or ``AWS_DEFAULT_REGION``).
+    """
+    u = urlparse(url)
+    bucket, key = u.netloc, quote(u.path.lstrip('/'))
+    scheme = 'https' if _env_flag('AWS_HTTPS', True) else 'http'
+    endpoint = os.environ.get('AWS_S3_ENDPOINT', None)
+    if endpoint is None:
+        region = os.environ.get('AWS_REGION', os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+        endpoint = 's3.{}.amazonaws.com'.format(region)
+
+    if _env_flag('AWS_VIRTUAL_HOSTING', True) and '.' not in bucket:
+        return '{}://{}.{}/{}'.format(scheme, bucket, endpoint, key)
+    return '{}://{}/{}/{}'.format(scheme, endpoint, bucket, key)
+
+
+class S3Signer:
+    """ Adds AWS SigV4 authorization headers to S3 requests.
+
+    Botocore session, credentials and region are looked up once, on first use, off the event
+    loop thread. Refreshable credentials (assumed roles, instance profiles) are refreshed
+    off the event loop too, only signing runs per request. Requests are left unsigned when
+    ``AWS_NO_SIGN_REQUEST=YES``, ``botocore`` is not installed or there are no credentials.
+    """
+
+    def __init__(self):
+        self._creds = None  # type: Any
+        self._region = 'us-east-1'
+        self._ready = None  # type: Optional[asyncio.Future]
+
+    def _setup(self) -> None:
+        if _env_flag('AWS_NO_SIGN_REQUEST', False):
+            return
+
+        try:
+            import botocore.session
+        except ImportError:
+            return
+
+        session = botocore.session.get_session()
+        self._creds = session.get_credentials()
+        self._region = os.environ.get('AWS_REGION', session.get_config_variable('region') or 'us-east-1')
+
+    async def sign(self, http_url: str, headers: Dict[str, str]) -> Dict[str, str]:
+        loop = asyncio.get_event_loop()
+        if self._ready is None:
+            self._ready = loop.run_in_executor(None, self._setup)
+        await asyncio.shield(self._ready)
+
+        creds = self._creds
+        if creds is None:
+            return headers
+
+        from botocore.auth import S3SigV4Auth
+        from botocore.awsrequest import AWSRequest
+
+        if getattr(creds, 'refresh_needed', lambda: False)():
+            frozen = await loop.run_in_executor(None, creds.get_frozen_credentials)
+        else:
+            frozen = creds.get_frozen_credentials()
+
+        rq = AWSRequest(method='GET', url=http_url, headers=headers)
+        S3SigV4Auth(frozen, 's3', self._region).add_auth(rq)
+        return dict(rq.headers.items())
+
+
+class RangeClient:
+    """ Fetches byte ranges with asyncio, re-using keep-alive connections.
+
+    At most ``max_connections`` requests are in flight at any time. Must only be used
+    from one event loop. Requests to ``s3://`` urls are signed with ``signer``, a new
+    :class:`S3Signer` by default.
+    """
+
+    def __init__(self,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 signer: Optional[S3Signer] = None):
+        if max_connections < 1:
+            raise ValueError("max_connections should be at least 1")
+
+        self._max_connections = max_connections
+        self._timeout = timeout
+        self._sem = None  # type: Optional[asyncio.Semaphore]
+        self._idle = {}  # type: Dict[ConnKey, List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]]
+        self._ssl = None  # type: Optional[ssl.SSLContext]
+        self._signer = S3Signer() if signer is None else signer
+        self.n_requests = 0
+        self.n_bytes = 0
+
+    async def fetch(self, url: str, start: int, end: int) -> bytes:
+        """ Fetch bytes ``[start, end)`` of ``url``, ``http(s)://`` or ``s3://``.
+
+        :raises: :class:`HttpError` on error responses, :class:`asyncio.TimeoutError`
+        """
+        headers = {'Range': 'bytes={}-{}'.format(start, end - 1)}
+        if url.startswith('s3://'):
+            url = s3_to_http(url)
+            headers = await self._signer.sign(url, headers)
+
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self._max_connections)
+
+        async with self._sem:
+            data = await asyncio.wait_for(self._get(url, headers), self._timeout)
+
+        self.n_requests += 1
+        if len(data) > end - start:  # server ignored the range
+            data = data[start:end]
+        self.n_bytes += len(data)
+        return data
+
+    async def _get(self, url: str, headers: Dict[str, str]) -> bytes:
+        u = urlparse(url)
+        port = u.port or (443 if u.scheme == 'https' else 80)
+        key = (u.scheme, u.hostname, port)
+        target = u.path + ('?' + u.query if u.query else '')
+
+        req = ['GET {} HTTP/1.1'.format(target or '/'),
+               'Host: {}'.format(u.netloc)]
+        req.extend('{}: {}'.format(k, v) for k, v in headers.items() if k.lower() != 'host')
+        req = ('\r\n'.join(req) + '\r\n\r\n').encode('latin1')
+
+        while True:
+            idle = self._idle.get(key, [])
+            reused = len(idle) > 0
+            reader, writer = idle.pop() if reused else await self._connect(key)
+            try:
+                writer.write(req)
+                status, hdrs, body, keep = await _read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:  # server closed idle connection, try again
+                    continue
+                raise
+            except BaseException:
+                # timed out part way through a response, connection can't be re-used
+                writer.close()
+                raise
+
+            if keep:
+                self._idle.setdefault(key, []).append((reader, writer))
+            else:
+                writer.close()
+
+            if status not in (200, 206):
+                raise HttpError(status, url)
+            return body
+
+    async def _connect(self, key: ConnKey):
+        scheme, host, port = key
+        ctx = None
+        if scheme == 'https':
+            if self._ssl is None:
+                self._ssl = ssl.create_default_context()
+            ctx = self._ssl
+        return await asyncio.open_connection(host, port, ssl=ctx)
+
+    def close(self) -> None:
+        for conns in self._idle.values():
+            for _, writer in conns:
+                writer.close()
+        self._idle.clear()
+
+
+async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str], bytes, bool]:
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed")
+    version, status = line.decode('latin1').split(None, 2)[:2]
+
+    hdrs = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        k, v = line.decode('latin1').split(':', 1)
+        hdrs[k.strip().lower()] = v.strip()
+
+    keep = hdrs.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+    if hdrs.get('transfer-encoding', '').lower() == 'chunked':
+        parts = []
+        while True:
+            n = int((await reader.readline()).split(b';')[0], 16)
+            if n == 0:
+                await reader.readline()
+                break
+            parts.append(await reader.readexactly(n))
+            await reader.readline()
+        body = b''.join(parts)
+    elif 'content-length' in hdrs:
+        body = await reader.readexactly(int(hdrs['content-length']))
+    else:
+        body = await reader.read()
+        keep = False
+
+    return int(status), hdrs, body, keep
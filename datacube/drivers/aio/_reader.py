@@ -0,0 +1,365 @@
+# This file is part of the Open Data Cube, see https://opendatacube.org for more information
+#
+# Copyright (c) 2015-2020 ODC Contributors
+# SPDX-License-Identifier: Apache-2.0
+""" reader
+"""
+import asyncio
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Hashable, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from affine import Affine
+
+from datacube.storage import BandInfo
+from datacube.utils.geometry import CRS
+from datacube.drivers._types import (
+    ReaderDriverEntry,
+    ReaderDriver,
+    GeoRasterReader,
+    FutureGeoRasterReader,
+    FutureNdarray,
+    RasterShape,
+    RasterWindow,
+)
+from datacube.drivers.rio._reader import RDEntry as RioRDEntry, _roi_to_window
+from ._http import RangeClient, DEFAULT_MAX_CONNECTIONS, DEFAULT_TIMEOUT
+from ._tiff import UnsupportedTiff, read_cog_header, decode_tile
+
+_LOG = logging.getLogger(__name__)
+
+DEFAULT_HEADER_SIZE = 16*1024
+DEFAULT_COALESCE_GAP = 64*1024
+DEFAULT_MAX_RANGE = 16*1024*1024
+DEFAULT_MAX_HEADERS = 256
+
+Range = Tuple[int, int]  # pylint: disable=invalid-name
+
+
+def coalesce_ranges(ranges: Sequence[Range],
+                    gap: int = DEFAULT_COALESCE_GAP,
+                    max_size: int = DEFAULT_MAX_RANGE) -> List[Tuple[Range, List[int]]]:
+    """ Merge byte ranges ``[start, end)`` that are less than ``gap`` bytes apart into
+    fewer, larger ranges of at most ``max_size`` bytes (unless a single range is bigger).
+
+    :returns: ``[((start, end), [indexes of ranges it covers]), ...]`` sorted by start
+    """
+    out = []  # type: List[Tuple[Range, List[int]]]
+    for i in sorted(range(len(ranges)), key=lambda i: ranges[i]):
+        start, end = ranges[i]
+        if out:
+            (s0, e0), idx = out[-1]
+            if start - e0 <= gap and max(end, e0) - s0 <= max_size:
+                out[-1] = ((s0, max(end, e0)), idx + [i])
+                continue
+        out.append(((start, end), [i]))
+    return out
+
+
+class HeaderCache:
+    """ Parsed headers of recently opened files, load context of :class:`AIORdrDriver`.
+
+    Only used from the event loop thread of the driver that created it.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_size: int = DEFAULT_MAX_HEADERS):
+        self.loop = loop
+        self._max_size = max_size
+        self._headers = OrderedDict()  # type: OrderedDict[str, asyncio.Future]
+
+    def __len__(self) -> int:
+        return len(self._headers)
+
+    def get(self, url: str, parse) -> asyncio.Future:
+        fut = self._headers.get(url, None)
+        if fut is None or (fut.done() and fut.exception() is not None):
+            fut = self._headers[url] = self.loop.create_task(parse(url))
+            while len(self._headers) > self._max_size:
+                self._headers.popitem(last=False)
+        self._headers.move_to_end(url)
+        return fut
+
+
+class AIOReader(GeoRasterReader):
+    def __init__(self,
+                 img: SimpleNamespace,
+                 band_idx: int,
+                 driver: 'AIORdrDriver',
+                 crs: Optional[CRS],
+                 transform: Optional[Affine],
+                 nodata: Optional[Union[float, int]]):
+        self._img = img
+        self._band_idx = band_idx
+        self._driver = driver
+        self._crs = crs
+        self._transform = transform
+        self._nodata = nodata
+
+    @property
+    def crs(self) -> Optional[CRS]:
+        return self._crs
+
+    @property
+    def transform(self) -> Optional[Affine]:
+        return self._transform
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._img.levels[0].dtype.newbyteorder('=')
+
+    @property
+    def shape(self) -> RasterShape:
+        return self._img.levels[0].shape
+
+    @property
+    def nodata(self) -> Optional[Union[int, float]]:
+        return self._nodata
+
+    @property
+    def overviews(self) -> Tuple[int, ...]:
+        return tuple(sorted(self._img.overviews))
+
+    @property
+    def block_shape(self) -> RasterShape:
+        return self._img.levels[0].tile_shape
+
+    @property
+    def multiband_key(self) -> Optional[Hashable]:
+        return id(self._img)
+
+    def read(self,
+             window: Optional[RasterWindow] = None,
+             out_shape: Optional[RasterShape] = None) -> FutureNdarray:
+        fut = self._driver.submit(self._driver.read(self._img, [self._band_idx - 1], window, out_shape, self._nodata))
+        return _then(fut, lambda pix: pix[0])
+
+    def read_multi(self,
+                   others: Sequence[GeoRasterReader],
+                   window: Optional[RasterWindow] = None,
+                   out_shape: Optional[RasterShape] = None) -> FutureNdarray:
+        # pylint: disable=protected-access
+        bands = [self._band_idx - 1]
+        for rdr in others:
+            if not isinstance(rdr, AIOReader) or rdr._img is not self._img:
+                raise ValueError("Can only read bands of the same file together")
+            bands.append(rdr._band_idx - 1)
+
+        return self._driver.submit(self._driver.read(self._img, bands, window, out_shape, self._nodata))
+
+
+def _then(fut: Future, fn=None, out: Optional[Future] = None) -> Future:
+    """ Future of ``fn(fut.result())``, completes ``out`` if supplied.
+    """
+    out = Future() if out is None else out
+
+    def done(f: Future) -> None:
+        try:
+            v = f.result()
+            out.set_result(v if fn is None else fn(v))
+        except Exception as e:  # pylint: disable=broad-except
+            out.set_exception(e)
+
+    fut.add_done_callback(done)
+    return out
+
+
+class AIORdrDriver(ReaderDriver):
+    """ Reader driver for GeoTIFFs over HTTP(S) and S3 using asynchronous range requests.
+
+    All requests run on one event loop thread, so hundreds of reads can be in flight
+    without a thread per request. Headers are parsed by the driver, tiles of the
+    requested window are fetched with as few range requests as possible (nearby tiles
+    are fetched together) and decompressed on ``pool`` threads.
+
+    Only uncompressed and Deflate compressed files are decoded, other files are read
+    with the rasterio reader driver instead.
+
+    Recognised ``cfg`` options:
+
+    - ``max_connections``: requests in flight at once, default 64
+    - ``timeout``: seconds to wait for one request, default 60
+    - ``header_size``: bytes to fetch when opening a file, default 16KiB
+    - ``coalesce_gap``: fetch tiles less than this many bytes apart in one request, default 64KiB
+    - ``max_range``: largest coalesced request in bytes, default 16MiB
+    """
+
+    def __init__(self, pool: ThreadPoolExecutor, cfg: dict):
+        self._pool = pool
+        self._cfg = cfg
+        self._header_size = cfg.get('header_size', DEFAULT_HEADER_SIZE)
+        self._gap = cfg.get('coalesce_gap', DEFAULT_COALESCE_GAP)
+        self._max_range = cfg.get('max_range', DEFAULT_MAX_RANGE)
+        self._client = RangeClient(cfg.get('max_connections', DEFAULT_MAX_CONNECTIONS),
+                                   cfg.get('timeout', DEFAULT_TIMEOUT))
+        self._fallback = RioRDEntry().new_instance({'pool': pool, 'allow_custom_pool': True})
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='datacube-aio', daemon=True)
+        self._thread.start()
+
+    @property
+    def client(self) -> RangeClient:
+        return self._client
+
+    def submit(self, coro) -> Future:
+        """ Run coroutine on the event loop of this driver.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def new_load_context(self,
+                         bands: Iterable[BandInfo],
+                         old_ctx: Optional[Any]) -> Any:
+        """ Returns :class:`HeaderCache`, previous one is re-used when it belongs to this driver.
+        """
+        if isinstance(old_ctx, HeaderCache) and old_ctx.loop is self._loop:
+            return old_ctx
+        return HeaderCache(self._loop)
+
+    def open(self, band: BandInfo, ctx: Any) -> FutureGeoRasterReader:
+        out = Future()  # type: Future
+
+        def done(f: Future) -> None:
+            try:
+                out.set_result(f.result())
+            except UnsupportedTiff as e:
+                _LOG.debug("Reading %s with rasterio: %s", band.uri, e)
+                _then(self._fallback.open(band, None), out=out)
+            except Exception as e:  # pylint: disable=broad-except
+                out.set_exception(e)
+
+        self.submit(self._open(band, ctx)).add_done_callback(done)
+        return out
+
+    async def _fetch(self, url: str, start: int, end: int) -> bytes:
+        return await self._client.fetch(url, start, end)
+
+    async def _parse_header(self, url: str) -> SimpleNamespace:
+        return await read_cog_header(url, lambda start, end: self._fetch(url, start, end), self._header_size)
+
+    async def _open(self, band: BandInfo, ctx: Any) -> AIOReader:
+        if isinstance(ctx, HeaderCache) and ctx.loop is self._loop:
+            img = await ctx.get(band.uri, self._parse_header)
+        else:
+            img = await self._parse_header(band.uri)
+
+        bidx = 1 if band.band is None else band.band
+        if not 1 <= bidx <= img.levels[0].samples:
+            raise ValueError("No band {} in {}".format(bidx, band.uri))
+
+        return AIOReader(img, bidx, self,
+                         crs=img.crs or band.crs,
+                         transform=img.transform or band.transform,
+                         nodata=img.nodata if img.nodata is not None else band.nodata)
+
+    async def read(self,
+                   img: SimpleNamespace,
+                   bands: List[int],
+                   window: Optional[RasterWindow],
+                   out_shape: Optional[RasterShape],
+                   nodata: Optional[Union[float, int]]) -> np.ndarray:
+        """ Read ``window`` of ``bands`` (0 based), decimating to ``out_shape`` with nearest neighbour.
+
+        Decimated reads use the coarsest overview that is not coarser than requested, like GDAL.
+        """
+        # pylint: disable=too-many-locals
+        H, W = img.levels[0].shape
+        (r0, r1), (c0, c1) = _roi_to_window(window, (H, W)) or ((0, H), (0, W))
+        oh, ow = out_shape or (r1 - r0, c1 - c0)
+        if (oh, ow) == (r1 - r0, c1 - c0):
+            return await self._read_level(img, 0, bands, (r0, r1), (c0, c1), nodata)
+
+        scale = min((r1 - r0)/oh, (c1 - c0)/ow)
+        candidates = [(f, i) for i, f in enumerate(img.overviews, 1) if f <= scale*(1 + 1e-3)]
+        li = max(candidates)[1] if candidates else 0
+
+        lh, lw = img.levels[li].shape
+        ys = np.floor((r0 + (np.arange(oh) + 0.5)*(r1 - r0)/oh)*lh/H).astype('int64').clip(0, lh - 1)
+        xs = np.floor((c0 + (np.arange(ow) + 0.5)*(c1 - c0)/ow)*lw/W).astype('int64').clip(0, lw - 1)
+        y0, x0 = int(ys[0]), int(xs[0])
+        pix = await self._read_level(img, li, bands, (y0, int(ys[-1]) + 1), (x0, int(xs[-1]) + 1), nodata)
+        return pix[:, ys - y0][:, :, xs - x0]
+
+    async def _read_level(self,
+                          img: SimpleNamespace,
+                          li: int,
+                          bands: List[int],
+                          rows: Tuple[int, int],
+                          cols: Tuple[int, int],
+                          nodata: Optional[Union[float, int]]) -> np.ndarray:
+        # pylint: disable=too-many-locals
+        lvl = img.levels[li]
+        (r0, r1), (c0, c1) = rows, cols
+        th, tw = lvl.tile_shape
+        nty, ntx = lvl.ntiles
+        out = np.empty((len(bands), r1 - r0, c1 - c0), dtype=lvl.dtype.newbyteorder('='))
+
+        # (tile row, tile column, output planes, band selection for decode_tile)
+        tiles = []
+        for ti in range(r0//th, -(-r1//th)):
+            for tj in range(c0//tw, -(-c1//tw)):
+                if lvl.planar == 2:
+                    tiles.extend((ti, tj, [k], b*nty*ntx + ti*ntx + tj, None) for k, b in enumerate(bands))
+                else:
+                    tiles.append((ti, tj, slice(None), ti*ntx + tj, bands))
+
+        sparse = [t for t in tiles if lvl.counts[t[3]] == 0]
+        tiles = [t for t in tiles if lvl.counts[t[3]] > 0]
+        ranges = [(int(lvl.offsets[t[3]]), int(lvl.offsets[t[3]] + lvl.counts[t[3]])) for t in tiles]
+        merged = coalesce_ranges(ranges, self._gap, self._max_range)
+        blobs = await asyncio.gather(*[self._fetch(img.url, start, end) for (start, end), _ in merged])
+
+        decoded = []
+        for ((start, _), idx), blob in zip(merged, blobs):
+            for i in idx:
+                a, b = ranges[i]
+                decoded.append((tiles[i], self._loop.run_in_executor(self._pool, decode_tile,
+                                                                     blob[a - start:b - start], lvl, tiles[i][4])))
+
+        def paste(tile, pix):
+            ti, tj, planes = tile[:3]
+            ys, ye = max(r0, ti*th), min(r1, (ti + 1)*th)
+            xs, xe = max(c0, tj*tw), min(c1, (tj + 1)*tw)
+            if pix is None:
+                out[planes, ys - r0:ye - r0, xs - c0:xe - c0] = 0 if nodata is None else nodata
+            else:
+                out[planes, ys - r0:ye - r0, xs - c0:xe - c0] = pix[:, ys - ti*th:ye - ti*th, xs - tj*tw:xe - tj*tw]
+
+        for tile in sparse:
+            paste(tile, None)
+        for tile, pix in zip([t for t, _ in decoded], await asyncio.gather(*[f for _, f in decoded])):
+            paste(tile, pix)
+
+        return out
+
+
+class RDEntry(ReaderDriverEntry):
+    PROTOCOLS = ['http', 'https', 's3']
+    FORMATS = ['GeoTIFF']
+
+    @property
+    def protocols(self) -> List[str]:
+        return RDEntry.PROTOCOLS
+
+    @property
+    def formats(self) -> List[str]:
+        return RDEntry.FORMATS
+
+    def supports(self, protocol: str, fmt: str) -> bool:
+        return protocol in RDEntry.PROTOCOLS and fmt in RDEntry.FORMATS
+
+    def new_instance(self, cfg: dict) -> ReaderDriver:
+        cfg = cfg.copy()
+        pool = cfg.pop('pool', None)
+        if pool is None:
+            max_workers = cfg.pop('max_workers', os.cpu_count() or 1)
+            pool = ThreadPoolExecutor(max_workers=max_workers)
+        elif not isinstance(pool, ThreadPoolExecutor):
+            if not cfg.pop('allow_custom_pool', False):
+                raise ValueError("External `pool` should be a `ThreadPoolExecutor`")
+
+        return AIORdrDriver(pool, cfg)
@@ -0,0 +1,273 @@
+# This file is part of the Open Data Cube, see https://opendatacube.org for more information
+#
+# Copyright (c) 2015-2020 ODC Contributors
+# SPDX-License-Identifier: Apache-2.0
+""" Parsing of (Big)TIFF headers and decoding of tiles, just enough for Cloud Optimized GeoTIFFs
+"""
+import struct
+import zlib
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from affine import Affine
+
+from datacube.utils.geometry import CRS
+
+Fetch = Callable[[int, int], Awaitable[bytes]]  # pylint: disable=invalid-name
+
+# Baseline, tiling and GeoTIFF tags we need
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIG = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+MODEL_TRANSFORMATION = 34264
+GEO_KEY_DIRECTORY = 34735
+GDAL_NODATA = 42113
+
+_TAGS = {NEW_SUBFILE_TYPE, IMAGE_WIDTH, IMAGE_LENGTH, BITS_PER_SAMPLE, COMPRESSION, STRIP_OFFSETS,
+         SAMPLES_PER_PIXEL, ROWS_PER_STRIP, STRIP_BYTE_COUNTS, PLANAR_CONFIG, PREDICTOR, TILE_WIDTH,
+         TILE_LENGTH, TILE_OFFSETS, TILE_BYTE_COUNTS, SAMPLE_FORMAT, MODEL_PIXEL_SCALE, MODEL_TIEPOINT,
+         MODEL_TRANSFORMATION, GEO_KEY_DIRECTORY, GDAL_NODATA}
+
+# TIFF field type -> numpy type code, RATIONAL types are read as pairs of integers
+_FIELD_TYPES = {1: 'u1', 2: 'S1', 3: 'u2', 4: 'u4', 5: 'u4', 6: 'i1', 7: 'u1', 8: 'i2',
+                9: 'i4', 10: 'i4', 11: 'f4', 12: 'f8', 16: 'u8', 17: 'i8', 18: 'u8'}
+_N_VALUES = {5: 2, 10: 2}
+
+COMPRESSION_NONE = 1
+COMPRESSION_DEFLATE = (8, 32946)
+SUPPORTED_COMPRESSION = (COMPRESSION_NONE,) + COMPRESSION_DEFLATE
+
+_PIXEL_IS_POINT = 2
+_USER_DEFINED = 32767
+
+
+def _scalar(tags: Dict[int, Any], tag: int, default: Optional[int] = None) -> Optional[int]:
+    v = tags.get(tag, None)
+    return default if v is None else int(v[0])
+
+
+class UnsupportedTiff(ValueError):
+    """ Raised for TIFF files using features this reader doesn't implement.
+    """
+
+
+async def _read_ifds(header: bytes, fetch: Fetch) -> Tuple[str, List[Dict[int, Any]]]:
+    """ Parse all image file directories, fetching bytes outside of ``header`` as needed.
+
+    :returns: (numpy byte order character, tags of every IFD)
+    """
+    # pylint: disable=too-many-locals
+    if header[:2] == b'II':
+        bo = '<'
+    elif header[:2] == b'MM':
+        bo = '>'
+    else:
+        raise UnsupportedTiff("Not a TIFF file")
+
+    async def get(offset: int, n: int) -> bytes:
+        if offset + n <= len(header):
+            return header[offset:offset + n]
+        return await fetch(offset, offset + n)
+
+    magic, = struct.unpack(bo + 'H', header[2:4])
+    if magic == 42:
+        nfmt, ofmt, osz = 'H', 'I', 4
+        ifd_offset, = struct.unpack(bo + 'I', header[4:8])
+    elif magic == 43:
+        nfmt, ofmt, osz = 'Q', 'Q', 8
+        ifd_offset, = struct.unpack(bo + 'Q', header[8:16])
+    else:
+        raise UnsupportedTiff("Not a TIFF file")
+
+    nsz = struct.calcsize(nfmt)
+    esz = 4 + 2*osz
+    ifds = []
+    while ifd_offset:
+        n_entries, = struct.unpack(bo + nfmt, await get(ifd_offset, nsz))
+        raw = await get(ifd_offset + nsz, n_entries*esz + osz)
+
+        tags = {}
+        for i in range(n_entries):
+            entry = raw[i*esz:(i + 1)*esz]
+            tag, ftype = struct.unpack(bo + 'HH', entry[:4])
+            count, = struct.unpack(bo + ofmt, entry[4:4 + osz])
+            if tag not in _TAGS or ftype not in _FIELD_TYPES:
+                continue
+
+            dtype = np.dtype(bo + _FIELD_TYPES[ftype])
+            nbytes = count*dtype.itemsize*_N_VALUES.get(ftype, 1)
+            if nbytes <= osz:
+                data = entry[4 + osz:4 + osz + nbytes]
+            else:
+                offset, = struct.unpack(bo + ofmt, entry[4 + osz:])
+                data = await get(offset, nbytes)
+
+            if ftype == 2:
+                tags[tag] = data.split(b'\0')[0].decode('ascii')
+            else:
+                tags[tag] = np.frombuffer(data, dtype=dtype)
+
+        ifds.append(tags)
+        ifd_offset, = struct.unpack(bo + ofmt, raw[n_entries*esz:])
+
+    return bo, ifds
+
+
+def _dtype(tags: Dict[int, Any], bo: str) -> np.dtype:
+    bits = set(tags.get(BITS_PER_SAMPLE, [1]))
+    fmts = set(tags.get(SAMPLE_FORMAT, [1]))
+    if len(bits) != 1 or len(fmts) != 1:
+        raise UnsupportedTiff("Bands with different data types")
+
+    nbits, fmt = bits.pop(), fmts.pop()
+    kind = {1: 'u', 2: 'i', 3: 'f'}.get(fmt, None)
+    if kind is None or nbits not in (8, 16, 32, 64):
+        raise UnsupportedTiff("Unsupported sample format {}, {} bits".format(fmt, nbits))
+
+    return np.dtype('{}{}{}'.format(bo, kind, nbits//8))
+
+
+def _level(tags: Dict[int, Any], bo: str) -> SimpleNamespace:
+    """ Image geometry and tile index of one IFD.
+    """
+    shape = (_scalar(tags, IMAGE_LENGTH), _scalar(tags, IMAGE_WIDTH))
+    if TILE_OFFSETS in tags:
+        tile_shape = (_scalar(tags, TILE_LENGTH), _scalar(tags, TILE_WIDTH))
+        offsets, counts = tags[TILE_OFFSETS], tags.get(TILE_BYTE_COUNTS, None)
+    else:
+        tile_shape = (min(_scalar(tags, ROWS_PER_STRIP, shape[0]), shape[0]), shape[1])
+        offsets, counts = tags[STRIP_OFFSETS], tags.get(STRIP_BYTE_COUNTS, None)
+
+    compression = _scalar(tags, COMPRESSION, COMPRESSION_NONE)
+    predictor = _scalar(tags, PREDICTOR, 1)
+    if compression not in SUPPORTED_COMPRESSION:
+        raise UnsupportedTiff("Unsupported compression: {}".format(compression))
+    if predictor not in (1, 2, 3):
+        raise UnsupportedTiff("Unsupported predictor: {}".format(predictor))
+    if counts is None:
+        raise UnsupportedTiff("Missing byte counts")
+
+    return SimpleNamespace(shape=shape,
+                           tile_shape=tile_shape,
+                           ntiles=tuple(-(-n//t) for n, t in zip(shape, tile_shape)),
+                           dtype=_dtype(tags, bo),
+                           samples=_scalar(tags, SAMPLES_PER_PIXEL, 1),
+                           planar=_scalar(tags, PLANAR_CONFIG, 1),
+                           compression=compression,
+                           predictor=predictor,
+                           offsets=offsets.astype('int64'),
+                           counts=counts.astype('int64'))
+
+
+def _geokeys(tags: Dict[int, Any]) -> Dict[int, int]:
+    keys = tags.get(GEO_KEY_DIRECTORY, None)
+    if keys is None:
+        return {}
+    keys = keys.reshape(-1, 4)
+    # only keys with value stored in place, that's all we need
+    return {int(k): int(v) for k, loc, _, v in keys[1:1 + int(keys[0][3])] if loc == 0}
+
+
+def _transform(tags: Dict[int, Any], geokeys: Dict[int, int]) -> Optional[Affine]:
+    if MODEL_TRANSFORMATION in tags:
+        m = tags[MODEL_TRANSFORMATION]
+        tr = Affine(m[0], m[1], m[3], m[4], m[5], m[7])
+    elif MODEL_PIXEL_SCALE in tags and MODEL_TIEPOINT in tags:
+        sx, sy = tags[MODEL_PIXEL_SCALE][:2]
+        i, j, _, x, y, _ = tags[MODEL_TIEPOINT][:6]
+        tr = Affine(sx, 0, x - i*sx, 0, -sy, y + j*sy)
+    else:
+        return None
+
+    if geokeys.get(1025, None) == _PIXEL_IS_POINT:
+        tr = tr*Affine.translation(-0.5, -0.5)
+    return tr
+
+
+def _crs(geokeys: Dict[int, int]) -> Optional[CRS]:
+    for key in (3072, 2048):  # ProjectedCSTypeGeoKey, GeographicTypeGeoKey
+        code = geokeys.get(key, None)
+        if code is not None and 0 < code < _USER_DEFINED:
+            return CRS('epsg:{}'.format(code))
+    return None
+
+
+async def read_cog_header(url: str, fetch: Fetch, header_size: int) -> SimpleNamespace:
+    """ Parse GeoTIFF header.
+
+    :param fetch: ``await fetch(start, end)`` returns bytes of the file
+    :param header_size: Bytes to fetch up-front, more is fetched if header doesn't fit
+    :returns: Namespace with ``url``, ``byteorder``, ``levels`` (full resolution image then overviews,
+              see :func:`_level`), ``overviews`` (factors), ``crs``, ``transform`` and ``nodata``
+    :raises: :class:`UnsupportedTiff`
+    """
+    header = await fetch(0, header_size)
+    bo, ifds = await _read_ifds(header, fetch)
+
+    # skip masks
+    ifds = [tags for tags in ifds if not _scalar(tags, NEW_SUBFILE_TYPE, 0) & 4]
+    if not ifds:
+        raise UnsupportedTiff("No images in TIFF file")
+
+    levels = [_level(tags, bo) for tags in ifds]
+    full = levels[0]
+    levels = [full] + [lvl for lvl in levels[1:]
+                       if lvl.samples == full.samples and lvl.shape[1] < full.shape[1]]
+    geokeys = _geokeys(ifds[0])
+    nodata = ifds[0].get(GDAL_NODATA, None)
+
+    return SimpleNamespace(url=url,
+                           byteorder=bo,
+                           levels=levels,
+                           overviews=tuple(int(round(full.shape[1]/lvl.shape[1])) for lvl in levels[1:]),
+                           crs=_crs(geokeys),
+                           transform=_transform(ifds[0], geokeys),
+                           nodata=None if not nodata else float(nodata))
+
+
+def decode_tile(data: bytes, level: SimpleNamespace, bands: Optional[List[int]] = None) -> np.ndarray:
+    """ Decompress and un-predict one tile.
+
+    :param bands: 0 based sample indexes to pick from pixel interleaved tiles, ``None`` for band
+                  interleaved tiles, which only have one
+    :returns: Array of shape ``(nbands, rows, level.tile_shape[1])`` in native byte order, ``rows``
+              is less than tile height for the last strip of striped files
+    """
+    th, tw = level.tile_shape
+    spp = level.samples if bands is not None else 1
+    dtype = level.dtype
+
+    if level.compression in COMPRESSION_DEFLATE:
+        data = zlib.decompress(data)
+
+    # last strip only stores rows that are inside the image
+    th = min(th, len(data)//(tw*spp*dtype.itemsize))
+    if level.predictor == 3:
+        # floating point predictor: bytes are differenced, then stored most significant byte planes first
+        raw = np.frombuffer(data, dtype='uint8', count=th*tw*spp*dtype.itemsize).reshape(th, -1, spp)
+        raw = np.cumsum(raw, axis=1, dtype='uint8')
+        raw = raw.reshape(th, dtype.itemsize, tw*spp).transpose(0, 2, 1)
+        pix = np.ascontiguousarray(raw).view(dtype.newbyteorder('>')).reshape(th, tw, spp)
+    else:
+        pix = np.frombuffer(data, dtype=dtype, count=th*tw*spp).reshape(th, tw, spp)
+        if level.predictor == 2:
+            pix = np.cumsum(pix, axis=1, dtype=dtype)
+
+    pix = pix.astype(dtype.newbyteorder('='), copy=False)
+    return np.moveaxis(pix[:, :, bands if bands is not None else [0]], 2, 0)
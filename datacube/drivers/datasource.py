@@ -48,6 +48,14 @@ class GeoRasterReader(object, metaclass=ABCMeta):
     def nodata(self) -> Optional[Union[int, float]]:
         ...  # pragma: no cover
 
+    @property
+    def overviews(self) -> Tuple[int, ...]:
+        """ Available overview (decimation) factors, sorted from finest to coarsest.
+
+        Empty if there are no overviews or reader doesn't know about them.
+        """
+        return ()
+
     @abstractmethod
     def read(self,
              window: Optional[RasterWindow] = None,
@@ -0,0 +1,232 @@
+# This file is part of the Open Data Cube, see https://opendatacube.org for more information
+#
+# Copyright (c) 2015-2020 ODC Contributors
+# SPDX-License-Identifier: Apache-2.0
+""" Reader driver for NetCDF/HDF5 files that opens and reads them in worker processes.
+
+HDF5 library is generally not thread safe, so within one process all access to
+NetCDF files is serialised (see ``HDF5_LOCK``, GDAL's netCDF driver has a global
+lock of its own too). Worker processes each have their own copy of the library and
+their own open file handles, so reads from NetCDF storage units run in parallel.
+"""
+import multiprocessing
+import os
+import sys
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Any, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from affine import Affine
+
+from datacube.storage import BandInfo
+from datacube.utils.geometry import CRS
+from datacube.drivers._types import (
+    ReaderDriverEntry,
+    ReaderDriver,
+    GeoRasterReader,
+    FutureGeoRasterReader,
+    FutureNdarray,
+    RasterShape,
+    RasterWindow,
+)
+from datacube.drivers.rio._reader import (
+    DEFAULT_MAX_OPEN_FILES,
+    FileHandleCache,
+    pick,
+    _compute_overrides,
+    _dc_crs,
+    _read,
+    _read_multi,
+    _rio_band_idx,
+    _rio_uri,
+)
+
+RasterInfo = NamedTuple('RasterInfo', [('uri', str),
+                                       ('band_idx', int),
+                                       ('crs', Optional[CRS]),
+                                       ('transform', Optional[Affine]),
+                                       ('shape', RasterShape),
+                                       ('dtype', str),
+                                       ('nodata', Optional[Union[int, float]]),
+                                       ('overviews', Tuple[int, ...])])
+
+# Open files of a worker process
+_FILES = None  # type: Optional[FileHandleCache]
+
+
+def _worker_files(max_open: int) -> FileHandleCache:
+    global _FILES  # pylint: disable=global-statement
+    if _FILES is None or _FILES.max_open != max_open:
+        _FILES = FileHandleCache(max_open)
+    return _FILES
+
+
+def _worker_open(band: BandInfo, max_open: int) -> RasterInfo:
+    """ Runs in a worker process: open file, or re-use already open one, and describe the band.
+    """
+    uri = _rio_uri(band)
+    src, _ = _worker_files(max_open).checkout(uri)
+    bidx = _rio_band_idx(band, src)
+    overrides = _compute_overrides(src, band)
+
+    transform = pick(overrides.transform, src.transform)
+    if transform is not None and transform.is_identity:
+        transform = None
+
+    return RasterInfo(uri=uri,
+                      band_idx=bidx,
+                      crs=overrides.crs or _dc_crs(src.crs),
+                      transform=transform,
+                      shape=src.shape,
+                      dtype=src.dtypes[bidx-1],
+                      nodata=pick(overrides.nodata, src.nodatavals[bidx-1]),
+                      overviews=tuple(sorted(src.overviews(bidx))))
+
+
+def _worker_read(uri: str,
+                 bidx: Union[int, List[int]],
+                 window: Optional[RasterWindow],
+                 out_shape: Optional[RasterShape],
+                 max_open: int) -> np.ndarray:
+    """ Runs in a worker process, workers run one task at a time so no locking is needed.
+    """
+    src, _ = _worker_files(max_open).checkout(uri)
+    if isinstance(bidx, list):
+        return _read_multi(src, bidx, window, out_shape)
+    return _read(src, bidx, window, out_shape)
+
+
+class ProcReader(GeoRasterReader):
+    """ Band of a file opened in a worker process, pixels are read there and sent back.
+    """
+
+    def __init__(self, info: RasterInfo, procs: Executor, max_open: int):
+        self._info = info
+        self._procs = procs
+        self._max_open = max_open
+
+    @property
+    def crs(self) -> Optional[CRS]:
+        return self._info.crs
+
+    @property
+    def transform(self) -> Optional[Affine]:
+        return self._info.transform
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self._info.dtype)
+
+    @property
+    def shape(self) -> RasterShape:
+        return self._info.shape
+
+    @property
+    def nodata(self) -> Optional[Union[int, float]]:
+        return self._info.nodata
+
+    @property
+    def overviews(self) -> Tuple[int, ...]:
+        return self._info.overviews
+
+    @property
+    def multiband_key(self) -> str:
+        # time slices of a NetCDF variable are bands of the same file
+        return self._info.uri
+
+    def read(self,
+             window: Optional[RasterWindow] = None,
+             out_shape: Optional[RasterShape] = None) -> FutureNdarray:
+        return self._procs.submit(_worker_read, self._info.uri, self._info.band_idx,
+                                  window, out_shape, self._max_open)
+
+    def read_multi(self,
+                   others: Sequence[GeoRasterReader],
+                   window: Optional[RasterWindow] = None,
+                   out_shape: Optional[RasterShape] = None) -> FutureNdarray:
+        # pylint: disable=protected-access
+        bidxs = [self._info.band_idx]
+        for rdr in others:
+            if not isinstance(rdr, ProcReader) or rdr._info.uri != self._info.uri:
+                raise ValueError("Can only read bands of the same file together")
+            bidxs.append(rdr._info.band_idx)
+
+        return self._procs.submit(_worker_read, self._info.uri, bidxs,
+                                  window, out_shape, self._max_open)
+
+
+class ProcRdrDriver(ReaderDriver):
+    """ Reader driver that opens and reads files in a pool of worker processes.
+
+    Recognised ``cfg`` options:
+
+    - ``max_open_files``: number of open file handles kept by each worker process
+    """
+
+    def __init__(self, procs: Executor, cfg: dict):
+        self._procs = procs
+        self._cfg = cfg
+        self._max_open = max(1, cfg.get('max_open_files', DEFAULT_MAX_OPEN_FILES))
+
+    def new_load_context(self,
+                         bands: Iterable[BandInfo],
+                         old_ctx: Optional[Any]) -> Any:
+        # open files are kept by the worker processes
+        return None
+
+    def open(self, band: BandInfo, ctx: Any) -> FutureGeoRasterReader:
+        out = Future()  # type: Future
+
+        def on_open(fut):
+            try:
+                info = fut.result()
+            except Exception as e:  # pylint: disable=broad-except
+                out.set_exception(e)
+                return
+            out.set_result(ProcReader(info, self._procs, self._max_open))
+
+        self._procs.submit(_worker_open, band, self._max_open).add_done_callback(on_open)
+        return out
+
+
+def _new_process_pool(max_workers: int, start_method: str) -> ProcessPoolExecutor:
+    if sys.version_info < (3, 7):
+        return ProcessPoolExecutor(max_workers=max_workers)
+
+    # forking a process with HDF5 library state or running threads is not safe, default is 'spawn'
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context(start_method))
+
+
+class RDEntry(ReaderDriverEntry):
+    PROTOCOLS = ['file']
+    FORMATS = ['NetCDF', 'HDF5']
+
+    @property
+    def protocols(self) -> List[str]:
+        return RDEntry.PROTOCOLS
+
+    @property
+    def formats(self) -> List[str]:
+        return RDEntry.FORMATS
+
+    def supports(self, protocol: str, fmt: str) -> bool:
+        return protocol in RDEntry.PROTOCOLS and fmt in RDEntry.FORMATS
+
+    def new_instance(self, cfg: dict) -> ReaderDriver:
+        """ Recognised ``cfg`` options, other than those of :class:`ProcRdrDriver`:
+
+        - ``pool``: :class:`~concurrent.futures.ProcessPoolExecutor` to use
+        - ``max_workers``: number of worker processes to start, defaults to number of CPUs
+        - ``start_method``: ``multiprocessing`` start method of worker processes, ``"spawn"`` by default
+        """
+        cfg = cfg.copy()
+        pool = cfg.pop('pool', None)
+        if pool is None:
+            max_workers = cfg.pop('max_workers', os.cpu_count() or 1)
+            pool = _new_process_pool(max_workers, cfg.pop('start_method', 'spawn'))
+        elif not isinstance(pool, ProcessPoolExecutor):
+            if not cfg.pop('allow_custom_pool', False):
+                raise ValueError("External `pool` should be a `ProcessPoolExecutor`")
+
+        return ProcRdrDriver(pool, cfg)
@@ -5,9 +5,11 @@
 """ reader
 """
 from typing import (
-    List, Optional, Union, Any, Iterable,
+    List, Optional, Union, Any, Iterable, Hashable, Sequence,
     Tuple, NamedTuple, TypeVar
 )
+import threading
+from collections import OrderedDict
 import numpy as np
 from affine import Affine
 from concurrent.futures import ThreadPoolExecutor
@@ -16,11 +18,17 @@ from rasterio.io import DatasetReader
 import rasterio.crs
 
 from datacube.storage import BandInfo
+from datacube.storage._rio import maybe_lock
 from datacube.utils.geometry import CRS
 from datacube.utils import (
     uri_to_local_path,
     get_part_from_uri,
 )
+from datacube.drivers._blockcache import (
+    BlockCache, DiskBlockCache,
+    REMOTE_SCHEMES, read_blocks_multi, shared_block_cache, shared_disk_cache,
+)
+from datacube.drivers._readpolicy import DEFAULT_ATTEMPT_WORKERS, ReadPolicy
 from datacube.drivers._types import (
     ReaderDriverEntry,
     ReaderDriver,
@@ -38,6 +46,8 @@ Overrides = NamedTuple('Overrides', [('crs', Optional[CRS]),
 RioWindow = Tuple[Tuple[int, int], Tuple[int, int]]  # pylint: disable=invalid-name
 T = TypeVar('T')
 
+DEFAULT_MAX_OPEN_FILES = 64
+
 
 def pick(a: Optional[T], b: Optional[T]) -> Optional[T]:
     """ Return first non-None value or None if all are None
@@ -86,10 +96,49 @@ def _dc_crs(crs: Optional[rasterio.crs.CRS]) -> Optional[CRS]:
 def _read(src: DatasetReader,
           bidx: int,
           window: Optional[RasterWindow],
-          out_shape: Optional[RasterShape]) -> np.ndarray:
-    return src.read(bidx,
-                    window=_roi_to_window(window, src.shape),
-                    out_shape=out_shape)
+          out_shape: Optional[RasterShape],
+          lock: Optional[threading.Lock] = None) -> np.ndarray:
+    if lock is None:
+        return src.read(bidx,
+                        window=_roi_to_window(window, src.shape),
+                        out_shape=out_shape)
+
+    # shared file handle, GDAL dataset handles are not safe for concurrent access
+    with lock:
+        return src.read(bidx,
+                        window=_roi_to_window(window, src.shape),
+                        out_shape=out_shape)
+
+
+def _read_multi(src: DatasetReader,
+                bidxs: List[int],
+                window: Optional[RasterWindow],
+                out_shape: Optional[RasterShape],
+                lock: Optional[threading.Lock] = None) -> np.ndarray:
+    if out_shape is not None:
+        out_shape = (len(bidxs), *out_shape)
+
+    if lock is None:
+        return src.read(bidxs,
+                        window=_roi_to_window(window, src.shape),
+                        out_shape=out_shape)
+
+    with lock:
+        return src.read(bidxs,
+                        window=_roi_to_window(window, src.shape),
+                        out_shape=out_shape)
+
+
+def _read_fresh(uri: str,
+                bidx: Union[int, List[int]],
+                window: Optional[RasterWindow],
+                out_shape: Optional[RasterShape]) -> np.ndarray:
+    """ Read from a newly opened file handle, used for retries and hedged reads.
+    """
+    with rasterio.open(uri, 'r') as src:
+        if isinstance(bidx, list):
+            return _read_multi(src, bidx, window, out_shape)
+        return _read(src, bidx, window, out_shape)
 
 
 def _rio_uri(band: BandInfo) -> str:
@@ -131,7 +180,12 @@ class RIOReader(GeoRasterReader):
                  src: DatasetReader,
                  band_idx: int,
                  pool: ThreadPoolExecutor,
-                 overrides: Overrides = Overrides(None, None, None)):
+                 overrides: Overrides = Overrides(None, None, None),
+                 lock: Optional[threading.Lock] = None,
+                 uri: Optional[str] = None,
+                 policy: Optional[ReadPolicy] = None,
+                 cache: Optional[BlockCache] = None,
+                 disk_cache: Optional[DiskBlockCache] = None):
 
         transform = pick(overrides.transform, src.transform)
         if transform is not None and transform.is_identity:
@@ -144,6 +198,16 @@ class RIOReader(GeoRasterReader):
         self._band_idx = band_idx
         self._dtype = src.dtypes[band_idx-1]
         self._pool = pool
+        self._lock = lock
+        self._uri = uri
+        self._policy = policy
+        self._caches = [c for c in (cache, disk_cache) if c is not None]
+
+        # file handle might be shared with readers on other threads
+        with maybe_lock(lock):
+            self._file_overviews = tuple(src.overviews(band_idx))
+            self._block_shape = tuple(src.block_shapes[band_idx-1])
+        self._overviews = tuple(sorted(self._file_overviews))
 
     @property
     def crs(self) -> Optional[CRS]:
@@ -165,10 +229,74 @@ class RIOReader(GeoRasterReader):
     def nodata(self) -> Optional[Union[int, float]]:
         return self._nodata
 
+    @property
+    def overviews(self) -> Tuple[int, ...]:
+        return self._overviews
+
+    @property
+    def multiband_key(self) -> Optional[Hashable]:
+        # readers sharing a file handle can read all their bands in one go
+        return id(self._src)
+
+    def _read_now(self, read, bidx, window, out_shape) -> np.ndarray:
+        if self._policy is None:
+            return read(self._src, bidx, window, out_shape, self._lock)
+
+        def read_again():
+            if self._uri is None:
+                return read(self._src, bidx, window, out_shape, self._lock)
+            return _read_fresh(self._uri, bidx, window, out_shape)
+
+        return self._policy.run(lambda: read(self._src, bidx, window, out_shape, self._lock),
+                                read_again)
+
+    def _read_cached(self, rdrs: List['RIOReader'], window: Optional[RasterWindow],
+                     out_shape: Optional[RasterShape]) -> np.ndarray:
+        # pylint: disable=protected-access
+        assert self._uri is not None
+        bidxs = [rdr._band_idx for rdr in rdrs]
+
+        def read(which, roi, shape):
+            if len(which) == 1:
+                return self._read_now(_read, bidxs[which[0]], roi, shape)[np.newaxis]
+            return self._read_now(_read_multi, [bidxs[i] for i in which], roi, shape)
+
+        return read_blocks_multi(self._caches, [(self._uri, b) for b in bidxs],
+                                 self._src.shape, self._block_shape, self._file_overviews,
+                                 self._dtype, read, window, out_shape)
+
+    def _submit(self, read, rdrs: List['RIOReader'], window, out_shape) -> FutureNdarray:
+        # pylint: disable=protected-access
+        if not self._caches or self._uri is None:
+            bidx = rdrs[0]._band_idx if read is _read else [rdr._band_idx for rdr in rdrs]
+            return self._pool.submit(self._read_now, read, bidx, window, out_shape)
+
+        # bands are read through the cache together when they share block layout
+        layouts = {(rdr._block_shape, rdr._file_overviews) for rdr in rdrs}
+        if len(layouts) > 1:
+            return self._pool.submit(lambda: np.concatenate([self._read_cached([rdr], window, out_shape)
+                                                             for rdr in rdrs]))
+        if read is _read:
+            return self._pool.submit(lambda: self._read_cached(rdrs, window, out_shape)[0])
+        return self._pool.submit(self._read_cached, rdrs, window, out_shape)
+
     def read(self,
              window: Optional[RasterWindow] = None,
              out_shape: Optional[RasterShape] = None) -> FutureNdarray:
-        return self._pool.submit(_read, self._src, self._band_idx, window, out_shape)
+        return self._submit(_read, [self], window, out_shape)
+
+    def read_multi(self,
+                   others: Sequence[GeoRasterReader],
+                   window: Optional[RasterWindow] = None,
+                   out_shape: Optional[RasterShape] = None) -> FutureNdarray:
+        # pylint: disable=protected-access
+        rdrs = [self]
+        for rdr in others:
+            if not isinstance(rdr, RIOReader) or rdr._src is not self._src:
+                raise ValueError("Can only read bands of the same file together")
+            rdrs.append(rdr)
+
+        return self._submit(_read_multi, rdrs, window, out_shape)
 
 
 def _compute_overrides(src: DatasetReader, bi: BandInfo) -> Overrides:
@@ -188,32 +316,176 @@ def _compute_overrides(src: DatasetReader, bi: BandInfo) -> Overrides:
     return Overrides(crs=crs, transform=transform, nodata=nodata)
 
 
-def _rdr_open(band: BandInfo, ctx: Any, pool: ThreadPoolExecutor) -> RIOReader:
+class FileHandleCache:
+    """ Size bounded LRU cache of open :class:`rasterio.io.DatasetReader` handles.
+
+    Handles are keyed by normalised URI (see :func:`_rio_uri`), so several
+    bands stored in one multi-band file, or the same file read for
+    neighbouring tiles, share one open handle. Every handle comes with a lock
+    that must be held while reading from it.
+
+    Evicted handles are not closed explicitly as they might still be in use
+    by a reader, they are closed once the last reader referencing them is
+    garbage collected.
+    """
+
+    def __init__(self, max_open: int = DEFAULT_MAX_OPEN_FILES):
+        if max_open < 1:
+            raise ValueError("max_open should be at least 1")
+
+        self._max_open = max_open
+        self._lock = threading.Lock()
+        self._handles = OrderedDict()  # type: OrderedDict[str, Tuple[DatasetReader, threading.Lock]]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_open(self) -> int:
+        return self._max_open
+
+    @property
+    def hit_rate(self) -> float:
+        """ Fraction of checkouts served from cache, 0 if nothing was checked out yet.
+        """
+        n = self.hits + self.misses
+        return self.hits/n if n > 0 else 0.0
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def __contains__(self, uri: str) -> bool:
+        return uri in self._handles
+
+    def checkout(self, uri: str) -> Tuple[DatasetReader, threading.Lock]:
+        """ Get open file handle for ``uri``, opening it if needed.
+
+        :returns: (file handle, lock to hold while reading from the handle)
+        :raises: Whatever ``rasterio.open`` raises on failure
+        """
+        with self._lock:
+            h = self._handles.get(uri, None)
+            if h is not None:
+                self._handles.move_to_end(uri)
+                self.hits += 1
+                return h
+            self.misses += 1
+
+        # Open without holding the lock, so other files can be opened concurrently
+        src = rasterio.open(uri, 'r')
+
+        with self._lock:
+            h = self._handles.get(uri, None)
+            if h is not None:
+                # Some other thread opened the same file, use theirs
+                self._handles.move_to_end(uri)
+                src.close()
+                return h
+
+            h = (src, threading.Lock())
+            self._handles[uri] = h
+            while len(self._handles) > self._max_open:
+                self._handles.popitem(last=False)
+                self.evictions += 1
+
+        return h
+
+    def clear(self) -> None:
+        """ Drop all cached handles, counters are not reset.
+        """
+        with self._lock:
+            self._handles.clear()
+
+
+def _rdr_open(band: BandInfo, ctx: Any, pool: ThreadPoolExecutor,
+              policy: Optional[ReadPolicy] = None,
+              cache: Optional[BlockCache] = None,
+              disk_cache: Optional[DiskBlockCache] = None) -> RIOReader:
     """ Open file pointed by BandInfo and return RIOReader instance.
 
-        raises Exception on failure
+        When ``ctx`` is a :class:`FileHandleCache` file handles are shared
+        with other readers of the same file. Reads are run according to ``policy``
+        if one is supplied, and served from ``cache`` and ``disk_cache`` of decoded blocks
+        when supplied.
 
-        TODO: start using ctx for handle cache
+        raises Exception on failure
     """
     normalised_uri = _rio_uri(band)
-    src = rasterio.open(normalised_uri, 'r')
+    lock = None
+
+    if isinstance(ctx, FileHandleCache):
+        src, lock = ctx.checkout(normalised_uri)
+    else:
+        src = rasterio.open(normalised_uri, 'r')
+
     bidx = _rio_band_idx(band, src)
+    if band.uri_scheme not in REMOTE_SCHEMES:
+        disk_cache = None
 
-    return RIOReader(src, bidx, pool, _compute_overrides(src, band))
+    return RIOReader(src, bidx, pool, _compute_overrides(src, band), lock=lock,
+                     uri=normalised_uri, policy=policy, cache=cache, disk_cache=disk_cache)
 
 
 class RIORdrDriver(ReaderDriver):
+    """ Reader driver using rasterio.
+
+    Recognised ``cfg`` options:
+
+    - ``max_open_files``: size of the open file handle cache, 0 to disable
+    - ``read_timeout``, ``read_retries``, ``read_backoff``, ``read_hedge_quantile``,
+      ``read_hedge_after``, ``read_max_workers``: see :class:`~datacube.drivers._readpolicy.ReadPolicy`
+    - ``block_cache_size``: bytes of decoded source blocks to keep across loads, 0 (default)
+      disables it. The cache is shared by all drivers in the process, see
+      :func:`~datacube.drivers._blockcache.shared_block_cache`, largest configured size wins
+    - ``disk_cache_dir``, ``disk_cache_size``: local directory to keep decoded blocks of remote
+      files in and its size in bytes (or a string like ``"50GB"``), shared by all processes
+      using the same directory. Defaults come from ``DATACUBE_DISK_CACHE_DIR`` and
+      ``DATACUBE_DISK_CACHE_SIZE`` environment variables, see
+      :class:`~datacube.drivers._blockcache.DiskBlockCache`
+    """
+
     def __init__(self, pool: ThreadPoolExecutor, cfg: dict):
         self._pool = pool
         self._cfg = cfg
+        self._max_open = cfg.get('max_open_files', DEFAULT_MAX_OPEN_FILES)
+        # every driver thread might run an attempt and a hedged attempt at once
+        self._policy = ReadPolicy.from_cfg(cfg, max_workers=max(DEFAULT_ATTEMPT_WORKERS,
+                                                                2*getattr(pool, '_max_workers', 1)))
+        cache_size = cfg.get('block_cache_size', 0)
+        self._block_cache = shared_block_cache(cache_size) if cache_size else None
+        self._disk_cache = shared_disk_cache(cfg.get('disk_cache_dir', None), cfg.get('disk_cache_size', None))
+
+    @property
+    def read_policy(self) -> Optional[ReadPolicy]:
+        return self._policy
+
+    @property
+    def block_cache(self) -> Optional[BlockCache]:
+        return self._block_cache
+
+    @property
+    def disk_cache(self) -> Optional[DiskBlockCache]:
+        return self._disk_cache
 
     def new_load_context(self,
                          bands: Iterable[BandInfo],
                          old_ctx: Optional[Any]) -> Any:
-        return None  # TODO: implement file handle cache with this
+        """ Returns :class:`FileHandleCache`, or ``None`` if ``max_open_files`` was set to 0.
+
+        Previous context is re-used when compatible, so files opened by the
+        previous load are not opened again.
+        """
+        if not self._max_open:
+            return None
+
+        if isinstance(old_ctx, FileHandleCache) and old_ctx.max_open == self._max_open:
+            return old_ctx
+
+        return FileHandleCache(self._max_open)
 
     def open(self, band: BandInfo, ctx: Any) -> FutureGeoRasterReader:
-        return self._pool.submit(_rdr_open, band, ctx, self._pool)
+        return self._pool.submit(_rdr_open, band, ctx, self._pool, self._policy,
+                                 self._block_cache, self._disk_cache)
 
 
 class RDEntry(ReaderDriverEntry):
@@ -23,7 +23,9 @@ from datacube.utils.geometry import (
 EO3_SCHEMA = "https://schemas.opendatacube.org/dataset"
 
 
-def _norm_grid(grid: Dict[str, Any]) -> Any:
+def norm_grid(grid: Dict[str, Any]) -> Any:
+    """ Parse EO3 grid definition into an object with ``.shape`` and ``.transform`` (:class:`Affine`).
+    """
     shape = grid.get('shape')
     transform = grid.get('transform')
     if shape is None or transform is None:
@@ -34,7 +36,7 @@ def _norm_grid(grid: Dict[str, Any]) -> Any:
 
 def grid2points(grid: Dict[str, Any],
                 ring: bool = False) -> CoordList:
-    grid = _norm_grid(grid)
+    grid = norm_grid(grid)
 
     ny, nx = (float(dim) for dim in grid.shape)
     transform = grid.transform
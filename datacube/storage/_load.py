@@ -9,18 +9,26 @@ Important functions are:
 
 """
 import logging
-from collections import OrderedDict
+import os
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager, ExitStack
+from time import monotonic
+from os import PathLike
+from collections import OrderedDict, deque
+from types import SimpleNamespace
 import numpy as np
 from xarray.core.dataarray import DataArray as XrDataArray, DataArrayCoordinates
 from xarray.core.dataset import Dataset as XrDataset
 from typing import (
     Union, Optional, Callable,
-    List, Any, Iterator, Iterable, Mapping, Tuple, Hashable, cast
+    List, Any, Iterator, Iterable, Mapping, Tuple, Hashable, Deque, Dict, cast
 )
 
 from datacube.utils import ignore_exceptions_if
 from datacube.utils.math import invalid_mask
-from datacube.utils.geometry import GeoBox, roi_is_empty
+from datacube.utils.geometry import GeoBox, roi_is_empty, roi_shape
 from datacube.model import Measurement
 from datacube.drivers._types import ReaderDriver
 from . import DataSource, BandInfo
@@ -29,6 +37,9 @@ _LOG = logging.getLogger(__name__)
 
 FuserFunction = Callable[[np.ndarray, np.ndarray], Any]  # pylint: disable=invalid-name
 ProgressFunction = Callable[[int, int], Any]  # pylint: disable=invalid-name
+Allocator = Callable[[Measurement, Tuple[int, ...]], np.ndarray]  # pylint: disable=invalid-name
+
+DEFAULT_MAX_IN_FLIGHT = 16
 
 
 def _default_fuser(dst: np.ndarray, src: np.ndarray, dst_nodata) -> None:
@@ -40,6 +51,133 @@ def _default_fuser(dst: np.ndarray, src: np.ndarray, dst_nodata) -> None:
     np.copyto(dst, src, where=invalid_mask(dst, dst_nodata))
 
 
+def _count_invalid(xx: np.ndarray, nodata) -> int:
+    return int(np.count_nonzero(invalid_mask(xx, nodata)))
+
+
+def _count_invalid_filled(xx: np.ndarray, nodata) -> int:
+    """ Same as :func:`_count_invalid`, but for arrays that were just filled with ``nodata``.
+    """
+    if xx.size == 0:
+        return 0
+    return xx.size if _count_invalid(xx.ravel()[:1], nodata) > 0 else 0
+
+
+def _fuse_and_count(dst: np.ndarray, src: np.ndarray, dst_nodata) -> int:
+    """ Same as :func:`_default_fuser`, but also returns the number of pixels that got filled.
+    """
+    missing = invalid_mask(dst, dst_nodata)
+    n_before = int(np.count_nonzero(missing))
+    np.copyto(dst, src, where=missing)
+    return n_before - _count_invalid(dst, dst_nodata)
+
+
+class LoadMetrics:
+    """ Counters and timers collected while loading data.
+
+    Pass the same object to several loads to accumulate totals. Times are in
+    seconds and are summed across threads, so can exceed wall clock time.
+
+    :ivar files_opened: Number of files opened
+    :ivar bytes_read: Bytes of pixel data requested from readers
+    :ivar reads_paste: Number of reads pasted into destination without resampling
+    :ivar reads_warp: Number of reads that needed reprojecting/resampling
+    :ivar reads_skipped: Number of sources that were never opened because
+                         destination was already fully populated by earlier sources
+    :ivar datasets_broken: Number of sources that failed to open or read, and were skipped
+    :ivar t_open: Time spent opening files
+    :ivar t_read: Time spent reading pixels
+    :ivar t_warp: Time spent in ``warp_affine``/``rio_reproject``
+    :ivar t_fuse: Time spent fusing pixels into destination
+    """
+    COUNTERS = ('files_opened', 'bytes_read', 'reads_paste', 'reads_warp',
+                'reads_skipped', 'datasets_broken')
+    TIMERS = ('t_open', 't_read', 't_warp', 't_fuse')
+
+    def __init__(self):
+        for n in LoadMetrics.COUNTERS:
+            setattr(self, n, 0)
+        for n in LoadMetrics.TIMERS:
+            setattr(self, n, 0.0)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """ Add time spent inside ``with`` block to timer ``name``.
+        """
+        t0 = monotonic()
+        try:
+            yield
+        finally:
+            setattr(self, name, getattr(self, name) + (monotonic() - t0))
+
+    def update(self, other: 'LoadMetrics') -> None:
+        """ Add counts from ``other``, safe to call concurrently.
+        """
+        with self._lock:
+            for n in LoadMetrics.COUNTERS + LoadMetrics.TIMERS:
+                setattr(self, n, getattr(self, n) + getattr(other, n))
+
+    def to_dict(self) -> Dict[str, Union[int, float]]:
+        return {n: getattr(self, n) for n in LoadMetrics.COUNTERS + LoadMetrics.TIMERS}
+
+    @staticmethod
+    def from_dict(counts: Dict[str, Union[int, float]]) -> 'LoadMetrics':
+        """ Inverse of :meth:`to_dict`.
+        """
+        metrics = LoadMetrics()
+        for n in LoadMetrics.COUNTERS + LoadMetrics.TIMERS:
+            setattr(metrics, n, counts.get(n, getattr(metrics, n)))
+        return metrics
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.__dict__.update(state)
+
+    def __repr__(self):
+        return 'LoadMetrics({})'.format(', '.join('{}={}'.format(n, v)
+                                                  for n, v in self.to_dict().items()))
+
+
+@contextmanager
+def _no_timer() -> Iterator[None]:
+    yield
+
+
+def _timer(metrics: Optional[LoadMetrics], name: str):
+    """ ``metrics.timer(name)`` that is a no-op when ``metrics`` is ``None``.
+    """
+    return _no_timer() if metrics is None else metrics.timer(name)
+
+
+@contextmanager
+def _ignore_broken(skip_broken_datasets: bool, metrics: Optional[LoadMetrics]) -> Iterator[None]:
+    """ Same as :func:`ignore_exceptions_if`, but also counts ignored failures.
+    """
+    ok = False
+    with ignore_exceptions_if(skip_broken_datasets):
+        yield
+        ok = True
+
+    if not ok and metrics is not None:
+        metrics.datasets_broken += 1
+
+
+@contextmanager
+def _open_source(source: DataSource, metrics: Optional[LoadMetrics]) -> Iterator[Any]:
+    """ ``source.open()`` that records open time.
+    """
+    with ExitStack() as stack:
+        with _timer(metrics, 't_open'):
+            rdr = stack.enter_context(source.open())
+        if metrics is not None:
+            metrics.files_opened += 1
+        yield rdr
+
+
 def reproject_and_fuse(datasources: List[DataSource],
                        destination: np.ndarray,
                        dst_gbox: GeoBox,
@@ -47,53 +185,81 @@ def reproject_and_fuse(datasources: List[DataSource],
                        resampling: str = 'nearest',
                        fuse_func: Optional[FuserFunction] = None,
                        skip_broken_datasets: bool = False,
-                       progress_cbk: Optional[ProgressFunction] = None):
+                       progress_cbk: Optional[ProgressFunction] = None,
+                       metrics: Optional[LoadMetrics] = None):
     """
     Reproject and fuse `sources` into a 2D numpy array `destination`.
 
+    When using default fuser, sources are no longer opened once every pixel
+    of the `destination` is populated with valid data.
+
     :param datasources: Data sources to open and read from
     :param destination: ndarray of appropriate size to read data into
     :param dst_gbox: GeoBox defining destination region
     :param skip_broken_datasets: Carry on in the face of adversity and failing reads.
     :param progress_cbk: If supplied will be called with 2 integers `Items processed, Total Items`
                          after reading each file.
+    :param metrics: If supplied, I/O counts and timings are added to it
     """
-    # pylint: disable=too-many-locals
-    from ._read import read_time_slice
+    # pylint: disable=too-many-locals,too-many-branches
+    from ._read import read_time_slice, plan_time_slice, read_time_slice_planned, scratch_buffer
     assert len(destination.shape) == 2
 
     def copyto_fuser(dest: np.ndarray, src: np.ndarray) -> None:
         _default_fuser(dest, src, dst_nodata)
 
+    # Only default fuser guarantees that valid pixels are never overwritten
+    track_missing = fuse_func is None
     fuse_func = fuse_func or copyto_fuser
 
     destination.fill(dst_nodata)
     if len(datasources) == 0:
         return destination
     elif len(datasources) == 1:
-        with ignore_exceptions_if(skip_broken_datasets):
-            with datasources[0].open() as rdr:
-                read_time_slice(rdr, destination, dst_gbox, resampling, dst_nodata)
+        with _ignore_broken(skip_broken_datasets, metrics):
+            with _open_source(datasources[0], metrics) as rdr:
+                read_time_slice(rdr, destination, dst_gbox, resampling, dst_nodata, metrics=metrics)
 
         if progress_cbk:
             progress_cbk(1, 1)
 
         return destination
     else:
-        # Multiple sources, we need to fuse them together into a single array
-        buffer_ = np.full(destination.shape, dst_nodata, dtype=destination.dtype)
-        for n_so_far, source in enumerate(datasources, 1):
-            with ignore_exceptions_if(skip_broken_datasets):
-                with source.open() as rdr:
-                    roi = read_time_slice(rdr, buffer_, dst_gbox, resampling, dst_nodata)
+        # Multiple sources, we need to fuse them together into a single array.
+        # Each source is read into per-thread scratch memory sized to the
+        # region it affects, rather than into a full sized buffer.
+        n_missing = _count_invalid_filled(destination, dst_nodata) if track_missing else -1
+        n_skipped = 0
 
-                if not roi_is_empty(roi):
-                    fuse_func(destination[roi], buffer_[roi])
-                    buffer_[roi] = dst_nodata  # clean up for next read
+        for n_so_far, source in enumerate(datasources, 1):
+            if n_missing == 0:
+                # Nothing left to fill, don't even open the file
+                n_skipped += 1
+            else:
+                with _ignore_broken(skip_broken_datasets, metrics):
+                    with _open_source(source, metrics) as rdr:
+                        plan = plan_time_slice(rdr, dst_gbox, resampling)
+                        roi = plan.roi_dst
+                        if not roi_is_empty(roi):
+                            pix = scratch_buffer(roi_shape(roi), destination.dtype, dst_nodata)
+                            read_time_slice_planned(rdr, plan, pix, dst_nodata, metrics=metrics)
+
+                    if not roi_is_empty(roi):
+                        with _timer(metrics, 't_fuse'):
+                            if track_missing:
+                                n_missing -= _fuse_and_count(destination[roi], pix, dst_nodata)
+                            else:
+                                fuse_func(destination[roi], pix)
 
             if progress_cbk:
                 progress_cbk(n_so_far, len(datasources))
 
+        if n_skipped > 0:
+            _LOG.debug("Destination fully populated, skipped %d out of %d sources",
+                       n_skipped, len(datasources))
+            if metrics is not None:
+                metrics.reads_skipped += n_skipped
+
         return destination
 
 
@@ -103,9 +269,63 @@ def _mk_empty_ds(coords: DataArrayCoordinates, geobox: GeoBox) -> XrDataset:
     return XrDataset(coords=cast(Mapping[Hashable, Any], cc), attrs={'crs': geobox.crs})
 
 
+def _remove_file(fname: str) -> None:
+    try:
+        os.unlink(fname)
+    except OSError as e:
+        _LOG.warning("Failed to remove memory mapped output %s: %s", fname, e)
+
+
+def output_allocator(out: Union[Mapping[str, np.ndarray], str, PathLike]) -> Allocator:
+    """ Make function that supplies pixel storage for loaded measurements.
+
+    :param out: Either a mapping from measurement name to a pre-allocated array of the
+                right shape and dtype, measurements missing from the mapping get a newly
+                allocated array. Or a path to a directory in which to create
+                :class:`numpy.memmap` backed arrays, one ``<measurement>-*.dat`` file per
+                measurement, files are deleted once the array is garbage collected.
+
+    :returns: ``alloc(measurement, shape) -> ndarray``, returned array is not initialised
+    """
+    if isinstance(out, Mapping):
+        def from_mapping(m: Measurement, shape: Tuple[int, ...]) -> np.ndarray:
+            dst = out.get(m.name, None)
+            if dst is None:
+                return np.empty(shape, dtype=m.dtype)
+
+            if dst.shape != shape or dst.dtype != np.dtype(m.dtype):
+                raise ValueError("Output for '{}' should be {} {}, got {} {}".format(
+                    m.name, np.dtype(m.dtype).name, shape, dst.dtype.name, dst.shape))
+            return dst
+
+        return from_mapping
+
+    folder = str(out)
+
+    def to_memmap(m: Measurement, shape: Tuple[int, ...]) -> np.ndarray:
+        if int(np.prod(shape)) == 0:
+            # can not memory map empty files
+            return np.empty(shape, dtype=m.dtype)
+
+        fd, fname = tempfile.mkstemp(prefix=m.name + '-', suffix='.dat', dir=folder)
+        os.close(fd)
+        try:
+            dst = np.memmap(fname, dtype=m.dtype, mode='w+', shape=shape)
+        except BaseException:
+            _remove_file(fname)
+            raise
+
+        # views keep a reference to the memmap, so this runs once no view of it is left
+        weakref.finalize(dst, _remove_file, fname)
+        return dst
+
+    return to_memmap
+
+
 def _allocate_storage(coords: DataArrayCoordinates,
                       geobox: GeoBox,
-                      measurements: Iterable[Measurement]) -> XrDataset:
+                      measurements: Iterable[Measurement],
+                      alloc: Optional[Allocator] = None) -> XrDataset:
     xx = _mk_empty_ds(coords, geobox)
     dims = list(xx.coords.keys())
     shape = tuple(xx.sizes[k] for k in dims)
@@ -113,52 +333,197 @@ def _allocate_storage(coords: DataArrayCoordinates,
     for m in measurements:
         name, dtype, attrs = m.name, m.dtype, m.dataarray_attrs()
         attrs['crs'] = geobox.crs
-        data = np.empty(shape, dtype=dtype)
+        data = np.empty(shape, dtype=dtype) if alloc is None else alloc(m, shape)
         xx[name] = XrDataArray(data, coords=xx.coords, dims=dims, name=name, attrs=attrs)
 
     return xx
 
 
+def _nodata_key(nodata) -> Any:
+    """ Hashable stand-in for nodata value, all NaNs compare equal.
+    """
+    if nodata is None:
+        return None
+    if np.isnan(nodata):
+        return 'nan'
+    return nodata
+
+
+def _multiband_key(rdr, m: Measurement) -> Hashable:
+    """ Readers with the same key can be read together and reprojected in one go.
+    """
+    key = getattr(rdr, 'multiband_key', None)
+    if key is None:
+        return ('single', id(rdr))
+
+    from ._read import reader_overviews
+    return (key, rdr.dtype, rdr.shape, rdr.crs, rdr.transform, reader_overviews(rdr),
+            _nodata_key(rdr.nodata), _nodata_key(m.nodata), m.get('resampling_method', 'nearest'))
+
+
 def xr_load(sources: XrDataArray,
             geobox: GeoBox,
             measurements: List[Measurement],
             driver: ReaderDriver,
             driver_ctx_prev: Optional[Any] = None,
-            skip_broken_datasets: bool = False) -> Tuple[XrDataset, Any]:
-    # pylint: disable=too-many-locals
-    from ._read import read_time_slice_v2
+            skip_broken_datasets: bool = False,
+            max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+            metrics: Optional[LoadMetrics] = None,
+            out: Optional[Union[Mapping[str, np.ndarray], str, PathLike]] = None) -> Tuple[XrDataset, Any]:
+    """
+    Load data from grouped datasets using reader ``driver``.
+
+    Opens and reads are pipelined: up to ``max_in_flight`` datasets are being
+    opened or read at any given time, across all time indexes. Pixels are
+    fused into the destination in the same order as without pipelining, so
+    results are identical, ``max_in_flight`` only bounds the number of source
+    images kept in memory.
+
+    Measurements stored as different bands of one file (as reported by
+    :attr:`~datacube.drivers._types.GeoRasterReader.multiband_key`) are read in
+    one pass and reprojected together.
+
+    For measurements using default fuser no further reads are issued for a
+    group once the destination slice is fully populated.
+
+    :param max_in_flight: Maximum number of datasets being opened/read ahead of fusing
+    :param metrics: If supplied, I/O counts and timings are added to it, open and read
+                    times are time spent waiting for background work to complete
+    :param out: Load into these arrays or memory mapped files, see :func:`output_allocator`
+    :returns: (loaded data, load context that can be passed on to the next call)
+    """
+    # pylint: disable=too-many-locals,too-many-statements
+    from ._read import read_time_slice_v2_start, read_time_slice_multi_start
 
-    out = _allocate_storage(sources.coords, geobox, measurements)
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight should be at least 1")
 
-    def all_groups() -> Iterator[Tuple[Measurement, int, List[BandInfo]]]:
-        for idx, dss in np.ndenumerate(sources.values):
-            for m in measurements:
-                bbi = [BandInfo(ds, m.name) for ds in dss]
-                yield (m, idx, bbi)
+    alloc = None if out is None else output_allocator(out)
+    xx = _allocate_storage(sources.coords, geobox, measurements, alloc)
 
-    def just_bands(groups) -> Iterator[BandInfo]:
-        for _, _, bbi in groups:
-            yield from bbi
+    def all_bands() -> Iterator[BandInfo]:
+        for dss in sources.values.ravel():
+            for ds in dss:
+                for m in measurements:
+                    yield BandInfo(ds, m.name)
 
-    groups = list(all_groups())
-    ctx = driver.new_load_context(just_bands(groups), driver_ctx_prev)
+    ctx = driver.new_load_context(all_bands(), driver_ctx_prev)
 
-    # TODO: run upto N concurrently
-    for m, idx, bbi in groups:
-        dst = out.data_vars[m.name].values[idx]
+    def mk_group_state(m: Measurement, idx) -> SimpleNamespace:
+        dst = xx.data_vars[m.name].values[idx]
         dst[:] = m.nodata
-        resampling = m.get('resampling_method', 'nearest')
         fuse_func = m.get('fuser', None)
-
-        for band in bbi:
-            rdr = driver.open(band, ctx).result()
-
-            pix, roi = read_time_slice_v2(rdr, geobox, resampling, m.nodata)
-
-            if pix is not None:
-                if fuse_func:
-                    fuse_func(dst[roi], pix)
+        # -1 means don't track, custom fusers can change valid pixels
+        n_missing = -1 if fuse_func else _count_invalid_filled(dst, m.nodata)
+        return SimpleNamespace(m=m, dst=dst, fuse_func=fuse_func, n_missing=n_missing)
+
+    n_skipped = 0
+
+    def start_read(p: SimpleNamespace, wait: bool) -> None:
+        # Stage 1 -> 2: files are open, issue read requests, one per file
+        nonlocal n_skipped
+        if p.reads is not None:
+            return
+
+        live = [part for part in p.parts if part.grp.n_missing != 0]
+        if not wait and not all(part.fut.done() and part.fut.exception() is None
+                                for part in live):
+            # Errors are only reported when it's this source's turn to be fused
+            return
+
+        n_skipped += len(p.parts) - len(live)
+        p.reads = []
+
+        clusters = OrderedDict()  # type: OrderedDict[Hashable, List[Tuple[SimpleNamespace, Any]]]
+        for part in live:
+            with _ignore_broken(skip_broken_datasets, metrics):
+                with _timer(metrics, 't_open'):
+                    rdr = part.fut.result()
+                if metrics is not None:
+                    metrics.files_opened += 1
+                clusters.setdefault(_multiband_key(rdr, part.grp.m), []).append((part.grp, rdr))
+            part.fut = None
+
+        for cluster in clusters.values():
+            grps = [grp for grp, _ in cluster]
+            rdrs = [rdr for _, rdr in cluster]
+            m = grps[0].m
+            resampling = m.get('resampling_method', 'nearest')
+
+            with _ignore_broken(skip_broken_datasets, metrics):
+                # pixels are fused straight after `finish`, so can re-use scratch memory
+                if len(rdrs) == 1:
+                    fut, finish = read_time_slice_v2_start(rdrs[0], geobox, resampling, m.nodata,
+                                                           use_scratch=True, metrics=metrics)
                 else:
-                    _default_fuser(dst[roi], pix, m.nodata)
-
-    return out, ctx
+                    fut, finish = read_time_slice_multi_start(rdrs, geobox, resampling, m.nodata,
+                                                              use_scratch=True, metrics=metrics)
+                p.reads.append(SimpleNamespace(grps=grps, fut=fut, finish=finish))
+
+    def fuse_one(grp: SimpleNamespace, pix: np.ndarray, roi) -> None:
+        if grp.n_missing == 0:
+            return
+
+        if grp.fuse_func:
+            grp.fuse_func(grp.dst[roi], pix)
+        else:
+            grp.n_missing -= _fuse_and_count(grp.dst[roi], pix, grp.m.nodata)
+
+    def fuse(p: SimpleNamespace) -> None:
+        # Stage 2 -> done: wait for pixels and fuse into destination
+        start_read(p, wait=True)
+
+        for r in p.reads:
+            if all(grp.n_missing == 0 for grp in r.grps):
+                continue
+
+            with _ignore_broken(skip_broken_datasets, metrics):
+                with _timer(metrics, 't_read'):
+                    pix = None if r.fut is None else r.fut.result()
+                pix, roi = r.finish(pix)
+                if pix is None:
+                    continue
+
+                with _timer(metrics, 't_fuse'):
+                    if len(r.grps) == 1:
+                        fuse_one(r.grps[0], pix, roi)
+                    else:
+                        for grp, band_pix in zip(r.grps, pix):
+                            fuse_one(grp, band_pix, roi)
+
+    in_flight = deque()  # type: Deque[SimpleNamespace]
+
+    for idx, dss in np.ndenumerate(sources.values):
+        grps = [mk_group_state(m, idx) for m in measurements]
+
+        for ds in dss:
+            if len(in_flight) >= max_in_flight:
+                # Fuse in submission order, this keeps fusing order the same as sequential load
+                fuse(in_flight.popleft())
+
+            parts = []
+            for grp in grps:
+                if grp.n_missing == 0:
+                    # Destination slice is fully populated, don't open the rest
+                    n_skipped += 1
+                    continue
+                parts.append(SimpleNamespace(grp=grp, fut=driver.open(BandInfo(ds, grp.m.name), ctx)))
+
+            if not parts:
+                continue
+
+            in_flight.append(SimpleNamespace(parts=parts, reads=None))
+            for p in in_flight:
+                start_read(p, wait=False)
+
+    while in_flight:
+        fuse(in_flight.popleft())
+        for p in in_flight:
+            start_read(p, wait=False)
+
+    if n_skipped > 0:
+        _LOG.debug("Skipped %d reads, destination was already fully populated", n_skipped)
+        if metrics is not None:
+            metrics.reads_skipped += n_skipped
+
+    return xx, ctx
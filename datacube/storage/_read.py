@@ -6,7 +6,8 @@
 """
 from affine import Affine
 import numpy as np
-from typing import Tuple
+from types import SimpleNamespace
+from typing import Tuple, Optional, Callable, List
 
 from ..utils.math import is_almost_int, valid_mask
 
@@ -23,6 +24,13 @@ from ..utils.geometry import (
 
 from ..utils.geometry._warp import is_resampling_nn, Resampling, Nodata
 from ..utils.geometry import gbox as gbx
+from ..utils.generic import thread_local_cache
+from ..drivers._types import FutureNdarray
+
+# (future pixels | None, finish), ``finish(pix)`` returns (pixels | None, destination roi)
+ReadStart = Tuple[Optional[FutureNdarray],
+                  Callable[[Optional[np.ndarray]],
+                           Tuple[Optional[np.ndarray], Tuple[slice, slice]]]]
 
 
 def rdr_geobox(rdr) -> GeoBox:
@@ -85,7 +93,22 @@ def can_paste(rr, stol=1e-3, ttol=1e-2):
     return True, None
 
 
-def pick_read_scale(scale: float, rdr=None, tol=1e-3):
+def reader_overviews(rdr) -> Tuple[int, ...]:
+    """ Overview factors available in opened reader object, empty if unknown.
+    """
+    return tuple(getattr(rdr, 'overviews', ()) or ())
+
+
+def pick_read_scale(scale: float, rdr=None, tol=1e-3,
+                    resampling: Resampling = 'nearest') -> int:
+    """ Pick integer scale to read at for a given source->destination ``scale``.
+
+    When reader has overviews and resampling is not nearest neighbour, pick
+    the coarsest overview level that doesn't exceed requested scale, so
+    pixels are read straight from the overview and resampling is done by us
+    with the requested method. For nearest neighbour any integer scale is fine
+    as GDAL will decimate from the best overview level anyway.
+    """
     assert scale > 0
     # First find nearest integer scale
     #    Scale down to nearest integer, unless we can scale up by less than tol
@@ -102,34 +125,126 @@ def pick_read_scale(scale: float, rdr=None, tol=1e-3):
 
     scale = int(scale)
 
-    if rdr is not None:
-        # TODO: check available overviews in rdr
-        pass
+    if rdr is None or is_resampling_nn(resampling):
+        return scale
 
-    return scale
+    overviews = reader_overviews(rdr)
+    if len(overviews) == 0:
+        return scale
 
+    return max((f for f in overviews if f <= scale), default=1)
 
-def read_time_slice(rdr,
-                    dst: np.ndarray,
+
+def scratch_buffer(shape: Tuple[int, ...],
+                   dtype,
+                   fill_value: Optional[Nodata] = None) -> np.ndarray:
+    """ Get re-usable scratch array of a given shape and dtype.
+
+    Memory is allocated once per thread and dtype and is grown as needed, so
+    the same memory is handed out again on the next call from the same
+    thread. Returned array should not be used after that.
+
+    :param fill_value: If supplied fill returned array with this value
+    """
+    dtype = np.dtype(dtype)
+    n = int(np.prod(shape))
+    buffers = thread_local_cache('__dc_scratch_buffers__', {})
+
+    buf = buffers.get(dtype, None)
+    if buf is None or buf.size < n:
+        buf = np.empty(n, dtype=dtype)
+        buffers[dtype] = buf
+
+    out = buf[:n].reshape(shape)
+    if fill_value is not None:
+        out.fill(fill_value)
+    return out
+
+
+def release_scratch_buffers() -> None:
+    """ Release scratch memory held by the current thread.
+    """
+    thread_local_cache('__dc_scratch_buffers__', purge=True)
+
+
+def plan_time_slice(rdr,
                     dst_gbox: GeoBox,
-                    resampling: Resampling,
-                    dst_nodata: Nodata) -> Tuple[slice, slice]:
-    """ From opened reader object read into `dst`
+                    resampling: Resampling) -> SimpleNamespace:
+    """ Figure out what part of `dst_gbox` will be affected by reading from opened reader object.
 
-    :returns: affected destination region
+    :returns: Read plan to pass on to :func:`read_time_slice_planned`,
+              ``.roi_dst`` is the affected region of ``dst_gbox``
     """
-    assert dst.shape == dst_gbox.shape
-    src_gbox = rdr_geobox(rdr)
+    return plan_read(rdr_geobox(rdr), dst_gbox, resampling, rdr)
+
+
+def plan_read(src_gbox: GeoBox,
+              dst_gbox: GeoBox,
+              resampling: Resampling,
+              rdr=None) -> SimpleNamespace:
+    """ Same as :func:`plan_time_slice`, but works from source geobox, so no file needs to be opened.
 
+    :param rdr: Reader object, if available, used for picking overview level only
+    """
     rr = compute_reproject_roi(src_gbox, dst_gbox)
+    plan = SimpleNamespace(rr=rr, roi_dst=rr.roi_dst, paste_ok=False,
+                           src_gbox=src_gbox, dst_gbox=dst_gbox,
+                           resampling=resampling, scale=1, read_shape=(0, 0))
 
     if roi_is_empty(rr.roi_dst):
-        return rr.roi_dst
+        return plan
 
     is_nn = is_resampling_nn(resampling)
-    scale = pick_read_scale(rr.scale, rdr)
+    plan.scale = pick_read_scale(rr.scale, rdr, resampling=resampling)
+    plan.paste_ok, _ = can_paste(rr, ttol=0.9 if is_nn else 0.01)
+
+    if not plan.paste_ok and rr.is_st:
+        # add padding on src/dst ROIs, it was set to tight bounds
+        # TODO: this should probably happen inside compute_reproject_roi
+        rr.roi_dst = roi_pad(rr.roi_dst, 1, dst_gbox.shape)
+        rr.roi_src = roi_pad(rr.roi_src, 1, src_gbox.shape)
+        plan.roi_dst = rr.roi_dst
+
+    # shape of pixels as read from the source
+    if plan.paste_ok:
+        plan.read_shape = roi_shape(rr.roi_dst)
+    elif plan.scale > 1:
+        plan.read_shape = gbx.zoom_out(src_gbox[rr.roi_src], plan.scale).shape
+    else:
+        plan.read_shape = roi_shape(rr.roi_src)
 
-    paste_ok, _ = can_paste(rr, ttol=0.9 if is_nn else 0.01)
+    return plan
+
+
+def _count_read(metrics, rdr, paste_ok: bool, read_shape: Tuple[int, ...]) -> None:
+    if metrics is None:
+        return
+    if paste_ok:
+        metrics.reads_paste += 1
+    else:
+        metrics.reads_warp += 1
+    metrics.bytes_read += int(np.prod(read_shape))*np.dtype(rdr.dtype).itemsize
+
+
+def read_time_slice_planned(rdr,
+                            plan: SimpleNamespace,
+                            dst: np.ndarray,
+                            dst_nodata: Nodata,
+                            metrics=None) -> None:
+    """ Read into `dst` according to `plan` computed by :func:`plan_time_slice`.
+
+    :param dst: Destination array covering ``plan.roi_dst`` only
+    :param metrics: :class:`~datacube.storage._load.LoadMetrics` to update, optional
+    """
+    from ._load import _timer
+
+    rr = plan.rr
+    assert dst.shape == roi_shape(plan.roi_dst)
+
+    if roi_is_empty(plan.roi_dst):
+        return
+
+    _count_read(metrics, rdr, plan.paste_ok, plan.read_shape)
 
     def norm_read_args(roi, shape):
         if roi_is_full(roi, rdr.shape):
@@ -140,12 +255,12 @@ def read_time_slice(rdr,
 
         return w_[roi], shape
 
-    if paste_ok:
+    if plan.paste_ok:
         A = rr.transform.linear
         sx, sy = A.a, A.e
 
-        dst = dst[rr.roi_dst]
-        pix = rdr.read(*norm_read_args(rr.roi_src, dst.shape))
+        with _timer(metrics, 't_read'):
+            pix = rdr.read(*norm_read_args(rr.roi_src, dst.shape))
 
         if sx < 0:
             pix = pix[:, ::-1]
@@ -157,100 +272,172 @@ def read_time_slice(rdr,
         else:
             np.copyto(dst, pix, where=valid_mask(pix, rdr.nodata))
     else:
-        if rr.is_st:
-            # add padding on src/dst ROIs, it was set to tight bounds
-            # TODO: this should probably happen inside compute_reproject_roi
-            rr.roi_dst = roi_pad(rr.roi_dst, 1, dst_gbox.shape)
-            rr.roi_src = roi_pad(rr.roi_src, 1, src_gbox.shape)
-
-        dst = dst[rr.roi_dst]
-        dst_gbox = dst_gbox[rr.roi_dst]
-        src_gbox = src_gbox[rr.roi_src]
-        if scale > 1:
-            src_gbox = gbx.zoom_out(src_gbox, scale)
-
-        pix = rdr.read(*norm_read_args(rr.roi_src, src_gbox.shape))
-
-        if rr.transform.linear is not None:
-            A = (~src_gbox.transform)*dst_gbox.transform
-            warp_affine(pix, dst, A, resampling,
-                        src_nodata=rdr.nodata, dst_nodata=dst_nodata)
-        else:
-            rio_reproject(pix, dst, src_gbox, dst_gbox, resampling,
-                          src_nodata=rdr.nodata, dst_nodata=dst_nodata)
+        dst_gbox = plan.dst_gbox[rr.roi_dst]
+        src_gbox = plan.src_gbox[rr.roi_src]
+        if plan.scale > 1:
+            src_gbox = gbx.zoom_out(src_gbox, plan.scale)
 
-    return rr.roi_dst
+        with _timer(metrics, 't_read'):
+            pix = rdr.read(*norm_read_args(rr.roi_src, src_gbox.shape))
 
+        with _timer(metrics, 't_warp'):
+            if rr.transform.linear is not None:
+                A = (~src_gbox.transform)*dst_gbox.transform
+                warp_affine(pix, dst, A, plan.resampling,
+                            src_nodata=rdr.nodata, dst_nodata=dst_nodata)
+            else:
+                rio_reproject(pix, dst, src_gbox, dst_gbox, plan.resampling,
+                              src_nodata=rdr.nodata, dst_nodata=dst_nodata)
 
-def read_time_slice_v2(rdr,
-                       dst_gbox: GeoBox,
-                       resampling: Resampling,
-                       dst_nodata: Nodata) -> Tuple[np.ndarray,
-                                                    Tuple[slice, slice]]:
+
+def read_time_slice(rdr,
+                    dst: np.ndarray,
+                    dst_gbox: GeoBox,
+                    resampling: Resampling,
+                    dst_nodata: Nodata,
+                    metrics=None) -> Tuple[slice, slice]:
     """ From opened reader object read into `dst`
 
-    :returns: pixels read and ROI of dst_gbox that was affected
+    :returns: affected destination region
+    """
+    assert dst.shape == dst_gbox.shape
+    plan = plan_time_slice(rdr, dst_gbox, resampling)
+    read_time_slice_planned(rdr, plan, dst[plan.roi_dst], dst_nodata, metrics=metrics)
+    return plan.roi_dst
+
+
+def read_time_slice_v2_start(rdr,
+                             dst_gbox: GeoBox,
+                             resampling: Resampling,
+                             dst_nodata: Nodata,
+                             use_scratch: bool = False,
+                             metrics=None) -> ReadStart:
+    """ Issue read request on opened reader object, but don't wait for pixels to arrive.
+
+    Splits :func:`read_time_slice_v2` into two stages, so that many reads can be
+    in flight at the same time.
+
+    :param use_scratch: Reproject into :func:`scratch_buffer` memory rather than a newly
+                        allocated array, pixels returned by ``finish`` are then only valid
+                        until the next ``finish`` call from the same thread.
+    :param metrics: :class:`~datacube.storage._load.LoadMetrics` to update, optional,
+                    read time is not recorded as reads complete in the background
+
+    :returns: (future pixels | None, finish) where ``finish(pix)`` computes the same
+              ``(pixels, roi)`` tuple as returned by :func:`read_time_slice_v2`
+    """
+    return _read_start(rdr, [], dst_gbox, resampling, dst_nodata, use_scratch, metrics)
+
+
+def read_time_slice_multi_start(rdrs: List,
+                                dst_gbox: GeoBox,
+                                resampling: Resampling,
+                                dst_nodata: Nodata,
+                                use_scratch: bool = False,
+                                metrics=None) -> ReadStart:
+    """ Same as :func:`read_time_slice_v2_start`, but for several bands of one raster.
+
+    All readers must share :attr:`~datacube.drivers._types.GeoRasterReader.multiband_key`,
+    and have the same geobox, dtype and nodata. Pixels are read in one pass and reprojected
+    in one go, ``finish`` returns ``(band, y, x)`` array with bands in the same order as ``rdrs``.
     """
-    # pylint: disable=too-many-locals
+    rdr, *others = rdrs
+    return _read_start(rdr, others, dst_gbox, resampling, dst_nodata, use_scratch, metrics)
+
+
+def _read_start(rdr,
+                others: List,
+                dst_gbox: GeoBox,
+                resampling: Resampling,
+                dst_nodata: Nodata,
+                use_scratch: bool,
+                metrics=None) -> ReadStart:
+    # pylint: disable=too-many-locals,too-many-arguments
+    from ._load import _timer
     src_gbox = rdr_geobox(rdr)
 
     rr = compute_reproject_roi(src_gbox, dst_gbox)
 
     if roi_is_empty(rr.roi_dst):
-        return None, rr.roi_dst
+        return None, lambda _: (None, rr.roi_dst)
 
     is_nn = is_resampling_nn(resampling)
-    scale = pick_read_scale(rr.scale, rdr)
+    scale = pick_read_scale(rr.scale, rdr, resampling=resampling)
 
     paste_ok, _ = can_paste(rr, ttol=0.9 if is_nn else 0.01)
 
-    def norm_read_args(roi, shape):
+    def read(roi, shape):
         if roi_is_full(roi, rdr.shape):
             roi = None
 
         if roi is None and shape == rdr.shape:
             shape = None
 
-        return roi, shape
+        _count_read(metrics, rdr, paste_ok, (1 + len(others),) + (shape or rdr.shape))
+        if others:
+            return rdr.read_multi(others, roi, shape)
+        return rdr.read(roi, shape)
 
     if paste_ok:
         read_shape = roi_shape(rr.roi_dst)
         A = rr.transform.linear
         sx, sy = A.a, A.e
 
-        pix = rdr.read(*norm_read_args(rr.roi_src, read_shape)).result()
+        def finish_paste(pix):
+            if sx < 0:
+                pix = pix[..., ::-1]
+            if sy < 0:
+                pix = pix[..., ::-1, :]
 
-        if sx < 0:
-            pix = pix[:, ::-1]
-        if sy < 0:
-            pix = pix[::-1, :]
+            # normalise nodata to be equal to `dst_nodata`
+            if rdr.nodata is not None and rdr.nodata != dst_nodata:
+                pix[pix == rdr.nodata] = dst_nodata
 
-        # normalise nodata to be equal to `dst_nodata`
-        if rdr.nodata is not None and rdr.nodata != dst_nodata:
-            pix[pix == rdr.nodata] = dst_nodata
+            return pix, rr.roi_dst
 
-        dst = pix
-    else:
-        if rr.is_st:
-            # add padding on src/dst ROIs, it was set to tight bounds
-            # TODO: this should probably happen inside compute_reproject_roi
-            rr.roi_dst = roi_pad(rr.roi_dst, 1, dst_gbox.shape)
-            rr.roi_src = roi_pad(rr.roi_src, 1, src_gbox.shape)
-
-        dst_gbox = dst_gbox[rr.roi_dst]
-        src_gbox = src_gbox[rr.roi_src]
-        if scale > 1:
-            src_gbox = gbx.zoom_out(src_gbox, scale)
-
-        dst = np.full(dst_gbox.shape, dst_nodata, dtype=rdr.dtype)
-        pix = rdr.read(*norm_read_args(rr.roi_src, src_gbox.shape)).result()
-
-        if rr.transform.linear is not None:
-            A = (~src_gbox.transform)*dst_gbox.transform
-            warp_affine(pix, dst, A, resampling,
-                        src_nodata=rdr.nodata, dst_nodata=dst_nodata)
+        return read(rr.roi_src, read_shape), finish_paste
+
+    if rr.is_st:
+        # add padding on src/dst ROIs, it was set to tight bounds
+        # TODO: this should probably happen inside compute_reproject_roi
+        rr.roi_dst = roi_pad(rr.roi_dst, 1, dst_gbox.shape)
+        rr.roi_src = roi_pad(rr.roi_src, 1, src_gbox.shape)
+
+    dst_gbox = dst_gbox[rr.roi_dst]
+    src_gbox = src_gbox[rr.roi_src]
+    if scale > 1:
+        src_gbox = gbx.zoom_out(src_gbox, scale)
+
+    dst_shape = ((1 + len(others),) if others else ()) + dst_gbox.shape
+
+    def finish_warp(pix):
+        if use_scratch:
+            dst = scratch_buffer(dst_shape, rdr.dtype, dst_nodata)
         else:
-            rio_reproject(pix, dst, src_gbox, dst_gbox, resampling,
-                          src_nodata=rdr.nodata, dst_nodata=dst_nodata)
+            dst = np.full(dst_shape, dst_nodata, dtype=rdr.dtype)
+
+        with _timer(metrics, 't_warp'):
+            if rr.transform.linear is not None:
+                A = (~src_gbox.transform)*dst_gbox.transform
+                warp_affine(pix, dst, A, resampling,
+                            src_nodata=rdr.nodata, dst_nodata=dst_nodata)
+            else:
+                rio_reproject(pix, dst, src_gbox, dst_gbox, resampling,
+                              src_nodata=rdr.nodata, dst_nodata=dst_nodata)
+
+        return dst, rr.roi_dst
 
-    return dst, rr.roi_dst
+    return read(rr.roi_src, src_gbox.shape), finish_warp
+
+
+def read_time_slice_v2(rdr,
+                       dst_gbox: GeoBox,
+                       resampling: Resampling,
+                       dst_nodata: Nodata) -> Tuple[Optional[np.ndarray],
+                                                    Tuple[slice, slice]]:
+    """ From opened reader object read into `dst`
+
+    :returns: pixels read and ROI of dst_gbox that was affected
+    """
+    fut, finish = read_time_slice_v2_start(rdr, dst_gbox, resampling, dst_nodata)
+    return finish(None if fut is None else fut.result())
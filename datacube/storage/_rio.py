@@ -9,22 +9,25 @@ import logging
 import warnings
 import contextlib
 from contextlib import contextmanager
-from threading import RLock
+from threading import RLock, local
 import numpy as np
 from affine import Affine
 import rasterio
 import rasterio.path
 from urllib.parse import urlparse
-from typing import Optional, Iterator
+from rasterio.windows import Window
+from typing import Optional, Iterator, Iterable, Tuple, Dict, Set, Hashable, Any
 
 from datacube.utils import geometry
 from datacube.utils.math import num2numpy
 from datacube.utils import uri_to_local_path, get_part_from_uri, is_vsipath
 from datacube.utils.rio import activate_from_config
+from datacube.drivers._blockcache import DiskBlockCache, REMOTE_SCHEMES, read_blocks, shared_disk_cache
 from . import DataSource, GeoRasterReader, RasterShape, RasterWindow, BandInfo
 from ._hdf5 import HDF5_LOCK
 
 _LOG = logging.getLogger(__name__)
+_SHARED = local()
 
 
 def _rasterio_crs(src):
@@ -40,6 +43,27 @@ def maybe_lock(lock):
     return lock
 
 
+def _read_band(source: rasterio.Band,
+               lock: Optional[RLock],
+               window: Optional[RasterWindow],
+               out_shape: Optional[RasterShape],
+               cache: Optional[DiskBlockCache],
+               uri: Optional[str]) -> np.ndarray:
+    def read(window, out_shape):
+        with maybe_lock(lock):
+            return source.ds.read(indexes=source.bidx, window=window, out_shape=out_shape)
+
+    stack = _active_stack(uri)
+    if stack is not None and cache is None:
+        return stack.read(source, lock, window, out_shape)
+
+    if cache is None or uri is None:
+        return read(window, out_shape)
+
+    return read_blocks([cache], (uri, source.bidx), source.shape, source.ds.block_shapes[source.bidx-1],
+                       source.ds.overviews(source.bidx), source.dtype, read, window, out_shape)
+
+
 class BandDataSource(GeoRasterReader):
     """
     Wrapper for a :class:`rasterio.Band` object
@@ -48,13 +72,17 @@ class BandDataSource(GeoRasterReader):
     """
 
     def __init__(self, source, nodata=None,
-                 lock: Optional[RLock] = None):
+                 lock: Optional[RLock] = None,
+                 cache: Optional[DiskBlockCache] = None,
+                 uri: Optional[str] = None):
         self.source = source
         if nodata is None:
             nodata = self.source.ds.nodatavals[self.source.bidx-1]
 
         self._nodata = num2numpy(nodata, source.dtype)
         self._lock = lock
+        self._cache = cache
+        self._uri = uri
 
     @property
     def nodata(self):
@@ -76,12 +104,20 @@ class BandDataSource(GeoRasterReader):
     def shape(self) -> RasterShape:
         return self.source.shape
 
+    @property
+    def overviews(self) -> Tuple[int, ...]:
+        return tuple(sorted(self.source.ds.overviews(self.source.bidx)))
+
+    @property
+    def block_shape(self) -> RasterShape:
+        """ Internal tiling of the band in the file, (rows, cols) """
+        return tuple(self.source.ds.block_shapes[self.source.bidx-1])
+
     def read(self, window: Optional[RasterWindow] = None,
              out_shape: Optional[RasterShape] = None) -> Optional[np.ndarray]:
         """Read data in the native format, returning a numpy array
         """
-        with maybe_lock(self._lock):
-            return self.source.ds.read(indexes=self.source.bidx, window=window, out_shape=out_shape)
+        return _read_band(self.source, self._lock, window, out_shape, self._cache, self._uri)
 
 
 class OverrideBandDataSource(GeoRasterReader):
@@ -98,12 +134,16 @@ class OverrideBandDataSource(GeoRasterReader):
                  nodata,
                  crs: geometry.CRS,
                  transform: Affine,
-                 lock: Optional[RLock] = None):
+                 lock: Optional[RLock] = None,
+                 cache: Optional[DiskBlockCache] = None,
+                 uri: Optional[str] = None):
         self.source = source
         self._nodata = num2numpy(nodata, source.dtype)
         self._crs = crs
         self._transform = transform
         self._lock = lock
+        self._cache = cache
+        self._uri = uri
 
     @property
     def crs(self) -> geometry.CRS:
@@ -125,12 +165,169 @@ class OverrideBandDataSource(GeoRasterReader):
     def shape(self) -> RasterShape:
         return self.source.shape
 
+    @property
+    def overviews(self) -> Tuple[int, ...]:
+        return tuple(sorted(self.source.ds.overviews(self.source.bidx)))
+
+    @property
+    def block_shape(self) -> RasterShape:
+        """ Internal tiling of the band in the file, (rows, cols) """
+        return tuple(self.source.ds.block_shapes[self.source.bidx-1])
+
     def read(self, window: Optional[RasterWindow] = None,
              out_shape: Optional[RasterShape] = None) -> Optional[np.ndarray]:
         """Read data in the native format, returning a native array
         """
-        with maybe_lock(self._lock):
-            return self.source.ds.read(indexes=self.source.bidx, window=window, out_shape=out_shape)
+        return _read_band(self.source, self._lock, window, out_shape, self._cache, self._uri)
+
+
+def _rio_open(filename: str) -> rasterio.DatasetReader:
+    return rasterio.DatasetReader(rasterio.path.parse_path(str(filename)), sharing=False)
+
+
+@contextmanager
+def shared_file_handles() -> Iterator[None]:
+    """
+    Within this context :class:`RasterioDataSource` objects opened on the current thread
+    share file handles: opening a file that is already open re-uses the existing
+    handle. All handles are closed on exit.
+
+    Used to read several bands of the same file without re-opening it for every band.
+    Nested use is allowed, handles are closed when the outermost context exits.
+    """
+    if getattr(_SHARED, 'handles', None) is not None:
+        yield
+        return
+
+    handles = {}  # type: Dict[str, rasterio.DatasetReader]
+    _SHARED.handles = handles
+    try:
+        yield
+    finally:
+        _SHARED.handles = None
+        for src in handles.values():
+            src.close()
+
+
+def _window_key(window) -> Hashable:
+    if window is None:
+        return None
+    if isinstance(window, Window):
+        window = window.toranges()
+    return tuple((int(a), int(b)) for a, b in window)
+
+
+class _Stack:
+    """ Bands of one file that are read in one pass, see :func:`stacked_reads`.
+    """
+
+    def __init__(self, bands: Set[int]):
+        self.remaining = set(bands)
+        self.pixels = {}  # type: Dict[Any, Dict[int, np.ndarray]]
+        self.src = None  # type: Optional[rasterio.DatasetReader]
+        self.users = 0
+
+    def read(self, source: rasterio.Band,
+             lock: Optional[RLock],
+             window: Optional[RasterWindow],
+             out_shape: Optional[RasterShape]) -> np.ndarray:
+        key = (_window_key(window), None if out_shape is None else tuple(out_shape))
+        cached = self.pixels.get(key, {})
+        pix = cached.pop(source.bidx, None)
+
+        if pix is None:
+            # read this band together with every band of the stack that wasn't read yet
+            bands = sorted(self.remaining | {source.bidx})
+            with maybe_lock(lock):
+                pix = source.ds.read(indexes=bands, window=window,
+                                     out_shape=None if out_shape is None else (len(bands),) + tuple(out_shape))
+            cached = dict(zip(bands, pix))
+            pix = cached.pop(source.bidx)
+            self.pixels[key] = cached
+
+        self.remaining.discard(source.bidx)
+        if not cached:
+            self.pixels.pop(key, None)
+        return pix
+
+    def done(self) -> bool:
+        return self.users == 0 and not self.remaining and not self.pixels
+
+    def close(self) -> None:
+        if self.src is not None:
+            self.src.close()
+            self.src = None
+
+
+def _active_stack(filename) -> Optional[_Stack]:
+    stacks = getattr(_SHARED, 'stacks', None)
+    if stacks is None or filename is None:
+        return None
+    return stacks.get(str(filename), None)
+
+
+@contextmanager
+def stacked_reads(bands: Iterable[BandInfo]) -> Iterator[None]:
+    """
+    Within this context bands of the same file that differ only in band (or time slice)
+    index, like layered GeoTIFFs or stacked NetCDF storage units, are read together.
+
+    Such files are opened once on the current thread. The first read from any of the
+    listed bands reads the same window from all of them in one pass, later reads of that
+    window from the other bands are served from memory. Files are closed once all listed
+    bands were read, or on exit. Nested use has no effect.
+
+    :param bands: All bands that are going to be read within the context
+    """
+    if getattr(_SHARED, 'stacks', None) is not None:
+        yield
+        return
+
+    files = {}  # type: Dict[str, Set[int]]
+    for band in bands:
+        try:
+            src = RasterDatasetDataSource(band)
+        except (ValueError, RuntimeError):
+            continue  # will fail later, when it's actually read
+        bidx = src.get_bandnumber()
+        if bidx is not None:
+            files.setdefault(str(src.filename), set()).add(bidx)
+
+    stacks = {fname: _Stack(bidx) for fname, bidx in files.items() if len(bidx) > 1}
+    _SHARED.stacks = stacks
+    try:
+        yield
+    finally:
+        _SHARED.stacks = None
+        for stack in stacks.values():
+            stack.close()
+
+
+@contextmanager
+def _open_file(filename: str) -> Iterator[rasterio.DatasetReader]:
+    handles = getattr(_SHARED, 'handles', None)
+    if handles is not None:
+        src = handles.get(filename)
+        if src is None:
+            src = handles[filename] = _rio_open(filename)
+        yield src
+        return
+
+    stack = _active_stack(filename)
+    if stack is not None:
+        if stack.src is None:
+            stack.src = _rio_open(filename)
+        stack.users += 1
+        try:
+            yield stack.src
+        finally:
+            stack.users -= 1
+            if stack.done():
+                stack.close()
+        return
+
+    with _rio_open(filename) as src:
+        yield src
 
 
 class RasterioDataSource(DataSource):
@@ -164,8 +361,7 @@ class RasterioDataSource(DataSource):
 
         try:
             _LOG.debug("opening %s", self.filename)
-            with rasterio.DatasetReader(rasterio.path.parse_path(str(self.filename)),
-                                        sharing=False) as src:
+            with _open_file(self.filename) as src:
                 override = False
 
                 transform = src.transform
@@ -188,15 +384,20 @@ class RasterioDataSource(DataSource):
                     locked = False
                     lock.release()
 
+                cache = None
+                if urlparse(str(self.filename)).scheme in REMOTE_SCHEMES:
+                    cache = shared_disk_cache()
+
                 if override:
                     warnings.warn(f"""Broken/missing geospatial data was found in file:
 "{self.filename}"
 Will use approximate metadata for backwards compatibility reasons (#673).
 This behaviour is deprecated. Future versions will raise an error.""",
                                   category=DeprecationWarning)
-                    yield OverrideBandDataSource(band, nodata=nodata, crs=crs, transform=transform, lock=lock)
+                    yield OverrideBandDataSource(band, nodata=nodata, crs=crs, transform=transform, lock=lock,
+                                                 cache=cache, uri=self.filename)
                 else:
-                    yield BandDataSource(band, nodata=nodata, lock=lock)
+                    yield BandDataSource(band, nodata=nodata, lock=lock, cache=cache, uri=self.filename)
 
         except Exception as e:
             _LOG.error("Error opening source dataset: %s", self.filename)
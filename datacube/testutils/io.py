@@ -12,7 +12,7 @@ from ..utils.geometry._warp import resampling_s2rio
 from ..storage._read import rdr_geobox
 from ..utils.geometry import GeoBox
 from ..utils.geometry import gbox as gbx
-from ..index.eo3 import is_doc_eo3, _norm_grid
+from ..index.eo3 import is_doc_eo3, norm_grid
 from types import SimpleNamespace
 
 
@@ -72,7 +72,7 @@ def eo3_geobox(ds: Dataset, band: str) -> GeoBox:
     if crs is None or grid is None:
         raise ValueError('Not a valid EO3 dataset')
 
-    grid = _norm_grid(grid)
+    grid = norm_grid(grid)
     h, w = grid.shape
 
     return GeoBox(w, h, grid.transform, crs)
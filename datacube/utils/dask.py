@@ -9,7 +9,9 @@ from typing import Any, Iterable, Optional, Union, Tuple
 from random import randint
 import toolz
 import queue
+import zlib
 from dask.distributed import Client
+from distributed.diagnostics.plugin import SchedulerPlugin
 import dask
 import threading
 import logging
@@ -26,6 +28,7 @@ __all__ = (
     "partition_map",
     "save_blob_to_file",
     "save_blob_to_s3",
+    "DataLocalityPlugin",
 )
 
 _LOG = logging.getLogger(__name__)
@@ -344,3 +347,66 @@ def save_blob_to_s3(data,
                                     region_name=region_name,
                                     with_deps=with_deps,
                                     **kw)
+
+
+class DataLocalityPlugin(SchedulerPlugin):
+    """
+    Scheduler plugin that sends tasks reading the same file to the same worker.
+
+    Lazy loads annotate their tasks with ``dc_uris``, files each chunk reads. Every task is
+    assigned a preferred worker by hashing its first file over the workers currently
+    connected (rendezvous hashing, so adding or removing a worker only moves tasks of that
+    worker). Restrictions are loose: tasks still run elsewhere if the preferred worker is gone.
+    This keeps GDAL block cache and file handles of a worker useful across chunks.
+
+    Tasks with user supplied worker restrictions are left alone.
+
+    Annotations are dropped by dask's low-level task fusion, so this plugin only has an effect
+    when fusion is disabled for lazy loads computed with it active::
+
+        client.register_scheduler_plugin(DataLocalityPlugin())
+        with dask.config.set({'optimization.fuse.active': False}):
+            xx = dc.load(..., dask_chunks={...}).compute()
+
+    Without fusion lazy load graph layers reach the scheduler un-materialised and are
+    un-packed there by importing ``datacube``, which the scheduler only does for modules
+    listed in its ``distributed.scheduler.allowed-imports`` config. When registered on a
+    scheduler the plugin adds ``datacube`` to that list in the scheduler process, pass
+    ``allow_import=False`` to configure the scheduler yourself instead.
+    """
+
+    name = "datacube-data-locality"
+
+    def __init__(self, annotation: str = 'dc_uris', allow_import: bool = True):
+        self.annotation = annotation
+        self.allow_import = allow_import
+        self.n_placed = 0
+
+    def start(self, scheduler):
+        if not self.allow_import:
+            return
+
+        allowed = dask.config.get('distributed.scheduler.allowed-imports', ['dask', 'distributed'])
+        if 'datacube' not in allowed:
+            dask.config.set({'distributed.scheduler.allowed-imports': list(allowed) + ['datacube']})
+
+    @staticmethod
+    def preferred_worker(uri: str, workers: Iterable[str]) -> Optional[str]:
+        """ Worker that should read ``uri``, ``None`` if there are no workers. """
+        return max(workers, key=lambda w: zlib.crc32('{}|{}'.format(uri, w).encode('utf8')), default=None)
+
+    def update_graph(self, scheduler, keys=None, restrictions=None, annotations=None, **kwargs):
+        # pylint: disable=arguments-differ
+        uris = (annotations or {}).get(self.annotation, None)
+        workers = list(scheduler.workers)
+        if not uris or not workers:
+            return
+
+        for key, task_uris in uris.items():
+            ts = scheduler.tasks.get(key, None)
+            if ts is None or not task_uris or ts.worker_restrictions or ts.host_restrictions:
+                continue
+
+            ts.worker_restrictions = {self.preferred_worker(task_uris[0], workers)}
+            ts.loose_restrictions = True
+            self.n_placed += 1
@@ -141,16 +141,22 @@ class GeoboxTiles():
     """ Partition GeoBox into sub geoboxes
     """
 
-    def __init__(self, box: GeoBox, tile_shape: Tuple[int, int]):
+    def __init__(self, box: GeoBox, tile_shape: Tuple[int, int], offset: Tuple[int, int] = (0, 0)):
         """ Construct from a ``GeoBox``
 
         :param box: source :class:`datacube.utils.geometry.GeoBox`
         :param tile_shape: Shape of sub-tiles in pixels (rows, cols)
+        :param offset: Tile grid starts this many pixels (rows, cols) before ``box``, so first
+                       row/column of tiles is smaller by that much, ``0 <= offset < tile_shape``
         """
+        if not all(0 <= o < n for o, n in zip(offset, tile_shape)):
+            raise ValueError("offset should be within one tile: {} {}".format(offset, tile_shape))
+
         self._gbox = box
         self._tile_shape = tile_shape
-        self._shape = tuple(math.ceil(float(N)/n)
-                            for N, n in zip(box.shape, tile_shape))
+        self._offset = tuple(offset)
+        self._shape = tuple(math.ceil(float(N + o)/n)
+                            for N, n, o in zip(box.shape, tile_shape, offset))
         self._cache = {}  # type: Dict[Tuple[int, int], GeoBox]
 
     @property
@@ -163,16 +169,22 @@ class GeoboxTiles():
         """
         return self._shape
 
+    @property
+    def offset(self) -> Tuple[int, int]:
+        """ Number of pixels the tile grid starts before the base geobox
+        """
+        return self._offset
+
     def _idx_to_slice(self, idx: Tuple[int, int]) -> Tuple[slice, slice]:
-        def _slice(i, N, n) -> slice:
-            _in = i*n
-            if 0 <= _in < N:
-                return slice(_in, min(_in + n, N))
+        def _slice(i, N, n, o) -> slice:
+            _in = i*n - o
+            if -o <= _in < N:
+                return slice(max(_in, 0), min(_in + n, N))
             else:
                 raise IndexError("Index ({},{})is out of range".format(*idx))
 
-        ir, ic = (_slice(i, N, n)
-                  for i, N, n in zip(idx, self._gbox.shape, self._tile_shape))
+        ir, ic = (_slice(i, N, n, o)
+                  for i, N, n, o in zip(idx, self._gbox.shape, self._tile_shape, self._offset))
         return (ir, ic)
 
     def chunk_shape(self, idx: Tuple[int, int]) -> Tuple[int, int]:
@@ -182,15 +194,13 @@ class GeoboxTiles():
             :returns: (nrow, ncols) shape of a tile (edge tiles might be smaller)
             :raises: IndexError when index is outside of [(0,0) -> .shape)
         """
-        def _sz(i: int, n: int, tile_sz: int, total_sz: int) -> int:
-            if 0 <= i < n - 1:  # not edge tile
-                return tile_sz
-            elif i == n - 1:    # edge tile
-                return total_sz - (i*tile_sz)
+        def _sz(i: int, n: int, tile_sz: int, total_sz: int, o: int) -> int:
+            if 0 <= i < n:
+                return min((i + 1)*tile_sz - o, total_sz) - max(i*tile_sz - o, 0)
             else:               # out of index case
                 raise IndexError("Index ({},{}) is out of range".format(*idx))
 
-        n1, n2 = map(_sz, idx, self._shape, self._tile_shape, self._gbox.shape)
+        n1, n2 = map(_sz, idx, self._shape, self._tile_shape, self._gbox.shape, self._offset)
         return (n1, n2)
 
     def __getitem__(self, idx: Tuple[int, int]) -> GeoBox:
@@ -216,7 +226,8 @@ class GeoboxTiles():
             return range(_in, _out)
 
         sy, sx = self._tile_shape
-        A = Affine.scale(1.0/sx, 1.0/sy)*(~self._gbox.transform)
+        oy, ox = self._offset
+        A = Affine.scale(1.0/sx, 1.0/sy)*Affine.translation(ox, oy)*(~self._gbox.transform)
         # A maps from X,Y in meters to chunk index
         bbox = bbox.transform(A)
 
@@ -4,19 +4,30 @@
 # SPDX-License-Identifier: Apache-2.0
 """ rasterio environment management tools
 """
+import logging
 import threading
 from types import SimpleNamespace
 import functools
 import rasterio
 from rasterio.session import AWSSession, DummySession
 import rasterio.env
-from datacube.utils.generic import thread_local_cache
+from typing import Optional
+
+_LOG = logging.getLogger(__name__)
 
 _CFG_LOCK = threading.Lock()
 _CFG = SimpleNamespace(aws=None,
                        cloud_defaults=False,
                        kwargs={},
-                       epoch=0)
+                       epoch=0,
+                       creds=None,
+                       session=None)
+_REFRESH = None  # type: Optional[threading.Timer]
+
+# botocore refreshes credentials when asked for them with less than 15 minutes left,
+# and blocks every caller while refreshing once less than 10 minutes are left
+REFRESH_AHEAD = 12*60
+MIN_REFRESH_DELAY = 30
 
 
 SECRET_KEYS = ('AWS_ACCESS_KEY_ID',
@@ -30,14 +41,28 @@ def _sanitize(opts, keys):
             for k, v in opts.items()}
 
 
-def _state(purge=False):
+class _ThreadState(threading.local):
     """
     .env   None| rasterio.Env
     .epoch -1  | +Int
     """
-    return thread_local_cache("__rio_state__",
-                              SimpleNamespace(env=None, epoch=-1),
-                              purge=purge)
+
+    def __init__(self):
+        super().__init__()
+        self.env = None
+        self.epoch = -1
+
+
+_THREAD = _ThreadState()
+
+
+def _state(purge=False):
+    if not purge:
+        return _THREAD
+
+    state = SimpleNamespace(env=_THREAD.env, epoch=_THREAD.epoch)
+    _THREAD.env, _THREAD.epoch = None, -1
+    return state
 
 
 def get_rio_env(sanitize=True):
@@ -76,6 +101,10 @@ def activate_rio_env(aws=None, cloud_defaults=False, **kwargs):
     :param cloud_defaults: When True inject settings for reading COGs
     :param **kwargs: Passed on to rasterio.Env(..) constructor
     """
+    return _activate(_mk_session(aws), cloud_defaults, kwargs)
+
+
+def _mk_session(aws):
     session = DummySession()
 
     if aws is not None:
@@ -97,6 +126,10 @@ def activate_rio_env(aws=None, cloud_defaults=False, **kwargs):
 
         session = AWSSession(**aws)
 
+    return session
+
+
+def _activate(session, cloud_defaults, kwargs):
     opts = dict(
         GDAL_DISABLE_READDIR_ON_OPEN='EMPTY_DIR',
         GDAL_HTTP_MAX_RETRY='10',
@@ -121,20 +154,103 @@ def activate_rio_env(aws=None, cloud_defaults=False, **kwargs):
 def activate_from_config():
     """ Check if this threads needs to reconfigure, then does reconfigure.
 
-    - Does nothing if this thread is already configured and configuration hasn't changed.
-    - Configures current thread with default rio settings
+    - Does nothing if this thread is already configured and configuration hasn't changed,
+      this is cheap enough to call before every file open.
+    - Configures current thread with default rio settings, session (region and credentials
+      lookup) is only constructed once per configuration and shared by all threads
     """
     cfg = _CFG
-    state = _state()
+    state = _THREAD
+
+    if cfg.epoch == state.epoch:
+        return None
+
+    ee = _activate(_cfg_session(cfg), cfg.cloud_defaults, cfg.kwargs)
+    state.epoch = cfg.epoch
+    return ee
+
+
+def _cfg_session(cfg):
+    with _CFG_LOCK:
+        if cfg.session is None:
+            cfg.session = _mk_session(cfg.aws)
+            if cfg.creds is None:
+                _schedule_refresh(cfg, getattr(cfg.session, '_creds', None))
+        return cfg.session
+
+
+def _refresh_delay(creds):
+    """ Seconds until credentials should be refreshed, ``None`` if they don't expire.
+    """
+    seconds_remaining = getattr(creds, '_seconds_remaining', None)  # botocore RefreshableCredentials
+    if seconds_remaining is None:
+        return None
+    return max(MIN_REFRESH_DELAY, seconds_remaining() - REFRESH_AHEAD)
+
+
+def _schedule_refresh(cfg, creds):
+    """ Refresh expiring credentials in the background, must hold ``_CFG_LOCK``.
+    """
+    global _REFRESH  # pylint: disable=global-statement
 
-    if cfg.epoch != state.epoch:
-        ee = activate_rio_env(aws=cfg.aws,
-                              cloud_defaults=cfg.cloud_defaults,
-                              **cfg.kwargs)
-        state.epoch = cfg.epoch
-        return ee
+    if _REFRESH is not None:
+        _REFRESH.cancel()
+        _REFRESH = None
 
-    return None
+    delay = _refresh_delay(creds)
+    if delay is None:
+        return
+
+    _REFRESH = threading.Timer(delay, _refresh_creds, (cfg, creds))
+    _REFRESH.daemon = True
+    _REFRESH.start()
+
+
+def _refresh_creds(cfg, creds):
+    """ Get fresh credentials and publish them as a new configuration epoch,
+    so that IO threads pick them up on their next :func:`activate_from_config`.
+    """
+    global _CFG  # pylint: disable=global-statement
+
+    try:
+        cc = creds.get_frozen_credentials()
+    except Exception as e:  # pylint: disable=broad-except
+        _LOG.warning("Failed to refresh AWS credentials: %s", e)
+        cc = None
+
+    with _CFG_LOCK:
+        if _CFG is not cfg:
+            return  # configuration was replaced meanwhile
+
+        aws, session = cfg.aws, cfg.session
+        if cfg.creds is not None and cc is not None:
+            # credentials are baked into `aws`
+            aws = dict(aws,
+                       aws_access_key_id=cc.access_key,
+                       aws_secret_access_key=cc.secret_key,
+                       aws_session_token=cc.token)
+            session = None
+
+        _CFG = SimpleNamespace(aws=aws,
+                               cloud_defaults=cfg.cloud_defaults,
+                               kwargs=cfg.kwargs,
+                               epoch=cfg.epoch + 1,
+                               creds=cfg.creds,
+                               session=session)
+        _schedule_refresh(_CFG, creds)
+
+
+def _set_config(aws, cloud_defaults, kwargs, creds=None):
+    global _CFG  # pylint: disable=global-statement
+
+    with _CFG_LOCK:
+        _CFG = SimpleNamespace(aws=aws,
+                               cloud_defaults=cloud_defaults,
+                               kwargs=kwargs,
+                               epoch=_CFG.epoch + 1,
+                               creds=creds,
+                               session=None)
+        _schedule_refresh(_CFG, creds)
 
 
 def set_default_rio_config(aws=None, cloud_defaults=False, **kwargs):
@@ -143,19 +259,16 @@ def set_default_rio_config(aws=None, cloud_defaults=False, **kwargs):
     Doesn't actually activate one, just stores configuration for future
     use from IO threads.
 
+    Expiring credentials obtained by the session are refreshed in the background
+    shortly before they expire, IO threads then re-activate with new credentials.
+
     :param aws: Dictionary of options for rasterio.session.AWSSession
                 OR 'auto' -- session = rasterio.session.AWSSession()
 
     :param cloud_defaults: When True inject settings for reading COGs
     :param **kwargs: Passed on to rasterio.Env(..) constructor
     """
-    global _CFG  # pylint: disable=global-statement
-
-    with _CFG_LOCK:
-        _CFG = SimpleNamespace(aws=aws,
-                               cloud_defaults=cloud_defaults,
-                               kwargs=kwargs,
-                               epoch=_CFG.epoch + 1)
+    _set_config(aws, cloud_defaults, kwargs)
 
 
 def configure_s3_access(profile=None,
@@ -173,9 +286,10 @@ def configure_s3_access(profile=None,
 
     .. note::
 
-       if credentials are STS based they will eventually expire, currently
-       this case is not handled very well, reads will just start failing
-       eventually and will never recover.
+       if credentials are STS based they will eventually expire. Locally they are
+       refreshed in the background before that happens, but when configuring a dask
+       cluster (``client=``) workers keep the credentials they were given, reads
+       will just start failing eventually and will never recover.
 
     :param profile:        AWS profile name to use
     :param region_name:    Default region_name to use if not configured for a given/default AWS profile
@@ -200,7 +314,7 @@ def configure_s3_access(profile=None,
                                   requester_pays=requester_pays)
 
     if client is None:
-        set_default_rio_config(aws=aws, cloud_defaults=cloud_defaults, **gdal_opts)
+        _set_config(aws, cloud_defaults, gdal_opts, creds)
     else:
         client.register_worker_callbacks(
             functools.partial(set_default_rio_config,
@@ -10,7 +10,7 @@ from types import SimpleNamespace
 import pytest
 
 from datacube.api.query import GroupBy
-from datacube.api.core import _calculate_chunk_sizes
+from datacube.api.core import _calculate_chunk_sizes, _ChunkGridLayer
 from datacube import Datacube
 from datacube.testutils.geom import AlbersGS
 from datacube.testutils import mk_sample_dataset
@@ -112,3 +112,67 @@ def test_dask_chunks():
 
     with pytest.raises(KeyError):
         _calculate_chunk_sizes(sources, geobox, {'zz': 1})
+
+
+def test_calculate_chunk_sizes_storage(tmpdir, caplog):
+    import dask
+    from pathlib import Path
+    from datacube.testutils import mk_test_image, gen_tiff_dataset
+    from datacube.utils.geometry import gbox as gbx
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(512, 256, 'int16', nodata=nodata)
+    ds, gbox = gen_tiff_dataset(SimpleNamespace(name='aa', values=aa, nodata=nodata),
+                                tmpdir,
+                                prefix='ds1-',
+                                timestamp='2018-07-19',
+                                blocksize=64,
+                                resolution=(15, -15),
+                                offset=(11230, 1381110))
+    sources = Datacube.group_datasets([ds], 'time').isel(time=[0]*4)
+    mm = list(ds.type.measurements.values())
+
+    with dask.config.set({'array.chunk-size': '64KiB'}):
+        # 32Ki pixels: multiples of 64x64 source blocks read from the file header
+        assert _calculate_chunk_sizes(sources, gbox, 'storage', mm) == ((1,), (128, 256))
+        assert _calculate_chunk_sizes(sources, gbox, {'x': 'storage'}, mm) == ((1,), (256, 128))
+        assert _calculate_chunk_sizes(sources, gbox, {'x': 100, 'y': 'storage'}, mm) == ((1,), (256, 100))
+        # whole image fits, time chunk takes the rest of the budget
+        assert _calculate_chunk_sizes(sources, gbox, {'time': 'storage', 'x': 64, 'y': 64}, mm) == ((4,), (64, 64))
+
+        # source blocks are 32 pixels wide in a lower resolution output
+        assert _calculate_chunk_sizes(sources, gbx.zoom_out(gbox, 2), 'storage', mm) == ((1,), (128, 256))
+        assert _calculate_chunk_sizes(sources, gbx.zoom_out(gbox, 3), {'x': 'storage', 'y': 100}, mm)[1] == (100, 171)
+
+        # without measurements 'storage' means defaults, 'auto' always does
+        assert _calculate_chunk_sizes(sources, gbox, 'storage') == ((1,), (256, 512))
+        assert _calculate_chunk_sizes(sources, gbox, 'auto', mm) == ((1,), (256, 512))
+
+        xx = Datacube.load_data(sources, gbox, mm, dask_chunks='storage')
+        assert xx.aa.data.chunksize == (1, 128, 256)
+        np.testing.assert_array_equal(xx.aa.values[3], aa)
+
+        # output starts mid-block: first chunk is smaller so that the rest start on block boundaries
+        xx = Datacube.load_data(sources, gbox[10:, 20:], mm, dask_chunks='storage')
+        assert xx.aa.data.chunks[1:] == ((118, 128), (236, 256))
+        np.testing.assert_array_equal(xx.aa.values[3], aa[10:, 20:])
+
+    # block size recorded in the index, file is not opened
+    ds.type.definition['storage'] = {'chunking': {'time': 1, 'y': 100, 'x': 100}}
+    grid = {'shape': list(gbox.shape), 'transform': list(gbox.transform)}
+    ds.metadata_doc['grids'] = {'default': grid}
+    ds.metadata_doc['crs'] = str(gbox.crs)
+    ds.uris = ['file:///no/such/metadata.yaml']
+    with dask.config.set({'array.chunk-size': '64KiB'}):
+        assert _calculate_chunk_sizes(sources, gbox, 'storage', mm) == ((1,), (100, 300))
+
+        # layout unknown and file is missing: only chunk size limit applies, failure is logged
+        del ds.type.definition['storage']
+        assert _calculate_chunk_sizes(sources, gbox, 'storage', mm) == ((1,), (181, 181))
+        assert 'storage layout' in caplog.text
+
+
+def test_chunk_grid_layer_abstract():
+    with pytest.raises(TypeError):
+        _ChunkGridLayer('aa', (2, 3))
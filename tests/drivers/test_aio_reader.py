@@ -0,0 +1,254 @@
+# This file is part of the Open Data Cube, see https://opendatacube.org for more information
+#
+# Copyright (c) 2015-2020 ODC Contributors
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import re
+import time
+from pathlib import Path
+
+import botocore.session
+
+import numpy as np
+import pytest
+import rasterio
+import rasterio.shutil
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from datacube.drivers.aio._http import RangeClient, s3_to_http
+from datacube.drivers.aio._reader import RDEntry, HeaderCache, coalesce_ranges
+from datacube.drivers.rio._reader import RIOReader
+from datacube.testutils.io import write_gtiff
+from datacube.testutils.iodriver import GeoTIFF, mk_band
+
+
+@pytest.fixture
+def httpserver():
+    # driver keeps connections open and has many requests in flight, serve them concurrently
+    server = HTTPServer(threaded=True)
+    server.start()
+    yield server
+    server.clear()
+    server.stop()
+
+
+def _serve(httpserver, path: Path, log=None):
+    data = path.read_bytes()
+
+    def handler(request):
+        rng = request.headers.get('Range')
+        if log is not None:
+            log.append((request.path, rng, dict(request.headers)))
+        if request.method == 'HEAD':
+            return Response(status=200, headers={'Content-Length': str(len(data)), 'Accept-Ranges': 'bytes'})
+        if rng is None:
+            return Response(data, status=200)
+        a, b = map(int, re.match(r'bytes=(\d+)-(\d+)', rng).groups())
+        return Response(data[a:b + 1], status=206,
+                        headers={'Content-Range': 'bytes {}-{}/{}'.format(a, b, len(data)),
+                                 'Accept-Ranges': 'bytes'})
+
+    httpserver.expect_request('/' + path.name).respond_with_handler(handler)
+    return mk_band('a', httpserver.url_for('/'), path=path.name, format=GeoTIFF)
+
+
+def _mk_tiffs(tmpdir: Path):
+    image = np.random.randint(0, 1000, size=(300, 400), dtype='int16')
+    image[:128, :128] = -999  # sparse tile in COG
+    fimage = (image/7).astype('float32')
+    multi = np.stack([image, image[::-1], image[:, ::-1]])
+
+    base = write_gtiff(str(tmpdir/'base.tif'), image, nodata=-999, blocksize=64).path
+    fbase = write_gtiff(str(tmpdir/'fbase.tif'), fimage, blocksize=64).path
+    mbase = write_gtiff(str(tmpdir/'mbase.tif'), multi, nodata=-999, blocksize=64).path
+
+    def cog(src, name, **opts):
+        rasterio.shutil.copy(str(src), str(tmpdir/name), driver='COG', blocksize=128, **opts)
+        return tmpdir/name
+
+    def gtiff(src, name, **opts):
+        rasterio.shutil.copy(str(src), str(tmpdir/name), driver='GTiff', **opts)
+        return tmpdir/name
+
+    return {
+        'cog-deflate': cog(base, 'a.tif', compress='deflate', predictor=2, overview_resampling='nearest',
+                           sparse_ok=True),
+        'cog-float': cog(fbase, 'f.tif', compress='deflate', predictor=3),
+        'cog-bigtiff': cog(base, 'b.tif', compress='deflate', bigtiff='yes'),
+        'multi-pixel': gtiff(mbase, 'mp.tif', tiled='yes', blockxsize=64, blockysize=64, interleave='pixel',
+                             compress='deflate', predictor=2),
+        'multi-band': gtiff(mbase, 'mb.tif', tiled='yes', blockxsize=64, blockysize=64, interleave='band'),
+        'big-endian-strips': gtiff(base, 'be.tif', endianness='big', blockysize=7),
+        'lzw': gtiff(base, 'lzw.tif', tiled='yes', compress='lzw'),
+    }
+
+
+def test_coalesce_ranges():
+    assert coalesce_ranges([]) == []
+    assert coalesce_ranges([(100, 200), (0, 50), (55, 90)], gap=9) == [((0, 90), [1, 2]), ((100, 200), [0])]
+    assert coalesce_ranges([(100, 200), (0, 50), (55, 90)], gap=10) == [((0, 200), [1, 2, 0])]
+    assert coalesce_ranges([(0, 50), (60, 90)], gap=0) == [((0, 50), [0]), ((60, 90), [1])]
+    assert coalesce_ranges([(0, 50), (50, 90), (90, 200)],
+                           gap=0, max_size=100) == [((0, 90), [0, 1]), ((90, 200), [2])]
+
+
+def test_s3_to_http(monkeypatch):
+    for k in ('AWS_S3_ENDPOINT', 'AWS_HTTPS', 'AWS_VIRTUAL_HOSTING', 'AWS_REGION', 'AWS_DEFAULT_REGION'):
+        monkeypatch.delenv(k, raising=False)
+
+    assert s3_to_http('s3://bucket/a/b c.tif') == 'https://bucket.s3.us-east-1.amazonaws.com/a/b%20c.tif'
+    monkeypatch.setenv('AWS_REGION', 'ap-southeast-2')
+    assert s3_to_http('s3://my.bucket/a.tif') == 'https://s3.ap-southeast-2.amazonaws.com/my.bucket/a.tif'
+
+    monkeypatch.setenv('AWS_S3_ENDPOINT', 'localhost:9000')
+    monkeypatch.setenv('AWS_HTTPS', 'NO')
+    monkeypatch.setenv('AWS_VIRTUAL_HOSTING', 'FALSE')
+    assert s3_to_http('s3://bucket/a.tif') == 'http://localhost:9000/bucket/a.tif'
+
+
+def test_aio_driver_read(tmpdir, httpserver, monkeypatch):
+    tmpdir = Path(str(tmpdir))
+    # for files read by rasterio, don't look for side-car files on the test server
+    monkeypatch.setenv('GDAL_DISABLE_READDIR_ON_OPEN', 'EMPTY_DIR')
+    monkeypatch.setenv('CPL_VSIL_CURL_ALLOWED_EXTENSIONS', '.tif')
+    rde = RDEntry()
+    assert rde.supports('https', GeoTIFF) and not rde.supports('file', GeoTIFF)
+    assert set(rde.protocols) == {'http', 'https', 's3'}
+    with pytest.raises(ValueError):
+        rde.new_instance({'pool': []})
+
+    rdr = rde.new_instance({'max_workers': 2})
+    ctx = rdr.new_load_context(iter([]), None)
+    assert isinstance(ctx, HeaderCache)
+    assert rdr.new_load_context(iter([]), ctx) is ctx
+    assert rde.new_instance({}).new_load_context(iter([]), ctx) is not ctx
+
+    windows = [(None, None),
+               (np.s_[10:100, 70:201], None),
+               (np.s_[0:300, 0:400], (150, 200)),   # exact overview
+               (np.s_[3:290, 5:397], (100, 77)),    # decimated read from overview
+               (np.s_[200:300, 300:400], (10, 10))]
+
+    for name, path in _mk_tiffs(tmpdir).items():
+        band = _serve(httpserver, path)
+        with rasterio.open(str(path)) as f:
+            expect_meta = (f.crs, f.transform, f.shape, tuple(f.overviews(1)),
+                           band.nodata if f.nodata is None else f.nodata)
+            expect = [f.read(1, window=w, out_shape=s) for w, s in windows[:3]]
+            expect_multi = f.read(window=windows[1][0]) if f.count > 1 else None
+
+        src = rdr.open(band, ctx).result()
+        assert isinstance(src, RIOReader) == (name == 'lzw'), name
+        assert (src.crs, src.transform, src.shape, src.overviews, src.nodata) == expect_meta
+
+        for (w, s), yy in zip(windows, expect):
+            xx = src.read(w, s).result()
+            assert xx.dtype == yy.dtype == src.dtype
+            np.testing.assert_array_equal(xx, yy, err_msg='{} {}'.format(name, w))
+
+        for w, s in windows[3:]:
+            assert src.read(w, s).result().shape == s
+
+        if expect_multi is not None:
+            band2 = mk_band('b', httpserver.url_for('/'), path=path.name, format=GeoTIFF, band=3)
+            src3 = rdr.open(band2, ctx).result()
+            xx = src.read_multi([src3], windows[1][0]).result()
+            np.testing.assert_array_equal(xx, expect_multi[[0, 2]])
+
+    with pytest.raises(ValueError):
+        src.read_multi([object()])
+
+
+def test_aio_driver_requests(tmpdir, httpserver):
+    tmpdir = Path(str(tmpdir))
+    path = _mk_tiffs(tmpdir)['cog-deflate']
+    log = []
+    band = _serve(httpserver, path, log)
+
+    # GDAL COG tiles are stored with 4 byte size prefix and 4 bytes of the tile repeated after it
+    rdr = RDEntry().new_instance({'coalesce_gap': 8})
+    ctx = rdr.new_load_context(iter([band]), None)
+    src = rdr.open(band, ctx).result()
+    assert len(log) == 1  # header fits in the first request
+
+    # all tiles of the image are stored back to back, full resolution read is one request
+    src.read().result()
+    assert len(log) == 2
+
+    # header is parsed once per load context
+    rdr.open(band, ctx).result()
+    assert len(log) == 2 and len(ctx) == 1
+
+    # without coalescing every tile is a separate request, sparse top-left tile is not fetched
+    rdr = RDEntry().new_instance({'coalesce_gap': -1, 'max_connections': 3})
+    src = rdr.open(band, None).result()
+    n = len(log)
+    np.testing.assert_array_equal(src.read(np.s_[64:192, 64:192]).result(),
+                                  rasterio.open(str(path)).read(1, window=np.s_[64:192, 64:192]))
+    assert len(log) - n == 3
+    assert rdr.client.n_requests == len(log) - n + 1
+
+    # missing files fail
+    missing = mk_band('a', httpserver.url_for('/'), path='missing.tif', format=GeoTIFF)
+    with pytest.raises(IOError):
+        rdr.open(missing, None).result()
+
+
+def test_aio_driver_s3(tmpdir, httpserver, monkeypatch):
+    tmpdir = Path(str(tmpdir))
+    path = _mk_tiffs(tmpdir)['cog-deflate']
+    data = path.read_bytes()
+    log = []
+
+    def handler(request):
+        log.append(dict(request.headers))
+        a, b = map(int, re.match(r'bytes=(\d+)-(\d+)', request.headers['Range']).groups())
+        return Response(data[a:b + 1], status=206)
+
+    httpserver.expect_request('/bucket/' + path.name).respond_with_handler(handler)
+    monkeypatch.setenv('AWS_S3_ENDPOINT', '{}:{}'.format(httpserver.host, httpserver.port))
+    monkeypatch.setenv('AWS_HTTPS', 'NO')
+    monkeypatch.setenv('AWS_VIRTUAL_HOSTING', 'FALSE')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'fake-key')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'fake-secret')
+    monkeypatch.setenv('AWS_REGION', 'us-west-2')
+
+    sessions = []
+    get_session = botocore.session.get_session
+    monkeypatch.setattr(botocore.session, 'get_session', lambda: sessions.append(1) or get_session())
+
+    band = mk_band('a', 's3://bucket/', path=path.name, format=GeoTIFF)
+    rdr = RDEntry().new_instance({})
+    np.testing.assert_array_equal(rdr.open(band, None).result().read().result(),
+                                  rasterio.open(str(path)).read(1))
+    assert all('us-west-2/s3/aws4_request' in h['Authorization'] for h in log)
+    assert len(log) > 1 and len(sessions) == 1  # credentials are looked up once per driver
+
+    log.clear()
+    monkeypatch.setenv('AWS_NO_SIGN_REQUEST', 'YES')
+    RDEntry().new_instance({}).open(band, None).result()
+    assert log and all('Authorization' not in h for h in log)
+
+
+def test_range_client_timeout(httpserver):
+    httpserver.expect_request('/slow').respond_with_handler(lambda _: time.sleep(1) or Response(b'x'*10))
+    client = RangeClient(timeout=0.1)
+    writers = []
+
+    async def connect(key, _connect=client._connect):
+        reader, writer = await _connect(key)
+        writers.append(writer)
+        return reader, writer
+
+    client._connect = connect
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            loop.run_until_complete(client.fetch(httpserver.url_for('/slow'), 0, 10))
+        # connection abandoned mid-response is closed rather than leaked
+        assert len(writers) == 1 and writers[0].is_closing()
+        assert not any(client._idle.values())
+    finally:
+        client.close()
+        loop.close()
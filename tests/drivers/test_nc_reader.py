@@ -0,0 +1,99 @@
+# This file is part of the Open Data Cube, see https://opendatacube.org for more information
+#
+# Copyright (c) 2015-2020 ODC Contributors
+# SPDX-License-Identifier: Apache-2.0
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import rasterio
+
+from datacube import Datacube
+from datacube.drivers.netcdf import write_dataset_to_netcdf
+from datacube.drivers.netcdf._reader import RDEntry, ProcReader
+from datacube.storage._load import xr_load
+from datacube.testutils import gen_tiff_dataset, mk_sample_dataset, mk_test_image
+from datacube.testutils.iodriver import NetCDF, GeoTIFF, mk_band
+from datacube.testutils.threads import FakeThreadPoolExecutor
+
+
+def _mk_stacked_nc(tmpdir: Path):
+    """ NetCDF storage unit with 3 time slices of variable ``aa``
+    """
+    dss = []
+    for i in range(3):
+        aa = mk_test_image(96, 64, 'int16', nodata=-999) + i
+        ds, gbox = gen_tiff_dataset(SimpleNamespace(name='aa', values=aa, nodata=-999),
+                                    tmpdir,
+                                    prefix='ds{}-'.format(i),
+                                    timestamp='2018-07-{}'.format(19 + i),
+                                    resolution=(25, -25),
+                                    offset=(1500000, -3900000),
+                                    crs='epsg:3577')
+        ds.metadata_doc['id'] = str(uuid.uuid4())
+        dss.append(ds)
+
+    xx = Datacube.load_data(Datacube.group_datasets(dss, 'time'), gbox, dss[0].type.measurements)
+    write_dataset_to_netcdf(xx, tmpdir/'stack.nc')
+    return tmpdir/'stack.nc', xx, gbox
+
+
+def test_nc_driver_entry():
+    rde = RDEntry()
+    assert set(rde.formats) == {NetCDF, 'HDF5'}
+    assert rde.supports('file', NetCDF) and not rde.supports('s3', NetCDF)
+    assert not rde.supports('file', GeoTIFF)
+
+    with pytest.raises(ValueError):
+        rde.new_instance({'pool': FakeThreadPoolExecutor()})
+
+
+def test_nc_driver_read(tmpdir):
+    path, xx, gbox = _mk_stacked_nc(Path(str(tmpdir)))
+    base = path.parent.as_uri() + '/'
+
+    # worker functions run in this process, so read path can be checked directly
+    rdr = RDEntry().new_instance({'pool': FakeThreadPoolExecutor(), 'allow_custom_pool': True})
+    assert rdr.new_load_context(iter([]), None) is None
+
+    srcs = [rdr.open(mk_band('aa', base, path=path.name, layer='aa', band=i + 1, format=NetCDF), None).result()
+            for i in range(3)]
+    src = srcs[0]
+    assert isinstance(src, ProcReader)
+    assert src.crs == gbox.crs
+    assert src.transform == gbox.transform
+    assert src.shape == gbox.shape
+    assert src.dtype == np.dtype('int16')
+    assert src.nodata == -999
+    assert src.overviews == ()
+    assert len({s.multiband_key for s in srcs}) == 1
+
+    np.testing.assert_array_equal(src.read().result(), xx.aa.values[0])
+    np.testing.assert_array_equal(srcs[2].read(np.s_[10:20, 30:50]).result(), xx.aa.values[2, 10:20, 30:50])
+    np.testing.assert_array_equal(src.read_multi(srcs[1:]).result(), xx.aa.values)
+    assert src.read(out_shape=(32, 48)).result().shape == (32, 48)
+
+    with pytest.raises(ValueError):
+        src.read_multi([object()])
+
+    with pytest.raises(rasterio.errors.RasterioIOError):
+        rdr.open(mk_band('aa', base, path='missing.nc', layer='aa', format=NetCDF), None).result()
+
+
+def test_nc_driver_processes(tmpdir):
+    path, xx, gbox = _mk_stacked_nc(Path(str(tmpdir)))
+    base = path.parent.as_uri() + '/'
+
+    dss = [mk_sample_dataset([dict(name='aa', path=path.name, layer='aa', band=i + 1,
+                                   dtype='int16', nodata=-999)],
+                             base + 'stack.yaml', format=NetCDF, id=str(uuid.uuid4()),
+                             timestamp='2018-07-{}'.format(19 + i), geobox=gbox)
+           for i in range(3)]
+    sources = Datacube.group_datasets(dss, 'time')
+
+    rdr = RDEntry().new_instance({'max_workers': 2})
+    yy, _ = xr_load(sources, gbox, list(dss[0].type.measurements.values()), rdr)
+    np.testing.assert_array_equal(yy.aa.values, xx.aa.values)
+    np.testing.assert_array_equal(yy.time.values, xx.time.values)
@@ -4,6 +4,9 @@
 # SPDX-License-Identifier: Apache-2.0
 """ Tests for new RIO reader driver
 """
+import os
+import re
+import time
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, Future
 import numpy as np
@@ -11,18 +14,24 @@ import rasterio
 from affine import Affine
 import pytest
 import warnings
+from werkzeug.wrappers import Response
 
+from datacube.drivers._blockcache import BlockCache, DiskBlockCache, shared_block_cache, shared_disk_cache
+from datacube.drivers._readpolicy import ReadPolicy, ReadTimeoutError
 from datacube.drivers.rio._reader import (
     RDEntry,
+    FileHandleCache,
     _dc_crs,
     _rio_uri,
     _rio_band_idx,
     _roi_to_window,
 )
 from datacube.testutils.geom import SAMPLE_WKT_WITHOUT_AUTHORITY, epsg3857
+from datacube.testutils.io import write_gtiff
 from datacube.testutils.iodriver import (
     NetCDF, GeoTIFF, mk_band, mk_rio_driver, open_reader
 )
+from datacube.testutils.threads import FakeThreadPoolExecutor
 
 
 def test_rio_rd_entry():
@@ -207,6 +216,65 @@ def test_rio_driver_open(data_folder):
     assert src.nodata == bi.nodata
 
 
+def test_rio_driver_handle_cache(data_folder):
+    base = "file://" + str(data_folder) + "/metadata.yml"
+
+    rdr = mk_rio_driver()
+    b1 = mk_band('a', base, path="test.tif", format=GeoTIFF)
+    b2 = mk_band('b', base, path="test.tif", format=GeoTIFF, band=2)
+    b3 = mk_band('c', base, path="sample_tile_151_-29.tif", format=GeoTIFF)
+
+    ctx = rdr.new_load_context(iter([b1, b2]), None)
+    assert isinstance(ctx, FileHandleCache)
+    assert ctx.hit_rate == 0
+
+    src1 = rdr.open(b1, ctx).result()
+    src2 = rdr.open(b2, ctx).result()
+    assert ctx.misses == 1
+    assert ctx.hits == 1
+    assert ctx.hit_rate == 0.5
+    assert len(ctx) == 1
+    assert src1._src is src2._src
+    assert src1._lock is src2._lock
+
+    # overviews are looked up on open, asking for them doesn't touch the shared handle
+    with src1._lock:
+        assert src1.overviews == src2.overviews == tuple(sorted(src1._src.overviews(1)))
+
+    xx = src1.read().result()
+    yy = src2.read().result()
+    assert xx.shape == yy.shape == src1.shape
+
+    # context is recycled across loads
+    assert rdr.new_load_context(iter([b1]), ctx) is ctx
+    rdr.open(b1, ctx).result()
+    assert ctx.hits == 2
+
+    # LRU eviction
+    ctx = FileHandleCache(max_open=1)
+    assert rdr.new_load_context(iter([]), ctx) is not ctx
+    rdr.open(b1, ctx).result()
+    rdr.open(b3, ctx).result()
+    assert ctx.evictions == 1
+    assert len(ctx) == 1
+    assert _rio_uri(b3) in ctx
+    assert _rio_uri(b1) not in ctx
+
+    # evicted handle is still usable by existing readers
+    assert src1.read().result().shape == src1.shape
+
+    ctx.clear()
+    assert len(ctx) == 0
+
+    with pytest.raises(ValueError):
+        FileHandleCache(0)
+
+    # cache can be disabled
+    rdr = RDEntry().new_instance({'max_open_files': 0})
+    assert rdr.new_load_context(iter([b1]), None) is None
+    assert rdr.open(b1, None).result().shape == src1.shape
+
+
 def test_testutils_iodriver(data_folder):
     fpath = str(data_folder) + '/test.tif'
     src = open_reader(fpath)
@@ -217,3 +285,426 @@ def test_testutils_iodriver(data_folder):
     assert src.shape == (2000, 4000)
     assert src.nodata == -999
     assert src.dtype == np.dtype(np.int16)
+
+
+def test_default_read_multi():
+    from datacube.drivers._types import GeoRasterReader
+
+    class ConstReader(GeoRasterReader):
+        crs, transform, dtype, shape, nodata = None, None, np.dtype('int16'), (4, 5), None
+
+        def __init__(self, value, pool):
+            self._value = value
+            self._pool = pool
+
+        def read(self, window=None, out_shape=None):
+            if self._value is None:
+                return self._pool.submit(lambda: 1/0)
+            return self._pool.submit(lambda: np.full(out_shape or self.shape, self._value, dtype='int16'))
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        a, b, c, bad = (ConstReader(v, pool) for v in (1, 2, 3, None))
+        xx = a.read_multi([b, c], out_shape=(2, 3)).result()
+        assert xx.shape == (3, 2, 3)
+        assert xx[:, 0, 0].tolist() == [1, 2, 3]
+
+        with pytest.raises(ZeroDivisionError):
+            a.read_multi([bad, c]).result()
+
+
+def test_read_policy_cfg():
+    assert ReadPolicy.from_cfg({}) is None
+    assert ReadPolicy.from_cfg({'max_open_files': 3}) is None
+    assert RDEntry().new_instance({}).read_policy is None
+
+    rdr = RDEntry().new_instance({'read_retries': 2, 'read_backoff': 0})
+    assert rdr.read_policy is not None
+    assert rdr.read_policy.retries == 2
+    assert rdr.read_policy.backoff == 0
+    assert rdr.read_policy.hedging is False
+
+    p = ReadPolicy.from_cfg({'read_hedge_quantile': 0.9, 'read_hedge_after': 0.5,
+                             'read_hedge_min_samples': 2})
+    assert p.hedging is True
+    assert p.hedge_delay() == 0.5
+    p._record(0.1)
+    p._record(0.1)
+    assert p.hedge_delay() == pytest.approx(0.1)
+
+    with pytest.raises(ValueError):
+        ReadPolicy(retries=-1)
+
+    with pytest.raises(ValueError):
+        ReadPolicy(hedge_quantile=1.5)
+
+
+def test_read_policy_retries():
+    calls = []
+
+    def flaky(n_fail):
+        def read():
+            calls.append(1)
+            if len(calls) <= n_fail:
+                raise IOError("Failed")
+            return len(calls)
+        return read
+
+    p = ReadPolicy(retries=2, backoff=0)
+    assert p.run(flaky(2)) == 3
+    assert p.n_retries == 2
+
+    calls.clear()
+    with pytest.raises(IOError):
+        p.run(flaky(3))
+    assert len(calls) == 3
+
+    calls.clear()
+    with pytest.raises(IOError):
+        ReadPolicy().run(flaky(1))
+    assert len(calls) == 1
+
+    # retries use read_again
+    calls.clear()
+    assert p.run(flaky(100), lambda: 'again') == 'again'
+
+
+def test_read_policy_timeout_and_hedging():
+    def slow(dt, value):
+        def read():
+            time.sleep(dt)
+            return value
+        return read
+
+    p = ReadPolicy(timeout=0.05)
+    with pytest.raises(ReadTimeoutError):
+        p.run(slow(1, 'slow'))
+    assert p.n_timeouts == 1
+    assert p.run(slow(0, 'fast')) == 'fast'
+
+    def in_turn(*reads):
+        reads = iter(reads)
+        return lambda: next(reads)()
+
+    # timed out read is retried
+    p = ReadPolicy(timeout=0.05, retries=1, backoff=0)
+    assert p.run(slow(0, 'shared'), in_turn(slow(1, 'slow'), slow(0, 'fast'))) == 'fast'
+    assert (p.n_timeouts, p.n_retries) == (1, 1)
+
+    # hedged read wins over slow one
+    p = ReadPolicy(hedge_after=0.01)
+    t0 = time.monotonic()
+    assert p.run(slow(0, 'shared'), in_turn(slow(1, 'slow'), slow(0, 'fast'))) == 'fast'
+    assert time.monotonic() - t0 < 0.5
+    assert p.n_hedged == 1
+
+    # fast read doesn't get hedged, abandoned attempt can't hold shared state: read_again is used
+    assert p.run(slow(0, 'shared'), in_turn(slow(0, 'fast'), slow(0, 'hedged'))) == 'fast'
+    assert p.n_hedged == 1
+
+    # timeout counts from when attempt starts, not while it waits for a thread held by abandoned read
+    q = ReadPolicy(timeout=0.1, max_workers=1)
+    with pytest.raises(ReadTimeoutError):
+        q.run(slow(0.5, 'stuck'))
+    assert q.run(slow(0.05, 'queued')) == 'queued'
+    assert q.n_timeouts == 1
+    q.close()
+
+    # attempt pool size is configurable and defaults to twice the number of driver threads
+    assert ReadPolicy.from_cfg({'read_timeout': 1, 'read_max_workers': 3})._pool._max_workers == 3
+    rdr = RDEntry().new_instance({'read_timeout': 1, 'max_workers': 16})
+    assert rdr.read_policy._pool._max_workers == 32
+
+    # attempt threads are shut down on close, including abandoned slow read
+    threads = list(p._pool._threads)  # pylint: disable=protected-access
+    p.close()
+    for th in threads:
+        th.join(2)
+    assert not any(th.is_alive() for th in threads)
+    with pytest.raises(RuntimeError):
+        p.run(slow(0, 'fast'))
+
+    # policy without attempt pool has nothing to close
+    ReadPolicy(retries=1).close()
+
+
+def test_rio_driver_read_retry_http(tmpdir, httpserver):
+    # random pixels don't compress, so pixel data is not fetched with the header
+    image = np.random.randint(0, 1000, size=(256, 256), dtype='int16')
+    data = write_gtiff(str(tmpdir / 'a.tif'), image, nodata=-999, blocksize=64).path.read_bytes()
+    outage = 0.2  # seconds, starts with the first pixel request
+    outage_end = {}
+
+    def handler(request):
+        rng = request.headers.get('Range')
+        if request.method == 'HEAD':
+            return Response(status=200, headers={'Content-Length': str(len(data)),
+                                                 'Accept-Ranges': 'bytes'})
+        if rng is None:
+            return Response(data, status=200)
+
+        a, b = map(int, re.match(r'bytes=(\d+)-(\d+)', rng).groups())
+        if a > 0 and time.monotonic() < outage_end.setdefault(request.path, time.monotonic() + outage):
+            return Response(status=500)
+        return Response(data[a:b + 1], status=206,
+                        headers={'Content-Range': 'bytes {}-{}/{}'.format(a, b, len(data)),
+                                 'Accept-Ranges': 'bytes'})
+
+    def read(cfg, path):
+        httpserver.expect_request(path).respond_with_handler(handler)
+        rdr = RDEntry().new_instance(dict(pool=FakeThreadPoolExecutor(), allow_custom_pool=True, **cfg))
+        band = mk_band('a', httpserver.url_for('/'), path=path.lstrip('/'), format=GeoTIFF)
+        src = rdr.open(band, None).result()
+        return src.read().result()
+
+    with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN='EMPTY_DIR',
+                      CPL_VSIL_CURL_ALLOWED_EXTENSIONS='.tif'):
+        with pytest.raises(rasterio.errors.RasterioIOError):
+            read({}, '/no-retry.tif')
+
+        with pytest.raises(rasterio.errors.RasterioIOError):
+            read({'read_retries': 1, 'read_backoff': 0}, '/retry-too-soon.tif')
+
+        xx = read({'read_retries': 1, 'read_backoff': 2 * outage}, '/retry.tif')
+        np.testing.assert_array_equal(xx, image)
+
+
+def test_block_cache():
+    cache = BlockCache(100)
+    assert cache.hit_rate == 0
+    assert cache.get('a') is None
+
+    a = cache.put('a', np.zeros(40, dtype='uint8'))
+    assert not a.flags.writeable
+    cache.put('b', np.zeros(40, dtype='uint8'))
+    assert cache.get('a') is a
+    assert (cache.misses, cache.hits, cache.nbytes, len(cache)) == (1, 1, 80, 2)
+
+    # least recently used block goes first
+    cache.put('c', np.zeros(40, dtype='uint8'))
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.evictions == 1
+
+    # first block read wins, oversized blocks are returned but not kept
+    assert cache.put('a', np.ones(40, dtype='uint8')) is a
+    big = cache.put('big', np.ones(200, dtype='uint8'))
+    assert big.shape == (200,) and 'big' not in cache
+
+    cache.resize(50)
+    assert (len(cache), cache.nbytes, cache.evictions) == (1, 40, 2)
+    cache.clear()
+    assert (len(cache), cache.nbytes) == (0, 0)
+
+    with pytest.raises(ValueError):
+        BlockCache(-1)
+    with pytest.raises(ValueError):
+        cache.resize(-1)
+
+    # concurrent use keeps byte count consistent
+    cache = BlockCache(1000)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: cache.put(i % 37, np.zeros(10 + i % 7, dtype='uint8')), range(2000)))
+    assert cache.nbytes == sum(b.nbytes for b in cache._blocks.values()) <= 1000
+
+    assert shared_block_cache() is shared_block_cache()
+
+
+def test_rio_driver_block_cache(tmpdir):
+    image = np.random.randint(0, 1000, size=(200, 300), dtype='int16')
+    fname = str(tmpdir / 'a.tif')
+    write_gtiff(fname, image, nodata=-999, blocksize=64)
+    with rasterio.open(fname, 'r+') as f:
+        f.build_overviews([2, 4], rasterio.enums.Resampling.average)
+
+    band = mk_band('a', 'file://' + str(tmpdir) + '/', path='a.tif', format=GeoTIFF)
+    plain = RDEntry().new_instance({}).open(band, None).result()
+    assert RDEntry().new_instance({}).block_cache is None
+
+    rdr = RDEntry().new_instance({'block_cache_size': 1 << 20})
+    cache = rdr.block_cache
+    assert cache is shared_block_cache()
+    cache.clear()
+
+    reads = [(None, None),
+             (np.s_[10:100, 70:201], None),
+             (np.s_[64:128, 0:64], None),
+             (np.s_[8:200, 20:300], (96, 140)),  # overview 2, right/bottom edge
+             (np.s_[0:200, 0:300], (50, 75)),    # overview 4
+             (np.s_[3:200, 0:300], (50, 75))]    # not aligned to overview, not cached
+
+    def read_all(src):
+        return [src.read(w, s).result() for w, s in reads]
+
+    expect = read_all(plain)
+    np.testing.assert_array_equal(expect[0], image)
+    for xx, yy in zip(read_all(rdr.open(band, None).result()), expect):
+        np.testing.assert_array_equal(xx, yy)
+
+    assert cache.misses > 0
+    assert {k[2] for k in cache._blocks} == {0, 1, 2}
+    misses = cache.misses
+
+    # blocks survive file close and are re-used by later loads
+    for xx, yy in zip(read_all(rdr.open(band, None).result()), expect):
+        np.testing.assert_array_equal(xx, yy)
+    assert cache.misses == misses
+    assert cache.hits > 0
+
+    # reading several bands at once
+    src = rdr.open(band, FileHandleCache()).result()
+    assert src.read_multi([src], np.s_[:64, :64]).result().shape == (2, 64, 64)
+
+    # size is shared across the process, largest configured size wins
+    RDEntry().new_instance({'block_cache_size': 1000})
+    assert cache.max_bytes == 1 << 20
+    RDEntry().new_instance({'block_cache_size': 1 << 21})
+    assert shared_block_cache(None).max_bytes == 1 << 21
+    cache.resize(0)
+
+
+def test_rio_driver_block_cache_multiband(tmpdir, monkeypatch):
+    from datacube.drivers.rio import _reader
+
+    image = np.random.randint(0, 1000, size=(3, 200, 300), dtype='int16')
+    fname = str(tmpdir / 'a.tif')
+    write_gtiff(fname, image, nodata=-999, blocksize=64)
+    base = 'file://' + str(tmpdir) + '/'
+    bands = [mk_band('b{}'.format(i), base, path='a.tif', band=i + 1, format=GeoTIFF) for i in range(3)]
+
+    calls = []
+
+    def counted(read):
+        def _read(src, bidx, *args, **kwargs):
+            calls.append(bidx)
+            return read(src, bidx, *args, **kwargs)
+        return _read
+
+    monkeypatch.setattr(_reader, '_read', counted(_reader._read))
+    monkeypatch.setattr(_reader, '_read_multi', counted(_reader._read_multi))
+
+    rdr = RDEntry().new_instance({'block_cache_size': 1 << 20})
+    cache = rdr.block_cache
+    cache.clear()
+
+    ctx = FileHandleCache()
+    srcs = [rdr.open(band, ctx).result() for band in bands]
+    roi = np.s_[0:64, 0:128]
+
+    # missing blocks are read for all bands in one go
+    np.testing.assert_array_equal(srcs[0].read_multi(srcs[1:], roi).result(), image[(slice(None),) + roi])
+    assert calls == [[1, 2, 3], [1, 2, 3]]
+
+    # only bands that are not cached yet are read
+    del calls[:]
+    cache.clear()
+    np.testing.assert_array_equal(srcs[1].read(roi).result(), image[1][roi])
+    np.testing.assert_array_equal(srcs[0].read_multi(srcs[1:], roi).result(), image[(slice(None),) + roi])
+    assert calls == [2, 2, [1, 3], [1, 3]]
+
+    # cached blocks don't hold on to pixels of other bands
+    assert all(block.base is None or block.base.shape[0] == 64 for block in cache._blocks.values())
+    cache.resize(0)
+
+
+def test_disk_block_cache(tmpdir):
+    versions = {'s3://a/x.tif': 'v1', 's3://a/y.tif': None}
+    cache = DiskBlockCache(str(tmpdir / 'cache'), 1000, version_ttl=0, version=versions.get)
+    block = np.arange(100, dtype='int16').reshape(10, 10)
+
+    # local files and files without version are not cached
+    for uri in ('file:///x.tif', 's3://a/y.tif'):
+        assert cache.put((uri, 1, 0, (0, 0)), block) is block
+        assert cache.get((uri, 1, 0, (0, 0))) is None
+    assert cache.nbytes() == 0
+
+    cache.put(('s3://a/x.tif', 1, 0, (0, 0)), block)
+    xx = cache.get(('s3://a/x.tif', 1, 0, (0, 0)))
+    np.testing.assert_array_equal(xx, block)
+    assert not xx.flags.writeable
+    assert cache.get(('s3://a/x.tif', 1, 0, (0, 1))) is None
+    assert (cache.hits, cache.misses, cache.hit_rate) == (1, 1, 0.5)
+
+    # another process sees the same blocks, until the file changes
+    other = DiskBlockCache(cache.path, 1000, version_ttl=0, version=versions.get)
+    assert other.get(('s3://a/x.tif', 1, 0, (0, 0))) is not None
+    versions['s3://a/x.tif'] = 'v2'
+    assert other.get(('s3://a/x.tif', 1, 0, (0, 0))) is None
+
+    # least recently used blocks are evicted once directory grows over the cap
+    other.clear()
+    n = other.evictions
+    for i in range(6):
+        other.put(('s3://a/x.tif', 1, 0, (i, 0)), block)
+        os.utime(other._fname(('s3://a/x.tif', 1, 0, (i, 0))), (i, i))
+    assert other.nbytes() <= 1000
+    assert other.evictions - n == 3
+
+    assert other.get(('s3://a/x.tif', 1, 0, (3, 0))) is not None
+    other.put(('s3://a/x.tif', 1, 0, (6, 0)), block)
+    assert [other.get(('s3://a/x.tif', 1, 0, (i, 0))) is not None for i in range(3, 7)] == [True, False, True, True]
+
+    other.clear()
+    assert other.nbytes() == 0
+
+    with pytest.raises(ValueError):
+        DiskBlockCache(str(tmpdir), -1)
+
+
+def test_disk_block_cache_http(tmpdir, httpserver, monkeypatch):
+    from datacube.storage._rio import RasterDatasetDataSource
+
+    image = np.random.randint(0, 1000, size=(200, 300), dtype='int16')
+    data = write_gtiff(str(tmpdir / 'a.tif'), image, nodata=-999, blocksize=64).path.read_bytes()
+    etag = {'ETag': '"v1"'}
+
+    def handler(request):
+        if request.method == 'HEAD':
+            return Response(status=200, headers={'Content-Length': str(len(data)),
+                                                 'Accept-Ranges': 'bytes', **etag})
+        a, b = map(int, re.match(r'bytes=(\d+)-(\d+)', request.headers['Range']).groups())
+        return Response(data[a:b + 1], status=206,
+                        headers={'Content-Range': 'bytes {}-{}/{}'.format(a, b, len(data)),
+                                 'Accept-Ranges': 'bytes', **etag})
+
+    httpserver.expect_request('/a.tif').respond_with_handler(handler)
+    band = mk_band('a', httpserver.url_for('/'), path='a.tif', format=GeoTIFF)
+    cfg = {'disk_cache_dir': str(tmpdir / 'cache'), 'disk_cache_size': '1MB'}
+    local = mk_band('a', 'file://' + str(tmpdir) + '/', path='a.tif', format=GeoTIFF)
+
+    with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN='EMPTY_DIR'):
+        rdr = RDEntry().new_instance(cfg)
+        cache = rdr.disk_cache
+        assert cache is shared_disk_cache(cfg['disk_cache_dir'])
+        assert cache.max_bytes == 1000000
+
+        np.testing.assert_array_equal(rdr.open(band, None).result().read().result(), image)
+        assert cache.misses == 4*5 and cache.hits == 0
+
+        xx = rdr.open(band, None).result().read(np.s_[10:100, 70:201]).result()
+        np.testing.assert_array_equal(xx, image[10:100, 70:201])
+        assert cache.hits == 2*3
+
+        # local files are not cached on disk
+        rdr.open(local, None).result().read().result()
+        assert cache.hits + cache.misses == 4*5 + 2*3
+
+        # legacy reader path is configured from environment
+        monkeypatch.setenv('DATACUBE_DISK_CACHE_DIR', cfg['disk_cache_dir'])
+        assert shared_disk_cache() is cache
+        with RasterDatasetDataSource(band).open() as src:
+            np.testing.assert_array_equal(src.read(), image)
+            assert cache.hits == 2*3 + 4*5
+
+            # legacy reader passes windows as (start, stop) pairs
+            np.testing.assert_array_equal(src.read(((10, 100), (70, 201))), image[10:100, 70:201])
+            np.testing.assert_array_equal(src.read(rasterio.windows.Window(70, 10, 131, 90)),
+                                          image[10:100, 70:201])
+            assert cache.hits == 2*3 + 4*5 + 2*2*3
+
+        # changed file is read again
+        etag['ETag'] = '"v2"'
+        cache._versions.clear()
+        np.testing.assert_array_equal(rdr.open(band, None).result().read().result(), image)
+        assert cache.misses == 2*4*5
+
+    monkeypatch.delenv('DATACUBE_DISK_CACHE_DIR')
+    assert shared_disk_cache() is None
@@ -17,6 +17,7 @@ from datacube.testutils.io import RasterFileDataSource
 from datacube.storage import BandInfo
 from datacube.drivers.netcdf import create_netcdf_storage_unit, Variable
 from datacube.storage import reproject_and_fuse
+from datacube.storage._load import LoadMetrics
 from datacube.storage._rio import RasterDatasetDataSource, _url2rasterio
 from datacube.storage._read import read_time_slice
 from datacube.utils.geometry import GeoBox
@@ -44,6 +45,85 @@ def test_first_source_is_priority_in_reproject_and_fuse():
     assert (output_data == 1).all()
 
 
+def test_reproject_and_fuse_stops_when_full():
+    crs = epsg4326
+    shape = (2, 2)
+    no_data = -1
+
+    source1 = FakeDatasetSource([[1, 1], [no_data, 1]], crs=crs, shape=shape)
+    source2 = FakeDatasetSource([[2, 2], [2, no_data]], crs=crs, shape=shape)
+    source3 = FakeDatasetSource([[3, 3], [3, 3]], crs=crs, shape=shape,
+                                band_source_class=BrokenBandDataSource)
+    gbox = mk_gbox(shape, crs=crs)
+
+    metrics = LoadMetrics()
+    output_data = np.full(shape, fill_value=no_data, dtype='int16')
+    cbk_args = []
+    reproject_and_fuse([source1, source2, source3, source3], output_data, gbox, dst_nodata=no_data,
+                       progress_cbk=lambda *a: cbk_args.append(a),
+                       metrics=metrics)
+
+    assert (output_data == [[1, 1], [2, 1]]).all()
+    assert metrics.reads_skipped == 2
+    assert metrics.files_opened == 2
+    assert metrics.reads_paste == 2 and metrics.reads_warp == 0
+    assert metrics.bytes_read == 2*4*2
+    assert cbk_args == [(1, 4), (2, 4), (3, 4), (4, 4)]
+
+    metrics = LoadMetrics()
+    reproject_and_fuse([source1, source3, source2], output_data, gbox, dst_nodata=no_data,
+                       skip_broken_datasets=True, metrics=metrics)
+    assert (output_data == [[1, 1], [2, 1]]).all()
+    assert metrics.datasets_broken == 1
+    assert metrics.files_opened == 3
+
+    # custom fuser sees every source
+    with pytest.raises(OSError):
+        reproject_and_fuse([source1, source2, source3], output_data, gbox, dst_nodata=no_data,
+                           fuse_func=lambda dst, src: np.copyto(dst, src, where=(dst == no_data)))
+
+
+def test_reproject_and_fuse_scratch_memory(tmpdir):
+    import tracemalloc
+    from pathlib import Path
+    from datacube.storage._read import release_scratch_buffers
+    from datacube.testutils import mk_test_image
+    from datacube.testutils.io import write_gtiff
+    from datacube.testutils.geom import epsg3857
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    gbox = GeoBox(1024, 1024, Affine(10, 0, 0, 0, -10, 0), epsg3857)
+    aa = mk_test_image(64, 64, 'int16', nodata=nodata)
+
+    corners = [(0, 0), (0, 960), (960, 0), (960, 960), (500, 500)]
+    sources = []
+    for i, (row, col) in enumerate(corners):
+        mm = write_gtiff(tmpdir/'tile-{}.tif'.format(i), aa,
+                         crs=str(epsg3857),
+                         resolution=(10, -10),
+                         offset=gbox.transform*(col, row),
+                         nodata=nodata)
+        sources.append(RasterFileDataSource(str(mm.path), 1))
+
+    dst = np.full(gbox.shape, nodata, dtype='int16')
+    release_scratch_buffers()
+
+    tracemalloc.start()
+    try:
+        reproject_and_fuse(sources, dst, gbox, dst_nodata=nodata)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # no destination sized scratch memory is needed
+    assert peak < dst.nbytes//8
+
+    for row, col in corners:
+        np.testing.assert_array_equal(dst[row:row+64, col:col+64], aa)
+    assert (dst[100:900, 100:400] == nodata).all()
+
+
 def test_second_source_used_when_first_is_empty():
     crs = epsg4326
     shape = (2, 2)
@@ -4,15 +4,20 @@
 # SPDX-License-Identifier: Apache-2.0
 """ Test New IO driver loading
 """
-
+import gc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
 import numpy as np
+import pytest
 
 from datacube.storage._load import (
-    xr_load, _default_fuser
+    xr_load, _default_fuser, LoadMetrics
 )
 
 from datacube.api.core import Datacube
-from datacube.testutils import mk_sample_dataset
+from datacube.drivers.rio._reader import RDEntry
+from datacube.testutils import mk_sample_dataset, mk_test_image, gen_tiff_dataset
 from datacube.testutils.io import rio_slurp
 from datacube.testutils.iodriver import mk_rio_driver, tee_new_load_context
 
@@ -81,3 +86,152 @@ def test_new_xr_load(data_folder):
 
     np.testing.assert_array_equal(im[0], xx.a.values[0])
     np.testing.assert_array_equal(im[1], xx.b.values[0])
+
+
+def test_xr_load_pipelined(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    spatial = dict(resolution=(15, -15),
+                   offset=(11230, 1381110),)
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+    bb = np.full_like(aa, 7)
+
+    dss = []
+    for i, im in enumerate([aa, bb, aa[::-1]]):
+        bands = [SimpleNamespace(name=name, values=im, nodata=nodata)
+                 for name in ('a', 'b')]
+        ds, gbox = gen_tiff_dataset(bands, tmpdir,
+                                    prefix='ds{}-'.format(i),
+                                    timestamp='2018-07-19',
+                                    **spatial)
+        dss.append(ds)
+
+    sources = Datacube.group_datasets(dss, 'time')
+    measurements = [dss[0].type.measurements[n] for n in ('a', 'b')]
+    expect = np.where(aa == nodata, bb, aa)
+
+    rdr = RDEntry().new_instance({'pool': ThreadPoolExecutor(max_workers=4)})
+    for max_in_flight in (1, 2, 5, 100):
+        xx, _ = xr_load(sources, gbox, measurements, rdr, max_in_flight=max_in_flight)
+        np.testing.assert_array_equal(xx.a.values[0], expect)
+        np.testing.assert_array_equal(xx.b.values[0], expect)
+
+    with pytest.raises(ValueError):
+        xr_load(sources, gbox, measurements, rdr, max_in_flight=0)
+
+    # broken dataset in the middle of a group
+    (tmpdir/'ds1-a.tiff').unlink()
+    with pytest.raises(IOError):
+        xr_load(sources, gbox, measurements, rdr)
+
+    xx, _ = xr_load(sources, gbox, measurements, rdr, skip_broken_datasets=True)
+    np.testing.assert_array_equal(xx.a.values[0], np.where(aa == nodata, aa[::-1], aa))
+    np.testing.assert_array_equal(xx.b.values[0], expect)
+
+
+def test_xr_load_early_exit(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    spatial = dict(resolution=(15, -15),
+                   offset=(11230, 1381110),)
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+    bb = np.full_like(aa, 7)
+
+    dss = []
+    for i, im in enumerate([aa, bb, aa[::-1], bb]):
+        ds, gbox = gen_tiff_dataset(SimpleNamespace(name='a', values=im, nodata=nodata),
+                                    tmpdir,
+                                    prefix='ds{}-'.format(i),
+                                    timestamp='2018-07-19',
+                                    **spatial)
+        dss.append(ds)
+
+    # these should never be opened
+    (tmpdir/'ds2-a.tiff').unlink()
+    (tmpdir/'ds3-a.tiff').unlink()
+
+    sources = Datacube.group_datasets(dss, 'time')
+    measurements = [dss[0].type.measurements['a']]
+
+    for max_in_flight in (1, 2, 4):
+        metrics = LoadMetrics()
+        xx, _ = xr_load(sources, gbox, measurements, mk_rio_driver(),
+                        max_in_flight=max_in_flight,
+                        metrics=metrics)
+        np.testing.assert_array_equal(xx.a.values[0], np.where(aa == nodata, bb, aa))
+        assert metrics.reads_skipped == 2
+        assert metrics.files_opened == 2
+        assert metrics.reads_paste == 2
+        assert metrics.bytes_read == 2*aa.nbytes
+
+
+def test_xr_load_multiband(data_folder, monkeypatch):
+    from datacube.drivers.rio._reader import RIOReader
+    from datacube.utils.geometry import gbox as gbx
+
+    base = "file://" + str(data_folder) + "/metadata.yml"
+    ds = mk_sample_dataset([dict(name='a', path='test.tif'),
+                            dict(name='b', band=2, path='test.tif')], base)
+    sources = Datacube.group_datasets([ds], 'time')
+    measurements = [ds.type.measurements[n] for n in ('a', 'b')]
+    im, meta = rio_slurp(str(data_folder) + '/test.tif')
+
+    n_reads = dict(single=0, multi=0)
+
+    def counting(name, method):
+        def _read(*args, **kwargs):
+            n_reads[name] += 1
+            return method(*args, **kwargs)
+        return _read
+
+    monkeypatch.setattr(RIOReader, 'read', counting('single', RIOReader.read))
+    monkeypatch.setattr(RIOReader, 'read_multi', counting('multi', RIOReader.read_multi))
+
+    rdr = RDEntry().new_instance({})
+    xx, _ = xr_load(sources, meta.gbox, measurements, rdr)
+    assert n_reads == dict(single=0, multi=1)
+    np.testing.assert_array_equal(im[0], xx.a.values[0])
+    np.testing.assert_array_equal(im[1], xx.b.values[0])
+
+    # reprojected output should match band at a time reads
+    gbox = gbx.translate_pix(gbx.zoom_out(meta.gbox, 1.3), 0.3, -0.2)
+    for m in measurements:
+        m['resampling_method'] = 'bilinear'
+    xx, _ = xr_load(sources, gbox, measurements, rdr)
+    assert n_reads['multi'] == 2
+
+    no_cache = RDEntry().new_instance({'max_open_files': 0})
+    yy, _ = xr_load(sources, gbox, measurements, no_cache)
+    assert n_reads == dict(single=2, multi=2)
+    np.testing.assert_array_equal(xx.a.values, yy.a.values)
+    np.testing.assert_array_equal(xx.b.values, yy.b.values)
+
+
+def test_xr_load_out(data_folder, tmpdir):
+    from datacube.storage._load import output_allocator
+
+    base = "file://" + str(data_folder) + "/metadata.yml"
+    ds = mk_sample_dataset([dict(name='a', path='test.tif'),
+                            dict(name='b', band=2, path='test.tif')], base)
+    sources = Datacube.group_datasets([ds], 'time')
+    measurements = [ds.type.measurements[n] for n in ('a', 'b')]
+    im, meta = rio_slurp(str(data_folder) + '/test.tif')
+
+    dst = np.empty((1,) + meta.gbox.shape, dtype=measurements[1].dtype)
+    xx, _ = xr_load(sources, meta.gbox, measurements, mk_rio_driver(), out={'b': dst})
+    assert np.shares_memory(xx.b.values, dst)
+    np.testing.assert_array_equal(im[0], xx.a.values[0])
+    np.testing.assert_array_equal(im[1], dst[0])
+
+    xx, _ = xr_load(sources, meta.gbox, measurements, mk_rio_driver(), out=str(tmpdir))
+    np.testing.assert_array_equal(im[0], xx.a.values[0])
+    np.testing.assert_array_equal(im[1], xx.b.values[0])
+    assert len(list(Path(str(tmpdir)).glob('*.dat'))) == 2
+
+    # files are removed with the arrays
+    del xx
+    gc.collect()
+    assert list(Path(str(tmpdir)).glob('*.dat')) == []
+
+    alloc = output_allocator(str(tmpdir))
+    assert alloc(measurements[0], (0, 3)).shape == (0, 3)
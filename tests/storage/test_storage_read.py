@@ -4,6 +4,7 @@
 # SPDX-License-Identifier: Apache-2.0
 from affine import Affine
 import numpy as np
+from types import SimpleNamespace
 
 from datacube.storage._read import (
     can_paste,
@@ -38,6 +39,49 @@ def test_pick_read_scale():
     assert pick_read_scale(2.3) == 2
     assert pick_read_scale(1.99999) == 2
 
+    rdr = SimpleNamespace(overviews=(2, 4, 8))
+    assert pick_read_scale(3.7, rdr) == 3
+    assert pick_read_scale(3.7, rdr, resampling='nearest') == 3
+    assert pick_read_scale(3.7, rdr, resampling='average') == 2
+    assert pick_read_scale(4.0001, rdr, resampling='average') == 4
+    assert pick_read_scale(33.3, rdr, resampling='bilinear') == 8
+    assert pick_read_scale(1.5, rdr, resampling='average') == 1
+    assert pick_read_scale(0.5, rdr, resampling='average') == 1
+
+    # no overviews, or reader that doesn't know about overviews
+    assert pick_read_scale(3.7, SimpleNamespace(overviews=()), resampling='average') == 3
+    assert pick_read_scale(3.7, object(), resampling='average') == 3
+
+
+def test_read_from_overviews(tmpdir):
+    from datacube.testutils import mk_test_image
+    from datacube.testutils.io import write_gtiff
+    from datacube.testutils.iodriver import open_reader
+    from pathlib import Path
+    import rasterio
+    from rasterio.enums import Resampling
+
+    pp = Path(str(tmpdir))
+    xx = mk_test_image(256, 128, nodata=None)
+    mm = write_gtiff(pp/'tst-overviews.tif', xx, nodata=-999, blocksize=64)
+
+    rdr = open_reader(mm.path)
+    assert rdr.overviews == ()
+
+    with rasterio.open(str(mm.path), 'r+') as f:
+        f.build_overviews([4, 2], Resampling.average)
+
+    rdr = open_reader(mm.path)
+    assert rdr.overviews == (2, 4)
+
+    gbox = gbx.zoom_out(mm.gbox, 4.5)
+    assert pick_read_scale(4.5, rdr, resampling='average') == 4
+
+    yy, roi = read_time_slice_v2(rdr, gbox, 'average', -999)
+    assert roi_shape(roi) == gbox.shape
+    assert yy.shape == gbox.shape
+    assert not (yy == -999).any()
+
 
 def test_can_paste():
     src = AlbersGS.tile_geobox((17, -40))
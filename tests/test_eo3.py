@@ -14,6 +14,7 @@ from datacube.index.eo3 import (
     add_eo3_parts,
     is_doc_eo3,
     grid2points,
+    norm_grid,
 )
 
 SAMPLE_DOC = '''---
@@ -89,6 +90,12 @@ def test_grid2points():
                 dict(transform=identity)]:
         with pytest.raises(ValueError):
             grid2points(bad)
+        with pytest.raises(ValueError):
+            norm_grid(bad)
+
+    grid = norm_grid(dict(shape=[11, 22], transform=list(Affine.translation(100, 0))))
+    assert grid.shape == [11, 22]
+    assert grid.transform == Affine.translation(100, 0)
 
 
 def test_is_eo3(sample_doc, sample_doc_180):
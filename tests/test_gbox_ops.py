@@ -182,3 +182,24 @@ def test_gbox_tiles():
     assert tt.chunk_shape((0, 1)) == (h, 2)
     assert tt.chunk_shape((1, 1)) == (1, 2)
     assert tt.chunk_shape((1, 0)) == (1, w)
+
+    # tile grid starting before the geobox, first tiles are smaller
+    (H, W) = (25, 22)
+    (h, w) = (10, 20)
+    gbox = GeoBox(W, H, A, epsg3857)
+    tt = gbx.GeoboxTiles(gbox, (h, w), offset=(4, 15))
+    assert tt.offset == (4, 15)
+    assert tt.shape == (3, 2)
+    assert tt.chunk_shape((0, 0)) == (6, 5)
+    assert tt.chunk_shape((1, 1)) == (10, 17)
+    assert tt.chunk_shape((2, 1)) == (9, 17)
+    assert tt[0, 0] == gbox[0:6, 0:5]
+    assert tt[1, 1] == gbox[6:16, 5:22]
+    assert list(tt.tiles(gbox[7:9, 3:4].extent)) == [(1, 0)]
+    assert sorted(tt.tiles(gbox.extent)) == [(i, j) for i in range(3) for j in range(2)]
+
+    with pytest.raises(IndexError):
+        tt.chunk_shape((3, 0))
+
+    with pytest.raises(ValueError):
+        gbx.GeoboxTiles(gbox, (h, w), offset=(10, 0))
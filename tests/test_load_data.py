@@ -5,6 +5,7 @@
 from datacube import Datacube
 from datacube.api.query import query_group_by
 import numpy as np
+import xarray
 from types import SimpleNamespace
 import pytest
 
@@ -143,6 +144,611 @@ def test_load_data_cbk(tmpdir):
     assert progress_call_data == [(1, 4), (2, 4)]
 
 
+def test_load_data_cbk_dask(tmpdir):
+    import pickle
+    from datacube.api import TerminateCurrentLoad
+    from datacube.api.core import _LazyLoadProgress
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+    ds, gbox = gen_tiff_dataset(SimpleNamespace(name='aa', values=aa, nodata=nodata),
+                                tmpdir,
+                                prefix='ds1-',
+                                timestamp='2018-07-19',
+                                resolution=(15, -15),
+                                offset=(11230, 1381110))
+    sources = Datacube.group_datasets([ds], 'time')
+    chunks = {'x': 48, 'y': 32}
+
+    progress_call_data = []
+    xx = Datacube.load_data(sources, gbox, ds.type.measurements, dask_chunks=chunks,
+                            progress_cbk=lambda *a: progress_call_data.append(a))
+    assert progress_call_data == []
+    xx.load()
+    assert sorted(progress_call_data) == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    assert 'dc_partial_load' not in xx.attrs
+    np.testing.assert_array_equal(aa, xx.aa.values[0])
+
+    def cancel_after_two(n, nt):
+        if n > 2:
+            raise TerminateCurrentLoad()
+
+    xx = Datacube.load_data(sources, gbox, ds.type.measurements, dask_chunks=chunks,
+                            progress_cbk=cancel_after_two)
+    xx.load(scheduler='synchronous')
+    assert xx.attrs['dc_partial_load'] is True
+
+    # chunk that triggered cancel keeps its pixels, the one after is never read
+    n_loaded, n_empty = 0, 0
+    for roi in (np.s_[:32, :48], np.s_[:32, 48:], np.s_[32:, :48], np.s_[32:, 48:]):
+        if (xx.aa.values[0][roi] == aa[roi]).all():
+            n_loaded += 1
+        elif (xx.aa.values[0][roi] == nodata).all():
+            n_empty += 1
+    assert (n_loaded, n_empty) == (3, 1)
+
+    # copies sent to other processes keep cancellation state, but don't report progress
+    progress = pickle.loads(pickle.dumps(_LazyLoadProgress(cancel_after_two, 10)))
+    assert progress.cancelled is False
+    progress()
+    progress.cancel()
+    with pytest.raises(TerminateCurrentLoad):
+        progress()
+
+
+def _load_progress(xx):
+    """ Progress object shared by tasks of a dask load """
+    return next(layer.progress for layer in xx.__dask_graph__().layers.values()
+                if getattr(layer, 'progress', None) is not None)
+
+
+def test_load_data_cbk_distributed(tmpdir, monkeypatch):
+    import pickle
+    import threading
+    import weakref
+    from distributed import Client, Event, Queue
+    from datacube.api import TerminateCurrentLoad, core
+    from datacube.api.core import _LazyLoadProgress, _relay_progress
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+    ds, gbox = gen_tiff_dataset(SimpleNamespace(name='aa', values=aa, nodata=nodata),
+                                tmpdir,
+                                prefix='ds1-',
+                                timestamp='2018-07-19',
+                                resolution=(15, -15),
+                                offset=(11230, 1381110))
+    sources = Datacube.group_datasets([ds], 'time')
+    chunks = {'x': 48, 'y': 32}
+
+    with Client(n_workers=1, threads_per_worker=1, processes=False, dashboard_address=None):
+        # progress is reported from workers, relayed to the callback in this process
+        progress_call_data = []
+        xx = Datacube.load_data(sources, gbox, ds.type.measurements, dask_chunks=chunks,
+                                progress_cbk=lambda *a: progress_call_data.append(a))
+        yy = xx.compute()
+        assert _load_progress(xx).wait(10)
+        assert progress_call_data == [(1, 4), (2, 4), (3, 4), (4, 4)]
+        assert 'dc_partial_load' not in yy.attrs
+        np.testing.assert_array_equal(aa, yy.aa.values[0])
+
+        # cancelling marks Dataset returned by load, not copies made before that
+        def cancel_first(n, nt):
+            raise TerminateCurrentLoad()
+
+        xx = Datacube.load_data(sources, gbox, ds.type.measurements, dask_chunks=chunks,
+                                progress_cbk=cancel_first)
+        yy = xx.compute()
+        assert _load_progress(xx).wait(10)
+        assert xx.attrs['dc_partial_load'] is True
+        assert 'dc_partial_load' not in yy.attrs
+
+        # copies sent to workers see cancellation, checking at most every _CANCEL_CHECK_INTERVAL seconds
+        name = 'dc_progress-test'
+        progress = _LazyLoadProgress(None, 10, name=name)
+        remote = pickle.loads(pickle.dumps(progress))
+        assert remote.cancelled is False
+        progress.cancel()
+        assert remote.cancelled is False
+        monkeypatch.setattr(core, '_CANCEL_CHECK_INTERVAL', 0)
+        assert remote.cancelled is True
+        with pytest.raises(TerminateCurrentLoad):
+            remote()
+
+        # relay stops once progress object is gone and clears cancellation flag
+        relay = threading.Thread(target=_relay_progress, args=(weakref.ref(progress), Queue(name), Event(name)))
+        del progress
+        relay.start()
+        relay.join(10)
+        assert not relay.is_alive()
+        assert not Event(name).is_set()
+
+
+def test_load_data_dask_graph(tmpdir):
+    """ Graph size and build time should not grow with the number of chunks """
+    from time import monotonic
+    from datacube.utils.geometry import GeoBox
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+    ds, gbox = gen_tiff_dataset([SimpleNamespace(name='aa', values=aa, nodata=nodata),
+                                 SimpleNamespace(name='bb', values=aa, nodata=nodata)],
+                                tmpdir,
+                                prefix='ds1-',
+                                timestamp='2018-07-19',
+                                resolution=(15, -15),
+                                offset=(11230, 1381110))
+    sources = Datacube.group_datasets([ds], 'time').isel(time=[0]*5)
+    gbox = GeoBox(10_000, 10_000, gbox.transform, gbox.crs)
+
+    t0 = monotonic()
+    xx = Datacube.load_data(sources, gbox, ds.type.measurements, dask_chunks={'x': 48, 'y': 32})
+    t_build = monotonic() - t0
+
+    n_chunks = 5*(10_000//32 + 1)*(10_000//48 + 1)
+    assert xx.aa.data.npartitions == n_chunks
+    assert t_build < 5
+
+    graph = xx.__dask_graph__()
+    lazy = [layer for layer in graph.layers.values() if not layer.is_materialized()]
+    assert len(lazy) == 2
+    assert [len(layer) for layer in lazy] == [n_chunks]*2
+    # one copy of datasets shared by all measurements
+    assert len(graph.layers) == 3
+
+    yy = xx.isel(time=slice(0, 2), y=slice(0, 64), x=slice(0, 96))
+    assert len(yy.aa.data.__dask_optimize__(yy.aa.data.dask, yy.aa.data.__dask_keys__())) < 20
+
+    yy = yy.load()
+    np.testing.assert_array_equal(yy.aa.values[1], aa)
+    np.testing.assert_array_equal(yy.bb.values[0], aa)
+    assert (xx.aa[0, 64:96, 96:144] == nodata).all()
+
+
+def test_load_data_dask_group_measurements(data_folder, monkeypatch):
+    from datacube.api import core
+    from datacube.storage import _rio
+
+    base = "file://" + str(data_folder) + "/metadata.yml"
+    im, meta = rio_slurp(str(data_folder) + '/test.tif')
+    ds = mk_sample_dataset([dict(name='a', path='test.tif'),
+                            dict(name='b', band=2, path='test.tif')], base, geobox=meta.gbox)
+    sources = Datacube.group_datasets([ds], 'time')
+    chunks = {'longitude': 2000, 'latitude': 1000}
+
+    opened = []
+    rio_open = _rio._rio_open
+
+    def counting_open(fname):
+        src = rio_open(fname)
+        opened.append(src)
+        return src
+
+    monkeypatch.setattr(_rio, '_rio_open', counting_open)
+
+    xx = Datacube.load_data(sources, meta.gbox, ds.type.measurements, dask_chunks=chunks)
+    xx_chunks = xx.a.data.chunks
+    xx = xx.load()
+    assert len(opened) == 2*4
+
+    opened.clear()
+    yy = Datacube.load_data(sources, meta.gbox, ds.type.measurements, dask_chunks=chunks,
+                            dask_group_measurements=True)
+    assert yy.a.data.chunks == yy.b.data.chunks == xx_chunks
+
+    # footprint is checked once per chunk for both measurements
+    footprints = []
+    footprint_roi = core._footprint_roi
+    monkeypatch.setattr(core, '_footprint_roi', lambda *a, **kw: footprints.append(a) or footprint_roi(*a, **kw))
+
+    yy = yy.load()
+    assert len(opened) == 4
+    assert len(footprints) == 4
+    assert all(src.closed for src in opened)
+
+    np.testing.assert_array_equal(im[0], yy.a.values[0])
+    np.testing.assert_array_equal(im[1], yy.b.values[0])
+    xarray.testing.assert_identical(xx, yy)
+
+
+def test_load_data_dask_time_chunks(tmpdir):
+    import uuid
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    dss = []
+    for i, timestamp in enumerate(['2018-07-19', '2018-07-20', '2018-07-21']):
+        aa = mk_test_image(96, 64, 'int16', nodata=nodata) + i
+        ds, gbox = gen_tiff_dataset(SimpleNamespace(name='aa', values=aa, nodata=nodata),
+                                    tmpdir,
+                                    prefix='ds{}-'.format(i),
+                                    timestamp=timestamp,
+                                    resolution=(15, -15),
+                                    offset=(11230, 1381110))
+        ds.metadata_doc['id'] = str(uuid.uuid4())
+        dss.append(ds)
+
+    sources = Datacube.group_datasets(dss, 'time')
+    expect = Datacube.load_data(sources, gbox, ds.type.measurements)
+
+    xx = Datacube.load_data(sources, gbox, ds.type.measurements,
+                            dask_chunks={'time': 2, 'x': 48, 'y': 32})
+    assert xx.aa.data.chunks == ((2, 1), (32, 32), (48, 48))
+    # blocks are loaded directly, no rechunking
+    assert len(xx.__dask_graph__()) == 2*2*2 + len(dss)
+
+    yy = Datacube.load_data(sources, gbox, ds.type.measurements,
+                            dask_chunks={'time': -1}, dask_group_measurements=True)
+    assert yy.aa.data.chunks == ((3,), (64,), (96,))
+
+    xarray.testing.assert_identical(expect, xx.load())
+    xarray.testing.assert_identical(expect, yy.load())
+
+
+def test_load_data_stacked(tmpdir, monkeypatch):
+    import rasterio
+    import uuid
+    from datacube.storage import _rio
+    from datacube.utils.geometry import gbox as gbx
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    stack = np.stack([mk_test_image(96, 64, 'int16', nodata=nodata) + i for i in range(4)])
+    meta = write_gtiff(tmpdir/'stack.tif', stack, nodata=nodata, resolution=(15, -15), offset=(11230, 1381110))
+
+    # one dataset per time slice, all pointing into the same layered file
+    dss = []
+    for i in range(4):
+        ds = mk_sample_dataset([dict(name='aa', band=i + 1, path='stack.tif', dtype='int16', nodata=nodata)],
+                               (tmpdir/'stack.yaml').as_uri(), timestamp='2018-07-{}'.format(19 + i),
+                               id=str(uuid.uuid4()), geobox=meta.gbox)
+        dss.append(ds)
+    sources = Datacube.group_datasets(dss, 'time')
+    mm = [dss[0].type.measurements['aa']]
+
+    class CountingReader(rasterio.DatasetReader):
+        def read(self, *args, **kw):
+            reads.append(kw.get('indexes'))
+            return super().read(*args, **kw)
+
+    opened, reads = [], []
+
+    def counting_open(fname):
+        src = CountingReader(rasterio.path.parse_path(str(fname)), sharing=False)
+        opened.append(src)
+        return src
+
+    monkeypatch.setattr(_rio, '_rio_open', counting_open)
+
+    xx = Datacube.load_data(sources, meta.gbox, mm)
+    np.testing.assert_array_equal(xx.aa.values, stack)
+    assert len(opened) == 1 and opened[0].closed
+    assert reads == [[1, 2, 3, 4]]
+
+    # reprojected reads
+    gbox = gbx.zoom_out(meta.gbox, 1.7)
+    opened.clear()
+    reads.clear()
+    yy = Datacube.load_data(sources, gbox, mm, resampling='bilinear')
+    assert len(opened) == 1 and reads == [[1, 2, 3, 4]]
+    for i, ds in enumerate(dss):
+        expect = Datacube.load_data(Datacube.group_datasets([ds], 'time'), gbox, mm, resampling='bilinear')
+        np.testing.assert_array_equal(yy.aa.values[i], expect.aa.values[0])
+
+    # dask: time slices of a chunk are read together
+    opened.clear()
+    reads.clear()
+    zz = Datacube.load_data(sources, meta.gbox, mm, dask_chunks={'time': 2})
+    xarray.testing.assert_identical(xx, zz.load())
+    assert len(opened) == 2
+    assert sorted(reads) == [[1, 2], [3, 4]]
+
+
+def test_load_data_dask_payload(tmpdir):
+    import pickle
+    from datacube.storage import BandInfo
+    from datacube.api.core import _read_source
+    from datacube.model import Measurement
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+    ds, gbox = gen_tiff_dataset([SimpleNamespace(name='aa', values=aa, nodata=nodata),
+                                 SimpleNamespace(name='bb', values=aa, nodata=nodata)],
+                                tmpdir,
+                                prefix='ds1-',
+                                timestamp='2018-07-19',
+                                resolution=(15, -15),
+                                offset=(11230, 1381110))
+    ds.metadata_doc['lineage'] = {'source_datasets': {'x{}'.format(i): {'id': str(i)} for i in range(100)}}
+    sources = Datacube.group_datasets([ds], 'time')
+
+    for group in (False, True):
+        xx = Datacube.load_data(sources, gbox, ds.type.measurements, dask_chunks={'x': 48, 'y': 32},
+                                dask_group_measurements=group)
+        graph = dict(xx.__dask_graph__())
+        payload = [v for v in graph.values() if not isinstance(v, tuple)]
+        assert [type(v) for v in payload] == [BandInfo]*2
+        assert len(pickle.dumps(payload[0])) < min(1024, len(pickle.dumps(ds)) / 5)
+        xarray.testing.assert_identical(xx.load(), Datacube.load_data(sources, gbox, ds.type.measurements))
+
+    # bands that can't be described are passed on as datasets, errors are raised on compute
+    assert _read_source(ds, 'no_such_band') is ds
+    missing = Measurement(**dict(ds.type.measurements['aa'], name='no_such_band'))
+    xx = Datacube.load_data(sources, gbox, [missing], dask_chunks={})
+    with pytest.raises(ValueError):
+        xx.load()
+
+
+def test_load_data_dask_locality(tmpdir):
+    import dask
+    from distributed import Client
+    from datacube.utils.dask import DataLocalityPlugin
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+    dss = [gen_tiff_dataset(SimpleNamespace(name='aa', values=aa, nodata=nodata), tmpdir,
+                            prefix='ds{}-'.format(i),
+                            timestamp='2018-07-1{}'.format(i),
+                            resolution=(15, -15),
+                            offset=(11230, 1381110)) for i in range(3)]
+    gbox = dss[0][1]
+    for i, (ds, _) in enumerate(dss):
+        ds.metadata_doc['id'] = '10000000-0000-0000-0000-00000000000{}'.format(i)
+    sources = Datacube.group_datasets([ds for ds, _ in dss], 'time')
+    mm = list(dss[0][0].type.measurements.values())
+
+    xx = Datacube.load_data(sources, gbox, mm, dask_chunks={'x': 48, 'y': 32})
+    layer, = [lr for lr in xx.aa.__dask_graph__().layers.values() if 'dc_uris' in (lr.annotations or {})]
+    uris = {key: layer.annotations['dc_uris'](key) for key in layer}
+    assert len(uris) == 3*2*2
+    expect = {t: ((tmpdir/'ds{}-aa.tiff'.format(t)).as_uri(),) for t in range(3)}
+    assert {key[1]: u for key, u in uris.items()} == expect
+
+    plugin = DataLocalityPlugin()
+    with Client(n_workers=2, threads_per_worker=1, processes=False, dashboard_address=None) as client:
+        client.register_scheduler_plugin(plugin)
+        with dask.config.set({'optimization.fuse.active': False}):
+            yy = client.persist(xx.aa)
+            np.testing.assert_array_equal(yy.values, xx.aa.values)
+            placed = client.who_has(yy)
+
+        assert client.cluster.scheduler.plugins[plugin.name].n_placed == len(uris)
+        workers = {}
+        for key, who in placed.items():
+            workers.setdefault(eval(key)[1], set()).update(who)  # pylint: disable=eval-used
+        assert all(len(w) == 1 for w in workers.values())
+
+
+def test_load_data_footprint_pruning(tmpdir):
+    from datacube.api.core import _footprint_roi, _plan_sources
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+    band = SimpleNamespace(name='aa', values=aa, nodata=nodata)
+
+    ds, gbox = gen_tiff_dataset(band, tmpdir,
+                                prefix='ds1-',
+                                timestamp='2018-07-19',
+                                resolution=(15, -15),
+                                offset=(11230, 1381110))
+    ds_far, _ = gen_tiff_dataset(band, tmpdir,
+                                 prefix='ds2-',
+                                 timestamp='2018-07-19',
+                                 resolution=(15, -15),
+                                 offset=(11230 + 15*200, 1381110))
+
+    assert _footprint_roi(ds, gbox) == np.s_[0:64, 0:96]
+    assert _footprint_roi(ds, gbox[10:20, 30:40]) == np.s_[0:10, 0:10]
+    assert _footprint_roi(ds_far, gbox) == np.s_[0:0, 0:0]
+    assert _footprint_roi(SimpleNamespace(extent=None), gbox) is None
+
+    assert _plan_sources([ds, ds_far], gbox) == [(ds, np.s_[0:64, 0:96])]
+
+    # file for the non-overlapping dataset is never opened
+    (tmpdir/'ds2-aa.tiff').unlink()
+    progress_call_data = []
+
+    sources = Datacube.group_datasets([ds, ds_far], 'time')
+    xx = Datacube.load_data(sources, gbox, [ds.type.measurements['aa']],
+                            progress_cbk=lambda *a: progress_call_data.append(a))
+    np.testing.assert_array_equal(aa, xx.aa.values[0])
+    assert progress_call_data == [(1, 1)]
+
+
+def test_load_iter(tmpdir):
+    from datacube.api import TerminateCurrentLoad
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+
+    dss = []
+    for i, day in enumerate(('2018-07-19', '2018-07-20', '2018-07-21')):
+        ds, gbox = gen_tiff_dataset(SimpleNamespace(name='aa', values=aa + i, nodata=nodata),
+                                    tmpdir,
+                                    prefix='ds{}-'.format(i),
+                                    timestamp=day,
+                                    resolution=(15, -15),
+                                    offset=(11230, 1381110))
+        dss.append(ds)
+
+    dc = Datacube(index=SimpleNamespace())
+    expect = dc.load(datasets=dss, like=gbox)
+    assert expect.aa.shape == (3,) + gbox.shape
+
+    batches = list(dc.load_iter(datasets=dss, like=gbox))
+    assert [xx.time.size for xx in batches] == [1, 1, 1]
+    for i, xx in enumerate(batches):
+        assert xx.aa.dims == expect.aa.dims
+        np.testing.assert_array_equal(xx.aa.values, expect.aa.values[i:i+1])
+        assert xx.time.values[0] == expect.time.values[i]
+
+    batches = [xx.aa.values.copy() for xx in dc.load_iter(datasets=dss, like=gbox, batch_size=2)]
+    assert [b.shape[0] for b in batches] == [2, 1]
+    np.testing.assert_array_equal(np.concatenate(batches), expect.aa.values)
+
+    # with re-use every batch is loaded into the same memory
+    addrs = set()
+    for i, xx in enumerate(dc.load_iter(datasets=dss, like=gbox, reuse_buffers=True)):
+        np.testing.assert_array_equal(xx.aa.values[0], expect.aa.values[i])
+        addrs.add(xx.aa.values.__array_interface__['data'][0])
+    assert len(addrs) == 1
+
+    assert list(dc.load_iter(datasets=[], like=gbox)) == []
+    # bad arguments are reported on call, not on first next()
+    with pytest.raises(ValueError):
+        dc.load_iter(datasets=dss, like=gbox, batch_size=0)
+
+    # cancelled batch is the last one
+    def cancel_second(n, nt):
+        if len(loaded) == 1:
+            raise TerminateCurrentLoad()
+
+    loaded = []
+    for xx in dc.load_iter(datasets=dss, like=gbox, progress_cbk=cancel_second):
+        loaded.append(xx)
+    assert len(loaded) == 2
+    assert 'dc_partial_load' not in loaded[0].attrs
+    assert loaded[1].attrs['dc_partial_load'] is True
+
+
+def test_load_plan_only(tmpdir):
+    from datacube.utils.geometry import gbox as gbx
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+    dss = []
+    for i in range(2):
+        ds, gbox = gen_tiff_dataset(SimpleNamespace(name='aa', values=aa, nodata=nodata),
+                                    tmpdir,
+                                    prefix='ds{}-'.format(i),
+                                    timestamp='2018-07-{}'.format(19 + i),
+                                    resolution=(15, -15),
+                                    offset=(11230, 1381110))
+        dss.append(ds)
+
+    # files should never be touched
+    for f in tmpdir.glob('*.tiff'):
+        f.unlink()
+
+    dc = Datacube(index=SimpleNamespace())
+    plan = dc.load(datasets=dss, like=gbox[10:40, 5:50], plan_only=True)
+    assert plan['measurements'] == ['aa']
+    assert plan['files'] == 2
+    assert plan['reads'] == 2
+    assert plan['bytes_out'] == 2*30*45*2
+    times = [g['coords']['time'] for g in plan['groups']]
+    assert times == [np.datetime64('2018-07-19'), np.datetime64('2018-07-20')]
+
+    # no pixel grid in metadata: footprint at output resolution
+    rd, = plan['groups'][0]['reads']
+    assert rd['dataset'] == dss[0].id
+    assert rd['dst_roi'] == ((0, 30), (0, 45))
+    assert rd['src_roi'] is None and rd['paste'] is None
+    assert rd['bytes_read'] == 30*45*2
+
+    # pixel grid recorded in metadata (EO3 style)
+    for ds in dss:
+        ds.metadata_doc['grids'] = {'default': {'shape': list(gbox.shape),
+                                                'transform': list(gbox.transform)}}
+
+    plan = dc.load(datasets=dss, like=gbox[10:40, 5:50], plan_only=True)
+    rd, = plan['groups'][0]['reads']
+    assert rd['src_roi'] == ((10, 40), (5, 50))
+    assert rd['paste'] is True
+    assert rd['scale'] == 1
+    assert plan['bytes_read'] == 2*30*45*2
+
+    plan = dc.load(datasets=dss, like=gbx.zoom_out(gbox, 2.5), resampling='average', plan_only=True)
+    rd, = plan['groups'][0]['reads']
+    assert rd['paste'] is False
+    assert rd['scale'] == 2
+    assert rd['bytes_read'] == 32*48*2
+
+    plan = dc.load(datasets=[], like=gbox, plan_only=True)
+    assert plan['groups'] == [] and plan['bytes_read'] == 0
+
+
+def test_load_data_metrics(tmpdir):
+    import pickle
+    import uuid
+    from distributed import Client
+    from datacube.storage._load import LoadMetrics
+    from datacube.utils.geometry import gbox as gbx
+
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+
+    dss = []
+    for i in range(3):
+        ds, gbox = gen_tiff_dataset(SimpleNamespace(name='aa', values=aa, nodata=nodata),
+                                    tmpdir,
+                                    prefix='ds{}-'.format(i),
+                                    timestamp='2018-07-{}'.format(19 + i),
+                                    resolution=(15, -15),
+                                    offset=(11230, 1381110))
+        ds.metadata_doc['id'] = str(uuid.uuid4())
+        dss.append(ds)
+    (tmpdir/'ds2-aa.tiff').unlink()
+
+    sources = Datacube.group_datasets(dss, 'time')
+    mm = [dss[0].type.measurements['aa']]
+
+    metrics = LoadMetrics()
+    xx = Datacube.load_data(sources, gbox, mm, skip_broken_datasets=True, metrics=metrics)
+    assert 'dc_load_metrics' not in xx.attrs
+    assert metrics.files_opened == 2
+    assert metrics.datasets_broken == 1
+    assert metrics.reads_paste == 2 and metrics.reads_warp == 0
+    assert metrics.bytes_read == 2*aa.nbytes
+    assert metrics.t_read > 0 and metrics.t_open > 0
+
+    Datacube.load_data(sources, gbx.zoom_out(gbox, 1.3), mm, resampling='bilinear',
+                       skip_broken_datasets=True, metrics=metrics)
+    assert metrics.reads_warp == 2
+    assert metrics.t_warp > 0
+
+    # dask: per task counts are added up as chunks get computed
+    metrics = LoadMetrics()
+    xx = Datacube.load_data(sources, gbox, mm, skip_broken_datasets=True, metrics=metrics,
+                            dask_chunks={'time': 1, 'x': 48, 'y': 32})
+    assert metrics.files_opened == 0
+    xx.load()
+    assert metrics.files_opened == 2*4
+    assert metrics.datasets_broken == 4
+    assert metrics.bytes_read == 2*aa.nbytes
+
+    assert 'dc_load_metrics' not in xx.attrs
+
+    mm2 = pickle.loads(pickle.dumps(metrics))
+    assert mm2.to_dict() == metrics.to_dict()
+    assert LoadMetrics.from_dict(metrics.to_dict()).to_dict() == metrics.to_dict()
+    mm2.update(metrics)
+    assert mm2.files_opened == 2*metrics.files_opened
+    assert 'files_opened=8' in repr(metrics)
+
+    # dask.distributed: tasks send their counts back to the process that constructed the load
+    metrics = LoadMetrics()
+    with Client(n_workers=2, threads_per_worker=1, processes=False, dashboard_address=None):
+        xx = Datacube.load_data(sources, gbox, mm, skip_broken_datasets=True, metrics=metrics,
+                                dask_chunks={'time': 1, 'x': 48, 'y': 32})
+        yy = xx.compute()
+        assert _load_progress(xx).wait(10)
+
+    assert 'dc_load_metrics' not in yy.attrs
+    assert metrics.files_opened == 2*4
+    assert metrics.datasets_broken == 4
+    assert metrics.bytes_read == 2*aa.nbytes
+
+
 def test_hdf5_lock_release_on_failure():
     from datacube.storage._rio import RasterDatasetDataSource, HDF5_LOCK
     from datacube.storage import BandInfo
@@ -328,3 +934,45 @@ def test_native_load(tmpdir):
     xx = native_load(ds, ['cc'])
     assert xx.geobox == gbox_cc
     np.testing.assert_array_equal(cc, xx.isel(time=0).cc.values)
+
+
+def test_load_data_out(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    nodata = -999
+    aa = mk_test_image(96, 64, 'int16', nodata=nodata)
+
+    ds, gbox = gen_tiff_dataset([SimpleNamespace(name='aa', values=aa, nodata=nodata),
+                                 SimpleNamespace(name='bb', values=aa[::-1], nodata=nodata)],
+                                tmpdir,
+                                prefix='ds1-',
+                                timestamp='2018-07-19',
+                                resolution=(15, -15),
+                                offset=(11230, 1381110))
+    sources = Datacube.group_datasets([ds], 'time')
+    mm = [ds.type.measurements[n] for n in ('aa', 'bb')]
+
+    dst = np.zeros((1,) + gbox.shape, dtype='int16')
+    xx = Datacube.load_data(sources, gbox, mm, out={'aa': dst})
+    assert np.shares_memory(xx.aa.values, dst)
+    np.testing.assert_array_equal(dst[0], aa)
+    np.testing.assert_array_equal(xx.bb.values[0], aa[::-1])
+
+    with pytest.raises(ValueError):
+        Datacube.load_data(sources, gbox, mm, out={'aa': dst[:, 1:]})
+
+    with pytest.raises(ValueError):
+        Datacube.load_data(sources, gbox, mm, out={'aa': dst.astype('float32')})
+
+    with pytest.raises(ValueError):
+        Datacube.load_data(sources, gbox, mm, out={'aa': dst}, dask_chunks={})
+
+    scratch = tmpdir/'scratch'
+    scratch.mkdir()
+    xx = Datacube.load_data(sources, gbox, mm, out=scratch)
+    np.testing.assert_array_equal(xx.aa.values[0], aa)
+    np.testing.assert_array_equal(xx.bb.values[0], aa[::-1])
+
+    files = sorted(scratch.glob('*.dat'))
+    assert [f.name.split('-')[0] for f in files] == ['aa', 'bb']
+    on_disk = np.memmap(str(files[0]), dtype='int16', mode='r', shape=(1,) + gbox.shape)
+    np.testing.assert_array_equal(on_disk, xx.aa.values)
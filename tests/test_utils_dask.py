@@ -21,6 +21,7 @@ from datacube.utils.dask import (
     save_blob_to_s3,
     _save_blob_to_file,
     _save_blob_to_s3,
+    DataLocalityPlugin,
 )
 
 from datacube.utils.aws import (
@@ -181,6 +182,46 @@ def test_save_blob_s3(blob, monkeypatch, dask_client):
         assert bb2 == blob2
 
 
+def test_data_locality_plugin():
+    from types import SimpleNamespace
+
+    workers = ['tcp://a:1', 'tcp://b:1', 'tcp://c:1']
+    uris = ['file:///data/{}.tif'.format(i) for i in range(30)]
+    placed = {u: DataLocalityPlugin.preferred_worker(u, workers) for u in uris}
+    assert set(placed.values()) == set(workers)
+    assert DataLocalityPlugin.preferred_worker(uris[0], []) is None
+
+    # removing a worker only moves files that were assigned to it
+    for u, w in placed.items():
+        if w != workers[-1]:
+            assert DataLocalityPlugin.preferred_worker(u, workers[:-1]) == w
+
+    def task(**kw):
+        return SimpleNamespace(**{'worker_restrictions': None, 'host_restrictions': None,
+                                  'loose_restrictions': False, **kw})
+
+    tasks = {'a': task(), 'b': task(), 'c': task(worker_restrictions={'tcp://b:1'}), 'd': task()}
+    scheduler = SimpleNamespace(workers={w: None for w in workers}, tasks=tasks)
+    plugin = DataLocalityPlugin()
+    plugin.update_graph(scheduler, annotations={'dc_uris': {'a': (uris[0],), 'b': (uris[0], uris[1]),
+                                                            'c': (uris[1],), 'd': (), 'x': (uris[2],)}})
+    assert plugin.n_placed == 2
+    assert tasks['a'].worker_restrictions == tasks['b'].worker_restrictions == {placed[uris[0]]}
+    assert tasks['a'].loose_restrictions is True
+    assert tasks['c'].worker_restrictions == {'tcp://b:1'}
+    assert tasks['d'].worker_restrictions is None
+
+    plugin.update_graph(scheduler, annotations={'other': {'d': 1}})
+    assert plugin.n_placed == 2
+
+    # scheduler is allowed to import datacube graph layers only once plugin is started
+    with dask.config.set({'distributed.scheduler.allowed-imports': ['dask', 'distributed']}):
+        DataLocalityPlugin(allow_import=False).start(scheduler)
+        assert dask.config.get('distributed.scheduler.allowed-imports') == ['dask', 'distributed']
+        plugin.start(scheduler)
+        assert dask.config.get('distributed.scheduler.allowed-imports') == ['dask', 'distributed', 'datacube']
+
+
 def test_memory_functions(monkeypatch):
     gig = 10**9
 
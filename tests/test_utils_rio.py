@@ -184,3 +184,87 @@ def test_rio_configure_aws_access(monkeypatch, without_aws_env, dask_client):
 
     ee = client.submit(get_rio_env, sanitize=False).result()
     assert ee == ee_local
+
+
+def test_rio_env_via_config_shared_session(monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from datacube.utils.rio import _rio
+
+    n_sessions = 0
+    mk_session = _rio._mk_session
+
+    def counting_mk_session(aws):
+        nonlocal n_sessions
+        n_sessions += 1
+        return mk_session(aws)
+
+    monkeypatch.setattr(_rio, '_mk_session', counting_mk_session)
+    set_default_rio_config(aws=dict(aws_unsigned=True, region_name='us-west-1'))
+
+    barrier = threading.Barrier(4)
+
+    def activate_twice():
+        barrier.wait()  # make sure every call runs on a different thread
+        ee = activate_from_config()
+        return ee, activate_from_config()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = [f.result() for f in [pool.submit(activate_twice) for _ in range(4)]]
+
+    # session is constructed once and shared by all threads, repeated calls do nothing
+    assert n_sessions == 1
+    assert all(ee['AWS_NO_SIGN_REQUEST'] == 'YES' and again is None for ee, again in results)
+
+    set_default_rio_config()
+    deactivate_rio_env()
+
+
+def test_rio_configure_aws_access_refresh(monkeypatch):
+    import threading
+    import time
+    from botocore.credentials import ReadOnlyCredentials
+    import datacube.utils.aws
+    from datacube.utils.rio import _rio
+
+    class FakeCreds:
+        def __init__(self):
+            self.n = 0
+            self.refreshed = threading.Event()
+
+        def _seconds_remaining(self):
+            return 0 if self.n == 0 else 3600
+
+        def get_frozen_credentials(self):
+            self.n += 1
+            self.refreshed.set()
+            return ReadOnlyCredentials('key-{}'.format(self.n), 'secret', None)
+
+    creds = FakeCreds()
+    aws = dict(region_name='us-west-1', aws_access_key_id='key-0', aws_secret_access_key='secret',
+               aws_session_token=None, requester_pays=False)
+    monkeypatch.setattr(datacube.utils.aws, 'get_aws_settings', lambda **kw: (aws, creds))
+    monkeypatch.setattr(_rio, 'MIN_REFRESH_DELAY', 0.1)
+
+    assert configure_s3_access() is creds
+    ee = activate_from_config()
+    assert get_rio_env(sanitize=False)['AWS_ACCESS_KEY_ID'] == 'key-0'
+
+    # credentials expire soon: refreshed in the background, threads re-activate with new ones
+    assert creds.refreshed.wait(10)
+    for _ in range(100):
+        ee = activate_from_config()
+        if ee is not None:
+            break
+        time.sleep(0.05)
+
+    assert get_rio_env(sanitize=False)['AWS_ACCESS_KEY_ID'] == 'key-1'
+    assert activate_from_config() is None
+
+    # new expiry is far away
+    assert _rio._REFRESH.interval == 3600 - _rio.REFRESH_AHEAD
+
+    # replacing configuration cancels pending refresh
+    set_default_rio_config()
+    assert _rio._REFRESH is None
+    deactivate_rio_env()